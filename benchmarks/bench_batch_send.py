@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Benchmark queueing messages through POST /api/messages versus /api/messages/batch.
+Usage: python benchmarks/bench_batch_send.py [--messages N] [--batch-size N]
+
+Runs the API in-process (no network) against a service with no peers, so the
+numbers measure the request, validation and enqueue path plus the time until
+the send workers have drained the queue.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+def wait_for_drain(service, timeout=60.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        stats = service.message_queue.get_stats()
+        if not stats["queue_size"] and not stats["in_flight"]:
+            return
+        time.sleep(0.005)
+
+
+def run(label, service, total, send):
+    started = time.perf_counter()
+    send()
+    queued = time.perf_counter() - started
+    wait_for_drain(service)
+    drained = time.perf_counter() - started
+    print(f"{label:<32} {total / queued:>12,.0f} msgs/sec queued {total / drained:>12,.0f} msgs/sec sent")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark batch message sends")
+    parser.add_argument("--messages", type=int, default=5000, help="Messages per run")
+    parser.add_argument("--batch-size", type=int, default=200, help="Messages per batch request")
+    parser.add_argument("--port", type=int, default=7690, help="Peer port for the temporary service")
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp())
+    os.environ.setdefault("PEER_PORT", str(args.port))
+    os.environ.setdefault("SEND_QUEUE_SIZE", str(args.messages * 2))
+    import logging
+    logging.disable(logging.WARNING)
+
+    from fastapi.testclient import TestClient
+    from src.backend.api import app
+    from src.backend.service import p2p_service
+
+    client = TestClient(app)
+    total = args.messages
+
+    def single():
+        for i in range(total):
+            client.post("/api/messages", json={"text": f"message {i}"})
+
+    def batched():
+        for start in range(0, total, args.batch_size):
+            items = [{"text": f"message {i}"} for i in range(start, min(start + args.batch_size, total))]
+            client.post("/api/messages/batch", json={"messages": items})
+
+    run("single POST /api/messages", p2p_service, total, single)
+    run(f"batch of {args.batch_size}", p2p_service, total, batched)
+    print(f"\nQueue: {p2p_service.message_queue.get_stats()['batches_sent']} coalesced sends")
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,8 @@ import {
   fetchPeers,
   fetchStatus,
   fetchFiles,
-  sendMessage
+  sendMessage,
+  subscribeEvents
 } from "./api";
 import "./App.css";
 import { StatusSummaryCard } from "./components/StatusSummaryCard";
@@ -15,10 +16,12 @@ import { MessageComposer } from "./components/MessageComposer";
 import { MessagePanel } from "./components/MessagePanel";
 import { FileUpload } from "./components/FileUpload";
 import { FileList } from "./components/FileList";
-import { MessageLogEntry, Peer, StatusSummary, FileInfo } from "./types";
+import { MessageLogEntry, Peer, StatusSummary, FileInfo, ServiceEvent } from "./types";
 
 const POLL_INTERVAL = 5_000;
 const FILE_POLL_INTERVAL = 2_000; // Fast polling for file transfers to show download button promptly
+const EVENT_POLL_INTERVAL = 60_000; // Safety-net polling while the push channel is connected
+const MESSAGE_LIMIT = 200;
 
 function usePolling<T>(callback: () => Promise<T>, deps: unknown[] = [], interval: number = POLL_INTERVAL) {
   const [data, setData] = useState<T | null>(null);
@@ -70,13 +73,32 @@ function usePolling<T>(callback: () => Promise<T>, deps: unknown[] = [], interva
     };
   }, [fetchData, interval]);
 
-  return { data, loading, refresh: fetchData, error };
+  // Apply an incremental change pushed by the server without refetching
+  const update = useCallback((change: (current: T | null) => T | null) => {
+    const next = change(dataRef.current);
+    dataRef.current = next;
+    setData(next);
+  }, []);
+
+  return { data, loading, refresh: fetchData, update, error };
+}
+
+function upsertBy<T extends object>(items: T[] | null, item: T, key: keyof T): T[] {
+  const list = items ?? [];
+  const index = list.findIndex((existing) => existing[key] === item[key]);
+  if (index === -1) {
+    return [item, ...list];
+  }
+  const next = [...list];
+  next[index] = { ...list[index], ...item };
+  return next;
 }
 
 export default function App() {
   const [selectedPeer, setSelectedPeer] = useState<string | null>(null);
   const [isConnecting, setIsConnecting] = useState(false);
   const [isSending, setIsSending] = useState(false);
+  const [eventsConnected, setEventsConnected] = useState(false);
 
   const {
     data: status,
@@ -89,22 +111,89 @@ export default function App() {
     data: peers,
     loading: peersLoading,
     refresh: refreshPeers,
+    update: updatePeers,
     error: peersError
-  } = usePolling<Peer[]>(fetchPeers, []);
+  } = usePolling<Peer[]>(fetchPeers, [], eventsConnected ? EVENT_POLL_INTERVAL : POLL_INTERVAL);
 
   const {
     data: messages,
     loading: messagesLoading,
     refresh: refreshMessages,
+    update: updateMessages,
     error: messagesError
-  } = usePolling<MessageLogEntry[]>(() => fetchMessages(200), []);
+  } = usePolling<MessageLogEntry[]>(
+    () => fetchMessages(MESSAGE_LIMIT),
+    [],
+    eventsConnected ? EVENT_POLL_INTERVAL : POLL_INTERVAL
+  );
 
   const {
     data: files,
     loading: filesLoading,
     refresh: refreshFiles,
+    update: updateFiles,
     error: filesError
-  } = usePolling<FileInfo[]>(() => fetchFiles(100), [], FILE_POLL_INTERVAL);
+  } = usePolling<FileInfo[]>(
+    () => fetchFiles(100),
+    [],
+    eventsConnected ? EVENT_POLL_INTERVAL : FILE_POLL_INTERVAL
+  );
+
+  const handleEvents = useCallback(
+    (events: ServiceEvent[]) => {
+      for (const event of events) {
+        switch (event.type) {
+          case "message":
+            updateMessages((current) =>
+              [event.data as unknown as MessageLogEntry, ...(current ?? [])].slice(0, MESSAGE_LIMIT)
+            );
+            break;
+          case "peer_status": {
+            const peer = event.data as unknown as Peer;
+            updatePeers((current) =>
+              peer.status === "removed"
+                ? (current ?? []).filter((existing) => existing.peer_id !== peer.peer_id)
+                : upsertBy(current, peer, "peer_id")
+            );
+            break;
+          }
+          case "file_registered":
+            updateFiles((current) => upsertBy(current, event.data as unknown as FileInfo, "file_id"));
+            break;
+          case "transfer_complete":
+            // Outgoing completions are ACKs from the receiver; only incoming ones carry file info
+            if (event.data.direction !== "outgoing") {
+              updateFiles((current) => upsertBy(current, event.data as unknown as FileInfo, "file_id"));
+            }
+            break;
+          case "chunk_progress":
+            if (event.data.direction === "incoming") {
+              updateFiles((current) =>
+                (current ?? []).map((file) =>
+                  file.file_id === event.data.file_id
+                    ? {
+                        ...file,
+                        chunks_received: event.data.chunks_received as number,
+                        total_chunks: event.data.total_chunks as number
+                      }
+                    : file
+                )
+              );
+            }
+            break;
+          case "file_deleted":
+            updateFiles((current) => (current ?? []).filter((file) => file.file_id !== event.data.file_id));
+            break;
+          case "resync":
+            void Promise.all([refreshPeers(), refreshMessages(), refreshFiles()]).catch(() => undefined);
+            break;
+        }
+      }
+    },
+    [updateMessages, updatePeers, updateFiles, refreshPeers, refreshMessages, refreshFiles]
+  );
+
+  useEffect(() => subscribeEvents(handleEvents, setEventsConnected), [handleEvents]);
 
   const handleConnect = useCallback(
     async (host: string, port: number) => {
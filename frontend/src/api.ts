@@ -1,4 +1,4 @@
-import { MessageLogEntry, Peer, StatusSummary, FileInfo } from "./types";
+import { MessageLogEntry, Peer, StatusSummary, FileInfo, ServiceEvent } from "./types";
 
 // Use relative path for API calls to leverage Vite proxy
 // In production, set VITE_API_BASE_URL environment variable
@@ -122,3 +122,85 @@ export async function deleteFile(fileId: string): Promise<void> {
   await handleResponse(response);
 }
 
+const EVENT_RECONNECT_MAX_DELAY = 30_000;
+
+function eventsUrl(protocol: "ws" | "http"): string {
+  const base = API_BASE || window.location.origin;
+  const url = new URL(`${base}/api/events`, window.location.href);
+  if (protocol === "ws") {
+    url.protocol = url.protocol === "https:" ? "wss:" : "ws:";
+  }
+  return url.toString();
+}
+
+/**
+ * Subscribe to the server's push channel. Uses a WebSocket, falling back to
+ * Server-Sent Events if the socket cannot be opened, and reconnects with
+ * backoff. Events arrive in coalesced batches. Returns an unsubscribe function.
+ */
+export function subscribeEvents(
+  onEvents: (events: ServiceEvent[]) => void,
+  onConnectionChange?: (connected: boolean) => void
+): () => void {
+  let closed = false;
+  let useSse = typeof WebSocket === "undefined";
+  let retryDelay = 1_000;
+  let retryTimer: number | undefined;
+  let close: () => void = () => undefined;
+
+  const handleBatch = (raw: string) => {
+    const events = (JSON.parse(raw) as ServiceEvent[]).filter((event) => event.type !== "heartbeat");
+    if (events.length > 0) {
+      onEvents(events);
+    }
+  };
+
+  const scheduleReconnect = () => {
+    onConnectionChange?.(false);
+    if (closed) return;
+    retryTimer = window.setTimeout(connect, retryDelay);
+    retryDelay = Math.min(retryDelay * 2, EVENT_RECONNECT_MAX_DELAY);
+  };
+
+  const handleOpen = () => {
+    retryDelay = 1_000;
+    onConnectionChange?.(true);
+  };
+
+  function connect() {
+    if (useSse) {
+      const source = new EventSource(eventsUrl("http"));
+      source.onopen = handleOpen;
+      source.onmessage = (message) => handleBatch(message.data);
+      source.onerror = () => {
+        source.close();
+        scheduleReconnect();
+      };
+      close = () => source.close();
+      return;
+    }
+
+    const socket = new WebSocket(eventsUrl("ws"));
+    let opened = false;
+    socket.onopen = () => {
+      opened = true;
+      handleOpen();
+    };
+    socket.onmessage = (message) => handleBatch(message.data);
+    socket.onclose = () => {
+      // A socket that never opened (e.g. blocked by a proxy) switches to SSE
+      if (!opened) {
+        useSse = true;
+      }
+      scheduleReconnect();
+    };
+    close = () => socket.close();
+  }
+
+  connect();
+  return () => {
+    closed = true;
+    window.clearTimeout(retryTimer);
+    close();
+  };
+}
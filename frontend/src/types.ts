@@ -9,6 +9,7 @@ export interface Peer {
 }
 
 export interface MessageLogEntry {
+  id?: number;
   direction: "incoming" | "outgoing";
   payload: Record<string, unknown>;
   sent_at?: string;
@@ -39,3 +40,20 @@ export interface FileInfo {
   total_chunks?: number;
 }
 
+
+export type ServiceEventType =
+  | "message"
+  | "message_status"
+  | "peer_status"
+  | "file_registered"
+  | "file_deleted"
+  | "chunk_progress"
+  | "transfer_complete"
+  | "resync"
+  | "heartbeat";
+
+export interface ServiceEvent {
+  type: ServiceEventType;
+  data: Record<string, unknown>;
+  ts?: number;
+}
@@ -1,14 +1,23 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, List, Optional
+import asyncio
+import json
 import mimetypes
 import os
 from pathlib import Path
 
 from src.backend.service import p2p_service
 from src.backend.file_manager import FileManager
+from src.backend.file_response import file_response, prefix_response
+from src.backend.swarm import STRATEGIES as SWARM_STRATEGIES
+
+# How long a send request may wait for room in a saturated send queue before getting a 429
+ENQUEUE_TIMEOUT = float(os.getenv("API_ENQUEUE_TIMEOUT", "1.0"))
+MAX_BATCH_MESSAGES = 1000
 
 
 class ConnectRequest(BaseModel):
@@ -21,9 +30,40 @@ class MessageRequest(BaseModel):
     text: str
 
 
+class MessageBatchRequest(BaseModel):
+    messages: List[MessageRequest]
+
+
+class RateLimitUpdate(BaseModel):
+    enabled: Optional[bool] = None
+    max_messages_per_minute: Optional[float] = None
+    max_bytes_per_minute: Optional[float] = None
+    max_connections_per_minute: Optional[float] = None
+    burst_seconds: Optional[float] = None
+
+
+class BandwidthLimitUpdate(BaseModel):
+    # Bytes per second; 0 = unlimited
+    global_rate: Optional[float] = None
+    peer_rate: Optional[float] = None
+    class_rates: Optional[Dict[str, float]] = None  # "message" and/or "bulk"
+    peer_rates: Optional[Dict[str, Optional[float]]] = None  # null removes a peer's override
+    burst_seconds: Optional[float] = None
+
+
 class FileSendRequest(BaseModel):
     recipient_id: Optional[str] = None  # None means broadcast
     file_id: str
+    priority: int = 5  # 1 (highest) to 10 (lowest)
+
+
+class SwarmDownloadRequest(BaseModel):
+    strategy: str = "rarest"  # or "fastest"
+    priority: int = 5
+
+
+class TransferUpdate(BaseModel):
+    priority: int
 
 
 app = FastAPI(title="P2P Messaging API", version="1.0.0")
@@ -43,6 +83,97 @@ def get_status():
     return p2p_service.get_status()
 
 
+@app.get("/api/limits/rate")
+def get_rate_limits():
+    return p2p_service.get_rate_limits()
+
+
+@app.put("/api/limits/rate")
+def update_rate_limits(request: RateLimitUpdate):
+    try:
+        return p2p_service.update_rate_limits(**request.dict(exclude_none=True))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/api/limits/bandwidth")
+def get_bandwidth_limits():
+    return p2p_service.get_bandwidth_limits()
+
+
+@app.put("/api/limits/bandwidth")
+def update_bandwidth_limits(request: BandwidthLimitUpdate):
+    try:
+        # exclude_unset rather than exclude_none: a null in peer_rates removes that override
+        return p2p_service.update_bandwidth_limits(**request.dict(exclude_unset=True))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+# Seconds without events before a heartbeat is sent (keeps proxies and dead-client detection happy)
+EVENT_HEARTBEAT_SECONDS = 15
+
+
+def _subscribe_events(types: Optional[str]):
+    """Subscribe to service events, waking the current event loop when some are pending"""
+    loop = asyncio.get_running_loop()
+    ready = asyncio.Event()
+    event_types = [t for t in types.split(",") if t] if types else None
+    subscription = p2p_service.events.subscribe(lambda: loop.call_soon_threadsafe(ready.set), event_types)
+    return subscription, ready
+
+
+async def _next_events(subscription, ready: asyncio.Event) -> list:
+    """Wait for the next batch of coalesced events ([] means heartbeat)"""
+    try:
+        await asyncio.wait_for(ready.wait(), timeout=EVENT_HEARTBEAT_SECONDS)
+    except asyncio.TimeoutError:
+        return []
+    # Clear before draining so an event published in between re-arms the wakeup
+    ready.clear()
+    return subscription.drain()
+
+
+@app.websocket("/api/events")
+async def events_websocket(websocket: WebSocket, types: Optional[str] = None):
+    """Push service events as JSON arrays, one array per batch.
+
+    While a send is in flight, new events collect in the client's bounded,
+    coalescing buffer, so a slow client receives fewer, more up-to-date
+    events (or a ``resync``) and never slows the service down.
+    """
+    await websocket.accept()
+    subscription, ready = _subscribe_events(types)
+    try:
+        while True:
+            events = await _next_events(subscription, ready)
+            await websocket.send_json(events or [{"type": "heartbeat"}])
+    except WebSocketDisconnect:
+        pass
+    finally:
+        p2p_service.events.unsubscribe(subscription)
+
+
+@app.get("/api/events")
+async def events_stream(request: Request, types: Optional[str] = None):
+    """Server-Sent Events fallback for clients that cannot use WebSockets"""
+    subscription, ready = _subscribe_events(types)
+
+    async def stream():
+        try:
+            while not await request.is_disconnected():
+                events = await _next_events(subscription, ready)
+                if events:
+                    yield f"data: {json.dumps(events)}\n\n"
+                else:
+                    yield ": heartbeat\n\n"
+        finally:
+            p2p_service.events.unsubscribe(subscription)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+
 @app.get("/api/peers")
 def get_peers():
     return {"peers": p2p_service.list_peers()}
@@ -61,36 +192,85 @@ def connect_peer(request: ConnectRequest):
     return {"status": "connected"}
 
 
+def _queue_full() -> HTTPException:
+    """429 telling the client when the send queue is expected to have room again"""
+    retry_after = max(1, p2p_service.message_queue.retry_after())
+    return HTTPException(status_code=429, detail="Send queue is full, retry later",
+                         headers={"Retry-After": str(retry_after)})
+
+
 @app.post("/api/messages")
 def create_message(request: MessageRequest):
     if request.recipient_id:
-        success = p2p_service.send_text_message(request.recipient_id, request.text)
+        success = p2p_service.send_text_message(request.recipient_id, request.text, timeout=ENQUEUE_TIMEOUT)
     else:
-        success = p2p_service.broadcast_text_message(request.text)
+        success = p2p_service.broadcast_text_message(request.text, timeout=ENQUEUE_TIMEOUT)
 
     if not success:
-        raise HTTPException(status_code=400, detail="Failed to queue message")
+        raise _queue_full()
     return {"status": "queued"}
 
 
+@app.post("/api/messages/batch")
+def create_messages(request: MessageBatchRequest, response: Response):
+    """Queue many messages in one request; each item gets its own message ID.
+
+    Items the send queue has no room for are marked "rejected" and a
+    Retry-After header is set; if none fit at all the answer is a 429.
+    """
+    if not request.messages:
+        raise HTTPException(status_code=400, detail="No messages given")
+    if len(request.messages) > MAX_BATCH_MESSAGES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_MESSAGES} messages per batch")
+
+    message_ids = p2p_service.send_text_messages(
+        [(item.recipient_id, item.text) for item in request.messages], timeout=ENQUEUE_TIMEOUT
+    )
+    queued = sum(1 for message_id in message_ids if message_id)
+    if not queued:
+        raise _queue_full()
+    if queued < len(message_ids):
+        response.headers["Retry-After"] = str(max(1, p2p_service.message_queue.retry_after()))
+    return {
+        "status": "queued" if queued == len(message_ids) else "partial",
+        "queued": queued,
+        "rejected": len(message_ids) - queued,
+        "messages": [{"message_id": message_id, "status": "queued" if message_id else "rejected"}
+                     for message_id in message_ids]
+    }
+
+
 @app.get("/api/messages")
-def list_messages(limit: int = 100):
+def list_messages(limit: int = 100, before: Optional[int] = None, after: Optional[int] = None,
+                  peer_id: Optional[str] = None, message_type: Optional[str] = None,
+                  since: Optional[float] = None, until: Optional[float] = None):
+    """Page through stored messages, newest first.
+
+    Pass the ``next_before`` value from one page as ``before`` to fetch older
+    messages, or a previously seen ``id`` as ``after`` to fetch newer ones.
+    """
     limit = max(1, min(limit, 500))
-    return {"messages": p2p_service.get_messages(limit=limit)}
+    messages = p2p_service.get_messages(limit=limit, before=before, after=after, peer_id=peer_id,
+                                        message_type=message_type, since=since, until=until)
+    ids = [message["id"] for message in messages if "id" in message]
+    return {
+        "messages": messages,
+        "next_before": min(ids) if ids else None,
+        "next_after": max(ids) if ids else after
+    }
 
 
 @app.post("/api/files/upload")
 async def upload_file(file: UploadFile = File(...), folder_path: str = Form(None)):
     """Upload a file to the local storage"""
     try:
-        file_data = await file.read()
         filename = file.filename or "unnamed"
         mime_type = file.content_type or mimetypes.guess_type(filename)[0] or "application/octet-stream"
         
-        # Save file locally
+        # Save file locally, streaming it to disk in a worker thread
         file_id = FileManager.generate_file_id(filename, p2p_service.identity.peer_id)
-        success = p2p_service.file_manager.save_file(
-            file_id, file_data, filename, mime_type, 
+        success = await run_in_threadpool(
+            p2p_service.file_manager.store_stream, file.file, file_id, filename, mime_type,
             p2p_service.identity.peer_id, None, folder_path
         )
         
@@ -104,34 +284,28 @@ async def upload_file(file: UploadFile = File(...), folder_path: str = Form(None
 
 
 @app.post("/api/files/send")
-async def send_file(request: FileSendRequest):
-    """Send a file to a peer or broadcast to all peers (if recipient_id is None)"""
+def send_file(request: FileSendRequest):
+    """Send a file to a peer or broadcast to all peers (if recipient_id is None)
+
+    The transfer runs in the background; follow it with /api/transfers/{transfer_id}.
+    """
     file_info = p2p_service.get_file_info(request.file_id)
     if not file_info:
         raise HTTPException(status_code=404, detail="File not found")
     
-    file_data = p2p_service.get_file(request.file_id)
-    if not file_data:
+    # Stream the file from disk rather than reading it into memory
+    stored_file = p2p_service.file_manager.get_stored_file(request.file_id)
+    if not stored_file:
         raise HTTPException(status_code=404, detail="File data not found")
     
-    if request.recipient_id:
-        success = p2p_service.send_file(
-            request.recipient_id,
-            file_data,
-            file_info["filename"],
-            file_info.get("mime_type", "application/octet-stream")
-        )
-    else:
-        success = p2p_service.broadcast_file(
-            file_data,
-            file_info["filename"],
-            file_info.get("mime_type", "application/octet-stream")
-        )
-    
-    if not success:
-        raise HTTPException(status_code=400, detail="Failed to send file")
-    
-    return {"status": "sent", "file_id": request.file_id}
+    job = p2p_service.queue_file_send(
+        request.recipient_id,
+        stored_file,
+        file_info["filename"],
+        file_info.get("mime_type", "application/octet-stream"),
+        request.priority
+    )
+    return {"status": job.state, "file_id": request.file_id, "transfer_id": job.transfer_id}
 
 
 @app.post("/api/files/send-direct")
@@ -139,6 +313,7 @@ async def send_file_direct(
     recipient_id: str = Form(None),
     broadcast: str = Form("false"),
     folder_path: str = Form(None),
+    priority: int = Form(5),
     file: UploadFile = File(...)
 ):
     """Upload and send a file directly to a peer or broadcast to all peers"""
@@ -147,18 +322,15 @@ async def send_file_direct(
     logger = logging.getLogger("api")
     
     try:
-        file_data = await file.read()
         filename = file.filename or "unnamed"
         mime_type = file.content_type or mimetypes.guess_type(filename)[0] or "application/octet-stream"
         
-        logger.info(f"Received file: {filename}, size: {len(file_data)} bytes, mime_type: {mime_type}")
-        
         is_broadcast = broadcast.lower() == "true"
         
-        # Save file locally first with folder path if provided
+        # Save file locally first with folder path if provided, streaming it to disk in a worker thread
         file_id = FileManager.generate_file_id(filename, p2p_service.identity.peer_id)
-        success = p2p_service.file_manager.save_file(
-            file_id, file_data, filename, mime_type, 
+        success = await run_in_threadpool(
+            p2p_service.file_manager.store_stream, file.file, file_id, filename, mime_type,
             p2p_service.identity.peer_id, None, folder_path
         )
         
@@ -166,30 +338,78 @@ async def send_file_direct(
             logger.error(f"Failed to save file locally: {filename}")
             raise HTTPException(status_code=500, detail="Failed to save file locally")
         
-        logger.info(f"File saved locally: {filename} (ID: {file_id})")
-        
-        if is_broadcast:
-            logger.info(f"Broadcasting file: {filename}")
-            success = p2p_service.broadcast_file(file_data, filename, mime_type)
-        else:
-            if not recipient_id:
-                logger.error("recipient_id is required when not broadcasting")
-                raise HTTPException(status_code=400, detail="recipient_id is required when not broadcasting")
-            logger.info(f"Sending file to peer {recipient_id}: {filename}")
-            success = p2p_service.send_file(recipient_id, file_data, filename, mime_type)
-        
-        if not success:
-            logger.error(f"Failed to send file: {filename}")
-            raise HTTPException(status_code=400, detail="Failed to send file")
+        file_info = p2p_service.file_manager.get_file_info(file_id)
+        logger.info(f"File saved locally: {filename} (ID: {file_id}), size: {file_info['file_size']} bytes, mime_type: {mime_type}")
+        # Send from the saved copy on disk
+        stored_file = p2p_service.file_manager.get_stored_file(file_id)
         
-        logger.info(f"File sent successfully: {filename}")
-        return {"status": "sent", "filename": filename, "broadcast": is_broadcast, "file_id": file_id}
+        if not is_broadcast and not recipient_id:
+            logger.error("recipient_id is required when not broadcasting")
+            raise HTTPException(status_code=400, detail="recipient_id is required when not broadcasting")
+        job = p2p_service.queue_file_send(None if is_broadcast else recipient_id, stored_file, filename,
+                                          mime_type, priority)
+        logger.info(f"Queued {'broadcast' if is_broadcast else f'send to peer {recipient_id}'} of {filename} "
+                    f"as transfer {job.transfer_id}")
+        return {"status": job.state, "filename": filename, "broadcast": is_broadcast, "file_id": file_id,
+                "transfer_id": job.transfer_id}
     except Exception as e:
         import traceback
         logger.error(f"Error in send_file_direct: {str(e)}\n{traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/files/{file_id}/swarm")
+def swarm_download(file_id: str, request: SwarmDownloadRequest):
+    """Download a file that other peers hold, fetching chunks from all of them in parallel
+
+    The download runs in the background; follow it with /api/transfers/{transfer_id}.
+    """
+    if request.strategy not in SWARM_STRATEGIES:
+        raise HTTPException(status_code=400, detail=f"strategy must be one of {', '.join(SWARM_STRATEGIES)}")
+    job = p2p_service.queue_swarm_download(file_id, request.strategy, request.priority)
+    return {"status": job.state, "file_id": file_id, "transfer_id": job.transfer_id}
+
+
+@app.get("/api/transfers")
+def list_transfers(state: Optional[str] = None):
+    """Background transfers, newest first, with bytes done, rate (bytes/s) and ETA (s)"""
+    return {"transfers": p2p_service.transfers.list_jobs(state), "stats": p2p_service.transfers.get_stats()}
+
+
+def _get_transfer(transfer_id: str):
+    job = p2p_service.transfers.get_job(transfer_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Transfer not found")
+    return job
+
+
+@app.get("/api/transfers/{transfer_id}")
+def get_transfer(transfer_id: str):
+    return _get_transfer(transfer_id).to_dict()
+
+
+@app.patch("/api/transfers/{transfer_id}")
+def update_transfer(transfer_id: str, request: TransferUpdate):
+    """Change a transfer's priority (1=highest, 10=lowest); it applies the next time it waits for a slot"""
+    _get_transfer(transfer_id)
+    if not p2p_service.transfers.set_priority(transfer_id, request.priority):
+        raise HTTPException(status_code=409, detail="Transfer has already finished")
+    return _get_transfer(transfer_id).to_dict()
+
+
+@app.post("/api/transfers/{transfer_id}/{action}")
+def control_transfer(transfer_id: str, action: str):
+    """Pause, resume or cancel a transfer"""
+    actions = {"pause": p2p_service.transfers.pause, "resume": p2p_service.transfers.resume,
+               "cancel": p2p_service.transfers.cancel}
+    if action not in actions:
+        raise HTTPException(status_code=404, detail=f"Unknown action {action}")
+    job = _get_transfer(transfer_id)
+    if not actions[action](transfer_id):
+        raise HTTPException(status_code=409, detail=f"Cannot {action} a transfer that is {job.state}")
+    return job.to_dict()
+
+
 @app.get("/api/files")
 def list_files(limit: int = 100):
     """List all files"""
@@ -198,8 +418,8 @@ def list_files(limit: int = 100):
 
 
 @app.get("/api/files/{file_id}")
-def download_file(file_id: str):
-    """Download a file"""
+def download_file(file_id: str, request: Request):
+    """Download a file (supports Range requests and conditional GETs)"""
     file_info = p2p_service.get_file_info(file_id)
     if not file_info:
         raise HTTPException(status_code=404, detail="File not found")
@@ -208,20 +428,14 @@ def download_file(file_id: str):
     if file_info.get("status") != "completed":
         raise HTTPException(status_code=400, detail=f"File transfer is {file_info.get('status', 'incomplete')}")
     
-    file_data = p2p_service.get_file(file_id)
-    if not file_data:
+    stored_file = p2p_service.file_manager.get_stored_file(file_id)
+    if not stored_file:
         raise HTTPException(status_code=404, detail="File data not found")
     
     filename = file_info.get("filename", "file")
     mime_type = file_info.get("mime_type", "application/octet-stream")
     
-    return Response(
-        content=file_data,
-        media_type=mime_type,
-        headers={
-            "Content-Disposition": f'attachment; filename="{filename}"'
-        }
-    )
+    return file_response(request, stored_file, mime_type, filename, "attachment", etag=file_info.get("sha256"))
 
 
 @app.get("/api/files/{file_id}/info")
@@ -261,8 +475,11 @@ def options_file(file_id: str):
 
 
 @app.get("/api/files/{file_id}/preview")
-def preview_file(file_id: str):
-    """Preview a file (for images, text files, videos, etc.)"""
+def preview_file(file_id: str, request: Request):
+    """Preview a file (for images, text files, videos, etc.)
+
+    Completed files support Range requests, so videos can seek.
+    """
     file_info = p2p_service.get_file_info(file_id)
     if not file_info:
         raise HTTPException(status_code=404, detail="File not found")
@@ -275,51 +492,32 @@ def preview_file(file_id: str):
     if mime_type.startswith("image/") or mime_type.startswith("video/"):
         # Check if file is being transferred
         if file_info.get("status") == "receiving":
-            # Return partial content if available
-            file_data = p2p_service.file_manager.get_partial_file(file_id)
-            if file_data:
-                return Response(
-                    content=file_data, 
-                    media_type=mime_type,
-                    headers={
-                        "Content-Disposition": f'inline; filename="{filename}"',
-                        "X-Transfer-Status": "receiving"
-                    }
-                )
-        elif file_info.get("status") == "completed":
-            file_data = p2p_service.get_file(file_id)
-            if not file_data:
-                raise HTTPException(status_code=404, detail="File data not found")
-            return Response(
-                content=file_data, 
-                media_type=mime_type,
-                headers={"Content-Disposition": f'inline; filename="{filename}"'}
-            )
+            # Stream the prefix received so far, with Range support, straight from the .part file
+            prefix = p2p_service.file_manager.get_partial_prefix(file_id)
+            if prefix:
+                part_path, length = prefix
+                return prefix_response(request, part_path, length, mime_type, headers={
+                    "Content-Disposition": f'inline; filename="{filename}"',
+                    "X-Transfer-Status": "receiving"
+                })
     
     # For completed files only
     if file_info.get("status") != "completed":
         raise HTTPException(status_code=400, detail=f"File transfer is {file_info.get('status', 'incomplete')}")
     
-    file_data = p2p_service.get_file(file_id)
-    if not file_data:
+    stored_file = p2p_service.file_manager.get_stored_file(file_id)
+    if not stored_file:
         raise HTTPException(status_code=404, detail="File data not found")
     
-    # For text files, return as text
-    if mime_type.startswith("text/"):
-        try:
-            text_content = file_data.decode('utf-8')
-            return Response(content=text_content, media_type=mime_type)
-        except:
-            pass
-    
-    # For other files, return as download
-    return Response(
-        content=file_data,
-        media_type=mime_type,
-        headers={
-            "Content-Disposition": f'attachment; filename="{filename}"'
-        }
-    )
+    if mime_type.startswith("image/") or mime_type.startswith("video/"):
+        disposition = "inline"
+    elif mime_type.startswith("text/"):
+        # Text is shown as-is in the browser
+        disposition = None
+    else:
+        # For other files, return as download
+        disposition = "attachment"
+    return file_response(request, stored_file, mime_type, filename, disposition, etag=file_info.get("sha256"))
 
 
 @app.on_event("shutdown")
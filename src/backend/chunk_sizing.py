@@ -0,0 +1,122 @@
+import threading
+import time
+from typing import Any, Dict, Optional
+
+MAX_CHUNK_SIZE = 512 * 1024  # largest span one chunk message carries (fits a 1MB frame after base64 and proofs)
+MIN_FRAME_SECONDS = 0.01  # a span should take at least this long to send, so per-message overhead stays small...
+MAX_FRAME_SECONDS = 0.1  # ...and at most this long, so control and chat frames are not stuck behind it
+ADAPT_SPANS = 4  # spans sent between two size adjustments
+GOODPUT_WEIGHT = 0.5  # weight of the newest window in the goodput average
+RTT_MAX_AGE = 60.0  # seconds an RTT sample is trusted before the peer is pinged again
+MAX_TRACKED_PEERS = 1024
+
+
+def span_limit(chunk_size: int, max_message_size: int) -> int:
+    """The largest span (a whole number of chunks) that fits in one message of ``max_message_size``"""
+    # base64 grows data by 4/3; a quarter of the frame stays free for the envelope and Merkle proofs
+    fits = min(MAX_CHUNK_SIZE, max_message_size * 3 // 4 - max_message_size // 4)
+    return max(chunk_size, fits // chunk_size * chunk_size)
+
+
+class ChunkSizer:
+    """Picks the span size of one outgoing transfer from the goodput it achieves.
+
+    A span is a run of consecutive chunks sent in one message. Each span
+    should take about one RTT to send (within ``MIN_FRAME_SECONDS`` and
+    ``MAX_FRAME_SECONDS``): on a fast LAN that makes spans large, so the
+    per-message cost of encoding, signing and verifying is spread over more
+    data; on a slow or lossy link the goodput drops and spans shrink, so
+    less is lost with a broken connection and other traffic interleaves
+    sooner. After every ``ADAPT_SPANS`` spans the size moves towards
+    ``goodput * frame time``, at most doubling or halving in one step.
+    """
+
+    def __init__(self, chunk_size: int, max_size: int, rtt: Optional[float] = None,
+                 goodput: Optional[float] = None):
+        self.chunk_size = chunk_size
+        self.max_size = max(chunk_size, max_size // chunk_size * chunk_size)
+        self.frame_seconds = min(MAX_FRAME_SECONDS, max(MIN_FRAME_SECONDS, rtt or 0.0))
+        self.goodput = goodput  # bytes per second, smoothed
+        self.size = self._target() if goodput else chunk_size
+        self.window_bytes = 0
+        self.window_seconds = 0.0
+        self.window_spans = 0
+        self.adjustments = 0
+
+    def _clamp(self, size: float) -> int:
+        return int(min(self.max_size, max(self.chunk_size, size // self.chunk_size * self.chunk_size)))
+
+    def _target(self) -> int:
+        return self._clamp(self.goodput * self.frame_seconds)
+
+    def chunks(self) -> int:
+        """Chunks to put in the next span"""
+        return self.size // self.chunk_size
+
+    def record(self, num_bytes: int, seconds: float):
+        """Account for one span: ``num_bytes`` of file data that took ``seconds`` to read, encode and send"""
+        self.window_bytes += num_bytes
+        self.window_seconds += seconds
+        self.window_spans += 1
+        if self.window_spans < ADAPT_SPANS or self.window_seconds <= 0:
+            return
+        measured = self.window_bytes / self.window_seconds
+        self.goodput = measured if self.goodput is None else \
+            GOODPUT_WEIGHT * measured + (1 - GOODPUT_WEIGHT) * self.goodput
+        size = self._clamp(min(self.size * 2, max(self.size / 2, self._target())))
+        if size != self.size:
+            self.adjustments += 1
+            self.size = size
+        self.window_bytes, self.window_seconds, self.window_spans = 0, 0.0, 0
+
+
+class LinkStats:
+    """Per-peer RTT and transfer goodput, used to size the next transfer's spans"""
+
+    def __init__(self):
+        self.peers: Dict[str, Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+
+    def _entry(self, peer_id: str) -> Dict[str, Any]:
+        entry = self.peers.get(peer_id)
+        if entry is None:
+            if len(self.peers) >= MAX_TRACKED_PEERS:
+                # Forget the peer seen longest ago
+                del self.peers[min(self.peers, key=lambda pid: self.peers[pid]["updated_at"])]
+            entry = self.peers[peer_id] = {"rtt": None, "rtt_at": 0.0, "goodput": None, "updated_at": 0.0}
+        entry["updated_at"] = time.time()
+        return entry
+
+    def record_rtt(self, peer_id: str, seconds: float):
+        with self.lock:
+            entry = self._entry(peer_id)
+            entry["rtt"], entry["rtt_at"] = seconds, time.time()
+
+    def rtt(self, peer_id: str, max_age: float = RTT_MAX_AGE) -> Optional[float]:
+        """The peer's last RTT sample, or None if there is none younger than ``max_age``"""
+        with self.lock:
+            entry = self.peers.get(peer_id)
+            if entry is None or entry["rtt"] is None or time.time() - entry["rtt_at"] > max_age:
+                return None
+            return entry["rtt"]
+
+    def record_goodput(self, peer_id: str, goodput: Optional[float]):
+        if not goodput:
+            return
+        with self.lock:
+            self._entry(peer_id)["goodput"] = goodput
+
+    def goodput(self, peer_id: str) -> Optional[float]:
+        with self.lock:
+            entry = self.peers.get(peer_id)
+            return entry["goodput"] if entry else None
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        with self.lock:
+            return {
+                peer_id: {
+                    "rtt_ms": round(entry["rtt"] * 1000, 2) if entry["rtt"] is not None else None,
+                    "goodput": round(entry["goodput"]) if entry["goodput"] else None
+                }
+                for peer_id, entry in self.peers.items()
+            }
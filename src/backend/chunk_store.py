@@ -0,0 +1,368 @@
+import bisect
+import hashlib
+import io
+import os
+import threading
+import uuid
+import logging
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # optional: without numpy, chunking hashes byte by byte (several times slower)
+    np = None
+
+logger = logging.getLogger("ChunkStore")
+
+# Content-defined chunk sizes; every peer must use the same values to find the same chunks
+MIN_CHUNK_SIZE = 16 * 1024
+AVG_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 256 * 1024
+READ_SIZE = 4 * 1024 * 1024  # bytes read per call while chunking a stream
+HASH_BLOCK = 32 * 1024  # bytes hashed per vectorized step; small enough for its arrays to stay in cache
+
+# A manifest lists a file's chunks in order as [sha256 hex digest, size]
+Manifest = List[List[Any]]
+
+# The gear table and masks are derived from SHA-256 rather than a seeded PRNG so
+# they are identical on every platform and Python version. The hash is kept to
+# 30 bits, which CPython handles as a single-digit int; the window is 30 bytes.
+_HASH_BITS = 30
+_HASH_MASK = (1 << _HASH_BITS) - 1
+_GEAR = [int.from_bytes(hashlib.sha256(b"gear%d" % i).digest()[:4], "big") & _HASH_MASK for i in range(256)]
+_GEAR_ARRAY = np.array(_GEAR, dtype=np.uint32) if np is not None else None
+
+
+def _spread_mask(bits: int) -> int:
+    """A mask of ``bits`` one-bits scattered over the hash (FastCDC avoids adjacent bits)"""
+    positions = sorted(range(_HASH_BITS), key=lambda p: hashlib.sha256(b"mask%d" % p).digest())[:bits]
+    return sum(1 << p for p in positions)
+
+
+# Normalized chunking: harder to cut before the average size, easier after it,
+# which narrows the size distribution around AVG_CHUNK_SIZE (2^16)
+_MASK_STRICT = _spread_mask(18)
+_MASK_LOOSE = _spread_mask(14)
+
+
+def _cut_point(data: memoryview, length: int) -> int:
+    """Length of the next chunk at the start of ``data`` (FastCDC)"""
+    if length <= MIN_CHUNK_SIZE:
+        return length
+    if length > MAX_CHUNK_SIZE:
+        length = MAX_CHUNK_SIZE
+    normal = min(AVG_CHUNK_SIZE, length)
+    h = 0
+    gear = _GEAR
+    # Cut points below the minimum size are never taken, so those bytes are skipped
+    for i, byte in enumerate(data[MIN_CHUNK_SIZE:normal], MIN_CHUNK_SIZE + 1):
+        h = ((h << 1) + gear[byte]) & _HASH_MASK
+        if not h & _MASK_STRICT:
+            return i
+    for i, byte in enumerate(data[normal:length], normal + 1):
+        h = ((h << 1) + gear[byte]) & _HASH_MASK
+        if not h & _MASK_LOOSE:
+            return i
+    return length
+
+
+def _gear_hits(buffer: bytes) -> Tuple[Any, Any]:
+    """Offsets in ``buffer`` where the gear hash of the 30 bytes ending there passes
+    the strict and the loose mask, computed with numpy instead of byte by byte.
+
+    Bits shifted past the 30-bit hash are dropped, so the hash at offset i is
+    ``sum(gear[b[i - k]] << k for k < 30)``; that sum is built by doubling
+    the window (1, 2, 4, 8, 16 bytes) with whole-array shifts and adds. It
+    is computed in uint32, whose wrap-around keeps the low 30 bits exact.
+    """
+    strict, loose = [], []
+    window = _HASH_BITS - 1
+    for start in range(0, len(buffer), HASH_BLOCK):
+        # Each block also hashes the 29 bytes before it, whose results are discarded
+        begin = max(0, start - window)
+        g = _GEAR_ARRAY[np.frombuffer(buffer, dtype=np.uint8, count=min(len(buffer), start + HASH_BLOCK) - begin,
+                                      offset=begin)]
+        spans = {1: g}
+        for width in (2, 4, 8, 16):
+            half = spans[width // 2]
+            doubled = half.copy()
+            doubled[width // 2:] += half[:-(width // 2)] << np.uint32(width // 2)
+            spans[width] = doubled
+        h = spans[16]
+        for shift, width in ((16, 8), (24, 4), (28, 2)):
+            h[shift:] += spans[width][:-shift] << np.uint32(shift)
+        h = h[start - begin:]
+        strict.append(np.flatnonzero((h & np.uint32(_MASK_STRICT)) == 0) + start)
+        loose.append(np.flatnonzero((h & np.uint32(_MASK_LOOSE)) == 0) + start)
+    if not strict:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(strict), np.concatenate(loose)
+
+
+def _cut_point_from_hits(data: memoryview, position: int, length: int, strict: Any, loose: Any) -> int:
+    """``_cut_point`` for the chunk at ``position`` of a buffer, using ``_gear_hits`` of that buffer"""
+    if length <= MIN_CHUNK_SIZE:
+        return length
+    if length > MAX_CHUNK_SIZE:
+        length = MAX_CHUNK_SIZE
+    normal = min(AVG_CHUNK_SIZE, length)
+    # The chunk's hash starts from zero at MIN_CHUNK_SIZE, so for its first 29 bytes it
+    # differs from the windowed hash (which also covers earlier bytes): do those directly
+    h = 0
+    exact_end = min(MIN_CHUNK_SIZE + _HASH_BITS - 1, length)
+    for i in range(MIN_CHUNK_SIZE, exact_end):
+        h = ((h << 1) + _GEAR[data[position + i]]) & _HASH_MASK
+        if not h & (_MASK_STRICT if i < normal else _MASK_LOOSE):
+            return i + 1
+    for hits, first, last in ((strict, exact_end, normal), (loose, max(exact_end, normal), length)):
+        if first >= last:
+            continue
+        index = int(np.searchsorted(hits, position + first))
+        if index < len(hits) and hits[index] < position + last:
+            return int(hits[index]) - position + 1
+    return length
+
+
+def cdc_chunks(f: BinaryIO) -> Iterator[bytes]:
+    """Split a stream into content-defined chunks.
+
+    Boundaries depend only on the bytes around them, so an insertion or
+    deletion changes the chunks near the edit and not the ones after it.
+    With numpy installed the rolling hash is vectorized; the cut points are
+    the same either way.
+    """
+    buffer = b""
+    eof = False
+    while True:
+        if not eof and len(buffer) < MAX_CHUNK_SIZE:
+            block = f.read(READ_SIZE)
+            if block:
+                buffer += block
+                continue
+            eof = True
+        if not buffer:
+            return
+        view = memoryview(buffer)
+        hits = _gear_hits(buffer) if np is not None else None
+        position = 0
+        while len(buffer) - position >= MAX_CHUNK_SIZE or (eof and position < len(buffer)):
+            if hits is None:
+                cut = _cut_point(view[position:], len(buffer) - position)
+            else:
+                cut = _cut_point_from_hits(view, position, len(buffer) - position, *hits)
+            yield bytes(view[position:position + cut])
+            position += cut
+        view.release()
+        buffer = buffer[position:]
+
+
+def split_chunks(f: BinaryIO, sizes: Iterable[int]) -> Iterator[bytes]:
+    """Split a stream at known chunk sizes (e.g. the sender's manifest), without re-chunking"""
+    for size in sizes:
+        chunk = f.read(size)
+        if len(chunk) != size:
+            raise IOError(f"File ended inside a {size} byte chunk")
+        yield chunk
+
+
+def valid_manifest(manifest: Any, file_size: int) -> bool:
+    """Whether a peer-supplied manifest is well-formed and adds up to ``file_size``"""
+    if not isinstance(manifest, list):
+        return False
+    total = 0
+    for entry in manifest:
+        if not (isinstance(entry, list) and len(entry) == 2 and ChunkStore.is_digest(entry[0])
+                and isinstance(entry[1], int) and not isinstance(entry[1], bool)
+                and 0 < entry[1] <= MAX_CHUNK_SIZE):
+            return False
+        total += entry[1]
+    return total == file_size
+
+
+class ChunkStore:
+    """Content-addressed chunk storage: each chunk is a file named by its SHA-256.
+
+    Chunks are reference counted by the manifests that use them and deleted
+    when the last one is released. The counts live in memory only; the
+    owner rebuilds them from its manifests at startup and then calls
+    ``collect_garbage`` to remove chunks that nothing references (left
+    behind by a crash part-way through storing a file).
+    """
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.refs: Dict[str, int] = {}
+        self.sizes: Dict[str, int] = {}  # size of every referenced chunk
+        self.stored_bytes = 0  # unique bytes on disk
+        self.logical_bytes = 0  # bytes of all files stored as manifests
+        self.lock = threading.Lock()
+        self.stats = {"chunks_written": 0, "chunks_deduplicated": 0, "chunks_deleted": 0}
+
+    @staticmethod
+    def is_digest(value: Any) -> bool:
+        if not isinstance(value, str) or len(value) != 64:
+            return False
+        try:
+            int(value, 16)
+        except ValueError:
+            return False
+        return True
+
+    def _path(self, digest: str) -> Path:
+        return self.directory / digest[:2] / digest
+
+    def _ref(self, digest: str, size: int) -> bool:
+        """Count one more reference (caller holds the lock); True if the chunk is new"""
+        count = self.refs.get(digest, 0)
+        self.refs[digest] = count + 1
+        self.logical_bytes += size
+        if count == 0:
+            self.sizes[digest] = size
+            self.stored_bytes += size
+        return count == 0
+
+    def add(self, data: bytes) -> str:
+        """Store a chunk (or reference the copy already stored); returns its digest"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        with self.lock:
+            if not self._ref(digest, len(data)) or path.exists():
+                self.stats["chunks_deduplicated"] += 1
+                return digest
+            try:
+                path.parent.mkdir(exist_ok=True)
+                tmp_path = path.with_name(f"{digest}.{uuid.uuid4().hex[:8]}.tmp")
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except OSError:
+                self._unref(digest)
+                raise
+            self.stats["chunks_written"] += 1
+            return digest
+
+    def _unref(self, digest: str) -> bool:
+        """Drop one reference (caller holds the lock); True if that was the last one"""
+        count = self.refs.get(digest, 0)
+        if count <= 0:
+            return False
+        size = self.sizes.get(digest, 0)
+        self.logical_bytes -= size
+        if count > 1:
+            self.refs[digest] = count - 1
+            return False
+        del self.refs[digest]
+        del self.sizes[digest]
+        self.stored_bytes -= size
+        return True
+
+    def retain(self, manifest: Manifest):
+        """Reference every chunk of an existing manifest (when loading it at startup)"""
+        with self.lock:
+            for digest, size in manifest:
+                self._ref(digest, size)
+
+    def release(self, manifest: Manifest):
+        """Drop a manifest's references, deleting chunks no other manifest uses"""
+        with self.lock:
+            for digest, _ in manifest:
+                if self._unref(digest):
+                    self._path(digest).unlink(missing_ok=True)
+                    self.stats["chunks_deleted"] += 1
+
+    def has(self, digest: str) -> bool:
+        return self.is_digest(digest) and self._path(digest).exists()
+
+    def read(self, digest: str) -> Optional[bytes]:
+        """A chunk's content, or None if it is not stored"""
+        if not self.is_digest(digest):
+            return None
+        try:
+            with open(self._path(digest), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def collect_garbage(self) -> int:
+        """Delete chunk files that no manifest references; returns how many"""
+        removed = 0
+        with self.lock:
+            for path in self.directory.glob("*/*"):
+                if path.name in self.refs:
+                    continue
+                try:
+                    path.unlink()
+                    removed += 1
+                except OSError as e:
+                    logger.warning(f"Failed to remove unreferenced chunk {path.name}: {e}")
+        if removed:
+            logger.info(f"Removed {removed} unreferenced chunks")
+        return removed
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get chunk store statistics, including the deduplication ratio"""
+        with self.lock:
+            return {
+                **self.stats,
+                "chunks": len(self.refs),
+                "stored_bytes": self.stored_bytes,
+                "logical_bytes": self.logical_bytes,
+                "bytes_saved": self.logical_bytes - self.stored_bytes,
+                "dedup_ratio": round(self.logical_bytes / self.stored_bytes, 3) if self.stored_bytes else 1.0
+            }
+
+
+class ManifestReader(io.RawIOBase):
+    """Read-only, seekable file object over a file stored as a chunk manifest"""
+
+    def __init__(self, store: ChunkStore, manifest: Manifest):
+        super().__init__()
+        self.store = store
+        self.digests = [digest for digest, _ in manifest]
+        self.offsets = [0]
+        for _, size in manifest:
+            self.offsets.append(self.offsets[-1] + size)
+        self.size = self.offsets[-1]
+        self.position = 0
+        self.cached_index = -1
+        self.cached: bytes = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError("negative seek position")
+        self.position = offset
+        return offset
+
+    def _chunk(self, index: int) -> bytes:
+        if index != self.cached_index:
+            data = self.store.read(self.digests[index])
+            if data is None:
+                raise IOError(f"Chunk {self.digests[index]} is missing from the chunk store")
+            self.cached_index, self.cached = index, data
+        return self.cached
+
+    def readinto(self, buffer) -> int:
+        if self.position >= self.size:
+            return 0
+        index = bisect.bisect_right(self.offsets, self.position) - 1
+        data = self._chunk(index)
+        start = self.position - self.offsets[index]
+        count = min(len(buffer), len(data) - start)
+        buffer[:count] = data[start:start + count]
+        self.position += count
+        return count
@@ -0,0 +1,303 @@
+import threading
+import time
+import uuid
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from src.backend.metrics import LatencyHistogram
+
+logger = logging.getLogger("DeliveryTracker")
+
+MAX_MISSING_RANGES = 32
+
+
+class _OutgoingStream:
+    """Our messages to one peer that have not been acknowledged yet"""
+
+    def __init__(self):
+        self.next_seq = 1
+        # seq -> [message, first_sent, last_sent, retransmits]
+        self.unacked: "OrderedDict[int, list]" = OrderedDict()
+        self.latency = LatencyHistogram()
+
+    def base(self) -> int:
+        """Highest seq the peer no longer needs (everything below our oldest unacked)"""
+        return (next(iter(self.unacked)) if self.unacked else self.next_seq) - 1
+
+
+class _IncomingStream:
+    """What we have received from one peer in its current epoch"""
+
+    def __init__(self, epoch: str):
+        self.epoch = epoch
+        self.cumulative = 0  # every seq up to here has been received
+        self.above: Set[int] = set()  # received out of order, above cumulative
+        self.unacked = 0  # messages received since our last ACK
+
+    def missing(self) -> List[List[int]]:
+        """Gaps between ``cumulative`` and the highest seq seen, as [start, end] ranges"""
+        ranges = []
+        expected = self.cumulative + 1
+        for seq in sorted(self.above):
+            if seq > expected:
+                ranges.append([expected, seq - 1])
+                if len(ranges) >= MAX_MISSING_RANGES:
+                    break
+            expected = seq + 1
+        return ranges
+
+
+class DeliveryTracker:
+    """End-to-end delivery acknowledgements over per-peer sequence numbers.
+
+    Each tracked message to a peer gets the next seq of our current epoch
+    (a random ID per process, so a restarted sender starts a fresh stream).
+    The receiver answers with batched, cumulative ACKs: one ACK says "all
+    seqs up to N arrived" and lists any gaps above N, and only those gaps
+    are retransmitted. Messages carry ``base``, the highest seq the sender
+    has already seen acknowledged, so a receiver that lost its state does
+    not ask for messages that were delivered long ago.
+
+    Retransmission without a NACK only happens on reconnect, or when a
+    message has gone unacknowledged for ``retransmit_timeout`` (the tail of
+    a stream has no later message to reveal the gap).
+
+    At most ``max_unacked`` messages per peer are tracked; tracking one more
+    gives up on the oldest, so a peer that stays away (whose retransmits
+    never count as attempts) cannot grow the table without bound.
+    """
+
+    def __init__(self, send_ack: Callable[[str, Dict[str, Any]], bool],
+                 retransmit: Callable[[str, List[Tuple[int, Any]]], bool],
+                 on_status: Optional[Callable[[str, Any], None]] = None,
+                 ack_interval: float = 0.1, ack_batch: int = 64,
+                 retransmit_timeout: float = 10.0, max_retransmits: int = 5, max_unacked: int = 1000):
+        self.epoch = uuid.uuid4().hex[:12]
+        self.send_ack = send_ack
+        self.retransmit = retransmit
+        self.on_status = on_status
+        self.ack_interval = ack_interval
+        self.ack_batch = ack_batch
+        self.retransmit_timeout = retransmit_timeout
+        self.max_retransmits = max_retransmits
+        self.max_unacked = max(1, max_unacked)
+        self.min_retransmit_gap = 0.5  # ignore repeated NACKs for a seq resent this recently
+
+        self.outgoing: Dict[str, _OutgoingStream] = {}
+        self.incoming: Dict[str, _IncomingStream] = {}
+        self.dirty: Set[str] = set()  # peers owed an ACK
+        self.lock = threading.RLock()
+        self.wakeup = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.is_running = False
+        self.stats = {"tracked": 0, "delivered": 0, "retransmitted": 0, "expired": 0,
+                      "duplicates": 0, "acks_sent": 0, "gaps_reported": 0}
+
+    def start(self):
+        """Start the ACK flush / retransmit timer thread"""
+        self.is_running = True
+        self.thread = threading.Thread(target=self._timer_loop, name="delivery-acks")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.is_running = False
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+
+    # ------------------------------------------------------------------
+    # Sending side
+    # ------------------------------------------------------------------
+    def track(self, peer_id: str, message: Any) -> Dict[str, Any]:
+        """Assign the next seq to a message; returns the ``delivery`` field to send with it"""
+        evicted = None
+        with self.lock:
+            stream = self.outgoing.setdefault(peer_id, _OutgoingStream())
+            if len(stream.unacked) >= self.max_unacked:
+                evicted = stream.unacked.popitem(last=False)[1][0]
+                self.stats["expired"] += 1
+            seq = stream.next_seq
+            stream.next_seq += 1
+            now = time.time()
+            stream.unacked[seq] = [message, now, now, 0]
+            self.stats["tracked"] += 1
+            delivery = {"epoch": self.epoch, "seq": seq, "base": stream.base()}
+        if evicted is not None:
+            self._report_failed(peer_id, evicted)
+        return delivery
+
+    def untrack(self, peer_id: str, seq: int) -> bool:
+        """Stop tracking a message whose send failed (the caller keeps it elsewhere)"""
+        with self.lock:
+            stream = self.outgoing.get(peer_id)
+            return bool(stream) and stream.unacked.pop(seq, None) is not None
+
+    def delivery_field(self, peer_id: str, seq: int) -> Dict[str, Any]:
+        """The ``delivery`` field for retransmitting an already tracked seq"""
+        with self.lock:
+            stream = self.outgoing.get(peer_id)
+            return {"epoch": self.epoch, "seq": seq, "base": stream.base() if stream else seq - 1}
+
+    def on_ack(self, peer_id: str, content: Dict[str, Any]):
+        """Process an ACK: settle everything it covers, retransmit reported gaps"""
+        if content.get("epoch") != self.epoch:
+            return  # an ACK for a stream from before we restarted
+        ack = content.get("ack")
+        missing = content.get("missing") or []
+        delivered = []
+        resend = []
+        with self.lock:
+            stream = self.outgoing.get(peer_id)
+            if not stream:
+                return
+            now = time.time()
+            if isinstance(ack, int):
+                while stream.unacked:
+                    seq = next(iter(stream.unacked))
+                    if seq > ack:
+                        break
+                    message, first_sent, _, _ = stream.unacked.pop(seq)
+                    stream.latency.observe(now - first_sent)
+                    delivered.append(message)
+                self.stats["delivered"] += len(delivered)
+            for gap in missing[:MAX_MISSING_RANGES]:
+                if not (isinstance(gap, list) and len(gap) == 2 and all(isinstance(v, int) for v in gap)):
+                    continue
+                for seq, entry in stream.unacked.items():
+                    if gap[0] <= seq <= gap[1] and (entry[3] == 0 or now - entry[2] >= self.min_retransmit_gap):
+                        resend.append((seq, entry))
+
+        for message in delivered:
+            message.status = "delivered"
+            if self.on_status:
+                self.on_status(peer_id, message)
+        if resend:
+            self._retransmit(peer_id, resend)
+
+    def resend_unacked(self, peer_id: str):
+        """Retransmit everything a peer has not acknowledged (e.g. after it reconnects)"""
+        with self.lock:
+            stream = self.outgoing.get(peer_id)
+            if not stream or not stream.unacked:
+                return
+            resend = list(stream.unacked.items())
+        self._retransmit(peer_id, resend)
+
+    def _retransmit(self, peer_id: str, entries: List[Tuple[int, list]]):
+        """Resend tracked entries; attempts only count if the peer was reachable"""
+        if not self.retransmit(peer_id, [(seq, entry[0]) for seq, entry in entries]):
+            return
+        now = time.time()
+        with self.lock:
+            for _, entry in entries:
+                entry[2] = now
+                entry[3] += 1
+            self.stats["retransmitted"] += len(entries)
+        logger.debug(f"Retransmitted {len(entries)} messages to {peer_id}")
+
+    # ------------------------------------------------------------------
+    # Receiving side
+    # ------------------------------------------------------------------
+    def on_receive(self, peer_id: str, delivery: Any) -> bool:
+        """Record an incoming tracked message; False if it is a duplicate"""
+        if not isinstance(delivery, dict):
+            return True
+        epoch, seq, base = delivery.get("epoch"), delivery.get("seq"), delivery.get("base", 0)
+        if not isinstance(epoch, str) or not isinstance(seq, int) or not isinstance(base, int):
+            return True
+        with self.lock:
+            stream = self.incoming.get(peer_id)
+            if stream is None or stream.epoch != epoch:
+                stream = self.incoming[peer_id] = _IncomingStream(epoch)
+            if base > stream.cumulative:
+                stream.cumulative = base
+                stream.above = {s for s in stream.above if s > base}
+
+            duplicate = seq <= stream.cumulative or seq in stream.above
+            if duplicate:
+                self.stats["duplicates"] += 1
+            else:
+                stream.above.add(seq)
+                while stream.cumulative + 1 in stream.above:
+                    stream.cumulative += 1
+                    stream.above.discard(stream.cumulative)
+
+            # Duplicates are acked too: the sender evidently missed our last ACK
+            stream.unacked += 1
+            self.dirty.add(peer_id)
+            if stream.unacked >= self.ack_batch:
+                self.wakeup.set()
+        return not duplicate
+
+    def flush_acks(self):
+        """Send one cumulative ACK to every peer that is owed one"""
+        with self.lock:
+            pending = []
+            for peer_id in self.dirty:
+                stream = self.incoming.get(peer_id)
+                if stream:
+                    pending.append((peer_id, {"epoch": stream.epoch, "ack": stream.cumulative,
+                                              "missing": stream.missing()}))
+                    stream.unacked = 0
+            self.dirty.clear()
+        for peer_id, content in pending:
+            if self.send_ack(peer_id, content):
+                with self.lock:
+                    self.stats["acks_sent"] += 1
+                    if content["missing"]:
+                        self.stats["gaps_reported"] += 1
+
+    # ------------------------------------------------------------------
+    def _expire(self):
+        """Retransmit stale unacked messages; give up on ones that never get through"""
+        now = time.time()
+        failed = []
+        resend: Dict[str, List[Tuple[int, list]]] = {}
+        with self.lock:
+            for peer_id, stream in self.outgoing.items():
+                for seq, entry in list(stream.unacked.items()):
+                    if now - entry[2] < self.retransmit_timeout:
+                        continue
+                    if entry[3] >= self.max_retransmits:
+                        del stream.unacked[seq]
+                        failed.append((peer_id, entry[0]))
+                        continue
+                    resend.setdefault(peer_id, []).append((seq, entry))
+            self.stats["expired"] += len(failed)
+
+        for peer_id, message in failed:
+            self._report_failed(peer_id, message)
+        for peer_id, items in resend.items():
+            self._retransmit(peer_id, items)
+
+    def _report_failed(self, peer_id: str, message: Any):
+        message.status = "failed"
+        logger.warning(f"Message {message.message_id} to {peer_id} was never acknowledged")
+        if self.on_status:
+            self.on_status(peer_id, message)
+
+    def _timer_loop(self):
+        last_expiry_check = time.monotonic()
+        while self.is_running:
+            self.wakeup.wait(timeout=self.ack_interval)
+            self.wakeup.clear()
+            try:
+                self.flush_acks()
+                if time.monotonic() - last_expiry_check >= 1.0:
+                    last_expiry_check = time.monotonic()
+                    self._expire()
+            except Exception as e:
+                logger.error(f"Error in delivery timer: {e}", exc_info=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get delivery statistics, including per-peer send->ack latency"""
+        with self.lock:
+            return {
+                **self.stats,
+                "epoch": self.epoch,
+                "unacked": sum(len(s.unacked) for s in self.outgoing.values()),
+                "ack_latency": {peer_id: stream.latency.snapshot()
+                                for peer_id, stream in self.outgoing.items()}
+            }
@@ -0,0 +1,115 @@
+import itertools
+import threading
+import time
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger("EventBus")
+
+# Event types published by the service
+MESSAGE = "message"
+MESSAGE_STATUS = "message_status"  # a sent message was delivered or gave up
+PEER_STATUS = "peer_status"
+FILE_REGISTERED = "file_registered"
+FILE_DELETED = "file_deleted"
+CHUNK_PROGRESS = "chunk_progress"
+TRANSFER_COMPLETE = "transfer_complete"
+RESYNC = "resync"  # events were dropped; the client should refetch via the REST API
+
+
+class EventSubscription:
+    """One client's pending events.
+
+    Events published with a key replace any pending event with the same key
+    (e.g. progress for one file), so a client that reads slowly receives the
+    latest state instead of every intermediate update. If un-keyed events
+    still pile up past ``max_pending``, they are dropped and replaced by a
+    single ``resync`` event: a stalled client never holds unbounded memory
+    or slows the publisher down.
+    """
+
+    def __init__(self, notify: Callable[[], None], max_pending: int = 1000,
+                 event_types: Optional[Iterable[str]] = None):
+        self.notify = notify
+        self.max_pending = max_pending
+        self.event_types = set(event_types) if event_types else None
+        self.pending: "OrderedDict[Any, Dict[str, Any]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self._unkeyed = itertools.count()
+        self.stats = {"delivered": 0, "coalesced": 0, "overflows": 0}
+
+    def push(self, event: Dict[str, Any], key: Optional[str] = None):
+        """Queue an event (called from any thread)"""
+        if self.event_types is not None and event["type"] not in self.event_types:
+            return
+        with self.lock:
+            was_empty = not self.pending
+            if key is None:
+                key = next(self._unkeyed)
+            elif key in self.pending:
+                self.stats["coalesced"] += 1
+            self.pending[key] = event
+            if len(self.pending) > self.max_pending:
+                self.pending.clear()
+                self.pending[RESYNC] = {"type": RESYNC, "data": {}, "ts": event["ts"]}
+                self.stats["overflows"] += 1
+        if was_empty:
+            self.notify()
+
+    def drain(self) -> List[Dict[str, Any]]:
+        """Take every pending event, oldest first"""
+        with self.lock:
+            events = list(self.pending.values())
+            self.pending.clear()
+            self.stats["delivered"] += len(events)
+            return events
+
+
+class EventBus:
+    """Fan-out of service events to push-channel subscribers"""
+
+    def __init__(self, max_pending: int = 1000):
+        self.max_pending = max_pending
+        self.subscribers: List[EventSubscription] = []
+        self.lock = threading.Lock()
+        self.published = 0
+
+    def subscribe(self, notify: Callable[[], None],
+                  event_types: Optional[Iterable[str]] = None) -> EventSubscription:
+        """Register a subscriber; ``notify`` is called when its queue becomes non-empty"""
+        subscription = EventSubscription(notify, self.max_pending, event_types)
+        with self.lock:
+            self.subscribers = self.subscribers + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription: EventSubscription):
+        with self.lock:
+            self.subscribers = [s for s in self.subscribers if s is not subscription]
+
+    def publish(self, event_type: str, data: Dict[str, Any], key: Optional[str] = None):
+        """Send an event to every subscriber; events sharing a key coalesce"""
+        with self.lock:
+            self.published += 1
+            subscribers = self.subscribers  # copy-on-write; iterated outside the lock
+        if not subscribers:
+            return
+        event = {"type": event_type, "data": data, "ts": time.time()}
+        if key is not None:
+            key = f"{event_type}:{key}"
+        for subscription in subscribers:
+            try:
+                subscription.push(event, key)
+            except Exception as e:
+                logger.error(f"Failed to queue {event_type} event: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get event bus statistics"""
+        subscribers = self.subscribers
+        return {
+            "published": self.published,
+            "subscribers": len(subscribers),
+            "delivered": sum(s.stats["delivered"] for s in subscribers),
+            "coalesced": sum(s.stats["coalesced"] for s in subscribers),
+            "overflows": sum(s.stats["overflows"] for s in subscribers)
+        }
@@ -2,29 +2,334 @@ import os
 import hashlib
 import json
 import base64
+import io
+import queue
+import shutil
 import threading
-from typing import Dict, Optional, List
+import time
+import uuid
+from contextlib import contextmanager
+from typing import BinaryIO, Dict, Iterator, Optional, List, Tuple, Union
 from datetime import datetime
 from pathlib import Path
 import logging
 
+from src.backend.chunk_store import ChunkStore, Manifest, ManifestReader, cdc_chunks, split_chunks
+from src.backend.event_bus import CHUNK_PROGRESS, FILE_DELETED, FILE_REGISTERED, TRANSFER_COMPLETE
+from src.backend.merkle import leaf_hash, verify_proof
+
 logger = logging.getLogger("FileManager")
 
+DEFAULT_CHUNK_SIZE = 32 * 1024  # chunk size of senders that do not announce one
+MIN_TRANSFER_CHUNK_SIZE = 4 * 1024  # smallest chunk size accepted, bounding a transfer's bitmap
+PART_SUFFIX = ".part"
+BITMAP_SUFFIX = ".bitmap"  # received-chunk bitmap persisted next to a .part file
+CHECKPOINT_CHUNKS = 256  # persist the bitmap after this many new chunks
+MAX_MISSING_RANGES = 64  # ranges listed in one resume request
+OUTGOING_TTL = 7 * 24 * 3600  # how long a sent file stays resumable
+INCOMING_TTL = 7 * 24 * 3600  # how long an unfinished incoming file is kept for resuming
+READ_AHEAD_CHUNKS = 8  # chunks read from disk per read when streaming a file out
+UPLOAD_PREFIX = ".upload-"  # temp files for uploads being copied into storage
+COPY_CHUNK_SIZE = 1024 * 1024
+MANIFEST_SUFFIX = ".manifest"  # a completed file stored as chunks in the chunk store
+
+
+def _preallocate(fd: int, size: int):
+    """Reserve ``size`` bytes for a file, falling back to a sparse file where unsupported"""
+    if size and hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError:
+            pass
+    os.ftruncate(fd, size)
+
+
+def _pwrite(fd: int, data: bytes, offset: int):
+    """Write all of ``data`` at ``offset`` (seek + write where pwrite is unavailable, e.g. Windows)"""
+    view = memoryview(data)
+    while view:
+        if hasattr(os, "pwrite"):
+            written = os.pwrite(fd, view, offset)
+        else:
+            os.lseek(fd, offset, os.SEEK_SET)
+            written = os.write(fd, view)
+        view = view[written:]
+        offset += written
+
+
+def _read_chunks(f, size: int, chunk_size: int) -> Iterator[memoryview]:
+    """Read ``size`` bytes through one reused read-ahead buffer, yielding chunk-sized views of it"""
+    buffer = memoryview(bytearray(chunk_size * READ_AHEAD_CHUNKS))
+    remaining = size
+    while remaining > 0:
+        wanted = min(len(buffer), remaining)
+        filled = 0
+        while filled < wanted:
+            read = f.readinto(buffer[filled:wanted])
+            if not read:
+                raise IOError(f"File ended after {size - remaining + filled} of {size} bytes")
+            filled += read
+        for start in range(0, filled, chunk_size):
+            yield buffer[start:min(start + chunk_size, filled)]
+        remaining -= filled
+
+
+class StoredFile:
+    """Handle to a completed file, whether it is one file on disk or a chunk manifest.
+
+    ``open`` resolves the storage when it is called, so a handle stays valid
+    while the file is moved into the chunk store in the background.
+    """
+
+    def __init__(self, manager: "FileManager", file_id: str, size: int, mtime: float):
+        self.manager = manager
+        self.file_id = file_id
+        self.size = size
+        self.mtime = mtime
+
+    def open(self) -> BinaryIO:
+        f = self.manager.open_file(self.file_id)
+        if f is None:
+            raise FileNotFoundError(f"File {self.file_id} is no longer stored")
+        return f
+
+
+def read_at(f: BinaryIO, offset: int, length: int) -> bytes:
+    """Read up to ``length`` bytes at ``offset``, short only at the end of the file"""
+    f.seek(offset)
+    parts = []
+    while length > 0:
+        data = f.read(length)
+        if not data:
+            break
+        parts.append(data)
+        length -= len(data)
+    return b"".join(parts)
+
+
+@contextmanager
+def open_source(source: Union[str, os.PathLike, StoredFile]) -> Iterator[Tuple[int, BinaryIO]]:
+    """Open a path or stored file for reading; yields ``(size, file)``"""
+    if isinstance(source, StoredFile):
+        f, size = source.open(), source.size
+    else:
+        f = open(source, 'rb', buffering=0)
+        size = os.fstat(f.fileno()).st_size
+    with f:
+        yield size, f
+
+
+@contextmanager
+def chunk_stream(source: Union[bytes, str, os.PathLike, StoredFile],
+                 chunk_size: int) -> Iterator[Tuple[int, Iterator[memoryview]]]:
+    """Open file content for chunked sending; yields ``(size, chunks)``.
+
+    ``source`` is either the content itself, a path or a stored file. Those
+    are streamed through a bounded read-ahead buffer, so memory use does not
+    depend on the file size; each chunk is only valid until the next one is
+    taken, which lets a broadcast encode it once and send that to every
+    recipient.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        view = memoryview(source)
+        yield len(view), (view[start:start + chunk_size] for start in range(0, len(view), chunk_size))
+        return
+    with open_source(source) as (size, f):
+        yield size, _read_chunks(f, size, chunk_size)
+
+
+class _PartialFile:
+    """An incoming file: a preallocated ``.part`` file plus a bitmap of received chunks.
+
+    Chunks are written straight to their offset, so memory use does not
+    depend on the file size. The bitmap is checkpointed to a sidecar file
+    (after fsyncing the data it describes), so an interrupted transfer can
+    be resumed after a restart by asking only for the chunks it lacks.
+    """
+
+    def __init__(self, path: Path, file_size: int, chunk_size: int, resume: bool = False):
+        self.path = path
+        self.bitmap_path = path.with_name(path.name + BITMAP_SUFFIX)
+        self.file_size = file_size
+        self.chunk_size = chunk_size
+        self.total_chunks = (file_size + chunk_size - 1) // chunk_size
+        self.bitmap = bytearray((self.total_chunks + 7) // 8)
+        self.received = 0
+        self.unsaved = 0  # chunks written since the last checkpoint
+        # Merkle proofs of received chunks (memory only), so they can be passed on to swarm peers
+        self.proofs: Dict[int, List[str]] = {}
+        self.lock = threading.Lock()
+        flags = os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0)
+        self.fd = os.open(path, flags if resume else flags | os.O_TRUNC, 0o644)
+        try:
+            if resume:
+                self._load_bitmap()
+            else:
+                _preallocate(self.fd, file_size)
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def _load_bitmap(self):
+        try:
+            saved = self.bitmap_path.read_bytes()
+        except OSError:
+            return
+        if len(saved) == len(self.bitmap):
+            self.bitmap[:] = saved
+            # Bits past the last chunk are never set; a corrupt file just costs a re-request
+            self.received = sum(1 for index in range(self.total_chunks) if self.has(index))
+
+    def checkpoint(self):
+        """Make the received chunks durable, then record them in the bitmap file"""
+        with self.lock:
+            if self.fd < 0:
+                return
+            os.fsync(self.fd)
+            tmp_path = self.bitmap_path.with_name(self.bitmap_path.name + ".tmp")
+            with open(tmp_path, "wb") as f:
+                f.write(self.bitmap)
+            os.replace(tmp_path, self.bitmap_path)
+            self.unsaved = 0
+
+    def has(self, index: int) -> bool:
+        return bool(self.bitmap[index >> 3] & (1 << (index & 7)))
+
+    def write(self, index: int, data: bytes) -> int:
+        """Write a chunk, or a span of consecutive chunks, at its offset.
+
+        Returns how many of the chunks are new (0 if all had been received).
+        """
+        span = range(index, min(self.total_chunks, index + max(1, -(-len(data) // self.chunk_size))))
+        with self.lock:
+            new = [i for i in span if not self.has(i)]
+            if not new:
+                return 0
+            _pwrite(self.fd, data, index * self.chunk_size)
+            for i in new:
+                self.bitmap[i >> 3] |= 1 << (i & 7)
+            self.received += len(new)
+            self.unsaved += len(new)
+            return len(new)
+
+    def read(self, index: int) -> Optional[bytes]:
+        """A received chunk, or None if it has not arrived"""
+        with self.lock:
+            if self.fd < 0 or not self.has(index):
+                return None
+            offset = index * self.chunk_size
+            length = min(self.chunk_size, self.file_size - offset)
+            if hasattr(os, "pread"):
+                return os.pread(self.fd, length, offset)
+            os.lseek(self.fd, offset, os.SEEK_SET)
+            return os.read(self.fd, length)
+    
+    def fill(self, offset: int, data: bytes):
+        """Write bytes that came from elsewhere (the chunk store) without marking any chunk"""
+        with self.lock:
+            _pwrite(self.fd, data, offset)
+
+    def mark_range(self, start: int, end: int) -> int:
+        """Mark every chunk lying entirely within bytes [start, end) as received; returns their bytes"""
+        first = (start + self.chunk_size - 1) // self.chunk_size
+        marked = 0
+        with self.lock:
+            for index in range(first, self.total_chunks):
+                chunk_end = min((index + 1) * self.chunk_size, self.file_size)
+                if chunk_end > end:
+                    break
+                if not self.has(index):
+                    self.bitmap[index >> 3] |= 1 << (index & 7)
+                    self.received += 1
+                    self.unsaved += 1
+                    marked += chunk_end - index * self.chunk_size
+        return marked
+
+    def missing(self) -> List[int]:
+        return [index for index in range(self.total_chunks) if not self.has(index)]
+
+    def missing_ranges(self, limit: int = MAX_MISSING_RANGES) -> List[List[int]]:
+        """Missing chunks as inclusive [start, end] ranges, oldest first"""
+        ranges: List[List[int]] = []
+        for index in range(self.total_chunks):
+            if self.has(index):
+                continue
+            if ranges and ranges[-1][1] == index - 1:
+                ranges[-1][1] = index
+            elif len(ranges) < limit:
+                ranges.append([index, index])
+            else:
+                break
+        return ranges
+
+    def held_ranges(self, proven: bool = False, limit: int = MAX_MISSING_RANGES) -> List[List[int]]:
+        """Received chunks as inclusive [start, end] ranges; with ``proven`` only those with a proof"""
+        ranges: List[List[int]] = []
+        for index in range(self.total_chunks):
+            if not self.has(index) or (proven and index not in self.proofs):
+                continue
+            if ranges and ranges[-1][1] == index - 1:
+                ranges[-1][1] = index
+            elif len(ranges) < limit:
+                ranges.append([index, index])
+            else:
+                break
+        return ranges
+    
+    def contiguous_bytes(self) -> int:
+        """Length of the prefix of the file that has fully arrived"""
+        index = 0
+        while index < self.total_chunks and self.has(index):
+            index += 1
+        return min(index * self.chunk_size, self.file_size)
+
+    def close(self, sync: bool = False):
+        with self.lock:
+            if self.fd < 0:
+                return
+            try:
+                if sync:
+                    os.fsync(self.fd)
+            finally:
+                os.close(self.fd)
+                self.fd = -1
+
 
 class FileManager:
-    """Manages file storage and retrieval for P2P file sharing"""
+    """Manages file storage and retrieval for P2P file sharing
+
+    By default a file is one file on disk, served straight from it. With
+    ``dedup`` on, completed files are moved into a content-addressed chunk
+    store in the background: each is split into content-defined chunks,
+    stored once per distinct chunk, and kept as a manifest - saving space
+    on similar files at the cost of assembling downloads from chunks.
+    """
     
-    def __init__(self, storage_dir: str = "files"):
+    def __init__(self, storage_dir: str = "files", event_bus=None, dedup: bool = False):
         self.storage_dir = Path(storage_dir)
+        # Optional EventBus notified of new files and transfer progress
+        self.event_bus = event_bus
         self.storage_dir.mkdir(exist_ok=True)
+        self.dedup = dedup
+        self.chunk_store = ChunkStore(str(self.storage_dir / "chunks"))
         
         self.files: Dict[str, Dict] = {}  # file_id -> file metadata
-        self.file_chunks: Dict[str, Dict[int, bytes]] = {}  # file_id -> {chunk_index: chunk_data}
+        self.partials: Dict[str, _PartialFile] = {}  # file_id -> incoming file being written
+        self.incoming_manifests: Dict[str, Manifest] = {}  # file_id -> the sender's manifest of an incoming file
+        self.outgoing: Dict[str, Dict] = {}  # file_id -> source of a file we sent, for resuming it
         self.folders: Dict[str, Dict] = {}  # folder_id -> folder metadata
         self.lock = threading.RLock()
+        self.stats = {"files_chunked": 0, "transfer_bytes_saved": 0, "chunks_rejected": 0}
+        
+        # Files waiting to be moved into the chunk store, as (file_id, chunk sizes or None)
+        self.ingest_queue: "queue.Queue" = queue.Queue()
+        self.ingest_thread: Optional[threading.Thread] = None
         
         # Load existing files metadata
         self._load_metadata()
+        self._load_outgoing()
+        self._load_chunk_store()
     
     def _load_metadata(self):
         """Load file metadata from disk"""
@@ -33,9 +338,116 @@ class FileManager:
             try:
                 with open(metadata_file, 'r') as f:
                     data = json.load(f)
-                    self.files = {k: v for k, v in data.items() if self._file_exists_on_disk(k)}
+                    self.files = {k: v for k, v in data.items()
+                                  if self._file_exists_on_disk(k) or self._resume_partial(k, v)}
             except Exception as e:
                 logger.warning(f"Failed to load file metadata: {e}")
+        if self.partials:
+            logger.info(f"Resuming {len(self.partials)} interrupted incoming transfers")
+        # Uploads and transfers without a usable bitmap cannot be resumed; drop their partial data
+        keep = {p.path.name for p in self.partials.values()} | {p.bitmap_path.name for p in self.partials.values()}
+        stale = (list(self.storage_dir.glob(f"*{PART_SUFFIX}")) + list(self.storage_dir.glob(f"*{BITMAP_SUFFIX}"))
+                 + list(self.storage_dir.glob(f"{UPLOAD_PREFIX}*"))
+                 + list(self.storage_dir.glob(f"*{MANIFEST_SUFFIX}.tmp")))
+        for part_file in stale:
+            if part_file.name in keep:
+                continue
+            try:
+                part_file.unlink()
+            except OSError as e:
+                logger.warning(f"Failed to remove stale partial file {part_file.name}: {e}")
+    
+    def _resume_partial(self, file_id: str, file_info: Dict) -> bool:
+        """Reopen an interrupted incoming transfer from its .part and bitmap files"""
+        if file_info.get("status") != "receiving" or not self._is_safe_file_id(file_id):
+            return False
+        if self._partial_expired(file_info, datetime.utcnow().timestamp() - INCOMING_TTL):
+            logger.info(f"Dropping interrupted transfer {file_id}: not completed within {INCOMING_TTL}s")
+            return False
+        part_path = self.storage_dir / f"{file_id}{PART_SUFFIX}"
+        bitmap_path = part_path.with_name(part_path.name + BITMAP_SUFFIX)
+        if not part_path.exists() or not bitmap_path.exists():
+            return False
+        try:
+            partial = _PartialFile(part_path, file_info["file_size"],
+                                   file_info.get("chunk_size", DEFAULT_CHUNK_SIZE), resume=True)
+        except (OSError, KeyError) as e:
+            logger.warning(f"Cannot resume transfer {file_id}: {e}")
+            return False
+        self.partials[file_id] = partial
+        file_info["chunks_received"] = partial.received
+        return True
+    
+    @staticmethod
+    def _partial_expired(file_info: Dict, cutoff: float) -> bool:
+        try:
+            return datetime.fromisoformat(file_info["created_at"]).timestamp() < cutoff
+        except (KeyError, TypeError, ValueError):
+            return True
+    
+    def _expire_partials(self):
+        """Delete incoming transfers that were not completed within INCOMING_TTL"""
+        cutoff = datetime.utcnow().timestamp() - INCOMING_TTL
+        with self.lock:
+            expired = [file_id for file_id in self.partials
+                       if self._partial_expired(self.files.get(file_id, {}), cutoff)]
+        for file_id in expired:
+            logger.info(f"Dropping incoming transfer {file_id}: not completed within {INCOMING_TTL}s")
+            self.delete_file(file_id)
+    
+    def _manifest_path(self, file_id: str) -> Path:
+        return self.storage_dir / f"{file_id}{MANIFEST_SUFFIX}"
+    
+    def _read_manifest(self, file_id: str) -> Optional[Manifest]:
+        try:
+            with open(self._manifest_path(file_id), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to read manifest of {file_id}: {e}")
+            return None
+    
+    def _load_chunk_store(self):
+        """Count chunk references from the manifests, drop orphaned chunks, queue files not yet chunked"""
+        recovered = False
+        for file_id, file_info in self.files.items():
+            if file_info.get("status") != "completed":
+                continue
+            if self._manifest_path(file_id).exists():
+                manifest = self._read_manifest(file_id)
+                if manifest is not None:
+                    self.chunk_store.retain(manifest)
+                if file_info.get("storage") != "chunks":
+                    # Crashed between writing the manifest and recording it
+                    file_info["storage"] = "chunks"
+                    Path(file_info.pop("file_path", None) or self.storage_dir / file_id).unlink(missing_ok=True)
+                    recovered = True
+            elif self.dedup:
+                self._schedule_ingest(file_id)
+        if recovered:
+            self._save_metadata()
+        self.chunk_store.collect_garbage()
+    
+    def _load_outgoing(self):
+        outgoing_file = self.storage_dir / "outgoing.json"
+        if not outgoing_file.exists():
+            return
+        try:
+            with open(outgoing_file, 'r') as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.warning(f"Failed to load outgoing transfers: {e}")
+            return
+        cutoff = datetime.utcnow().timestamp() - OUTGOING_TTL
+        self.outgoing = {k: v for k, v in data.items()
+                         if v.get("created_at", 0) >= cutoff and self.outgoing_source(v) is not None}
+    
+    def _save_outgoing(self):
+        outgoing_file = self.storage_dir / "outgoing.json"
+        try:
+            with open(outgoing_file, 'w') as f:
+                json.dump(self.outgoing, f, indent=2)
+        except Exception as e:
+            logger.error(f"Failed to save outgoing transfers: {e}")
     
     def _save_metadata(self):
         """Save file metadata to disk"""
@@ -46,19 +458,59 @@ class FileManager:
         except Exception as e:
             logger.error(f"Failed to save file metadata: {e}")
     
+    def _publish(self, event_type: str, data: Dict, key: str):
+        """Notify the event bus, if one is attached"""
+        if self.event_bus:
+            self.event_bus.publish(event_type, data, key=key)
+    
     def _file_exists_on_disk(self, file_id: str) -> bool:
-        """Check if file exists on disk"""
+        """Check if file exists on disk, whole or as a chunk manifest"""
         file_path = self.storage_dir / f"{file_id}"
-        return file_path.exists()
+        return file_path.exists() or self._manifest_path(file_id).exists()
+    
+    @staticmethod
+    def _is_safe_file_id(file_id: str) -> bool:
+        """File IDs come from peers and name files on disk; refuse anything path-like"""
+        return bool(file_id) and Path(file_id).name == file_id and file_id not in (".", "..")
     
     def register_file(self, file_id: str, filename: str, file_size: int, 
                        mime_type: str, sender_id: str, recipient_id: Optional[str] = None, 
-                       folder_path: Optional[str] = None) -> bool:
-        """Register a new file transfer"""
+                       folder_path: Optional[str] = None, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                       manifest: Optional[Manifest] = None, merkle_root: Optional[str] = None,
+                       max_chunk_size: Optional[int] = None, shared: bool = False) -> bool:
+        """Register a new file transfer and preallocate its ``.part`` file
+
+        ``manifest`` is the sender's chunk manifest of the file, if it sent
+        one: chunks we already hold can then be filled in locally (see
+        ``fill_from_store``) and the file is stored along its boundaries.
+        ``merkle_root`` lets ``verify_chunk`` check each chunk as it arrives.
+        ``max_chunk_size`` is the largest span of consecutive chunks the
+        sender may put in one message (one chunk if it did not say).
+        ``shared`` marks a file that was broadcast, which any peer may then
+        fetch from us in a swarm download (see ``is_shared``).
+        """
         with self.lock:
             if file_id in self.files:
                 logger.warning(f"File {file_id} already registered, updating...")
                 return False
+            if not self._is_safe_file_id(file_id) or chunk_size < MIN_TRANSFER_CHUNK_SIZE or \
+                    (max_chunk_size is not None and (max_chunk_size <= 0 or max_chunk_size % chunk_size)):
+                logger.error(f"Refusing file transfer {file_id!r}: invalid file ID or chunk size")
+                return False
+            # Transfers whose sender never came back would otherwise hold their disk space for good
+            self._expire_partials()
+            if shutil.disk_usage(self.storage_dir).free < file_size:
+                logger.error(f"Not enough disk space to receive {filename} ({file_size} bytes)")
+                return False
+            try:
+                partial = _PartialFile(self.storage_dir / f"{file_id}{PART_SUFFIX}", file_size, chunk_size)
+                partial.checkpoint()
+            except OSError as e:
+                logger.error(f"Failed to create partial file for {file_id}: {e}")
+                return False
+            self.partials[file_id] = partial
+            if manifest and self.dedup:
+                self.incoming_manifests[file_id] = manifest
             
             self.files[file_id] = {
                 "file_id": file_id,
@@ -70,143 +522,352 @@ class FileManager:
                 "folder_path": folder_path,
                 "status": "receiving",
                 "chunks_received": 0,
-                "total_chunks": 0,
+                "total_chunks": partial.total_chunks,
+                "chunk_size": chunk_size,
+                "max_chunk_size": max_chunk_size or chunk_size,
+                "merkle_root": merkle_root,
+                "shared": shared,
                 "created_at": datetime.utcnow().isoformat(),
                 "completed_at": None
             }
-            self.file_chunks[file_id] = {}
             self._save_metadata()
             logger.info(f"Registered file transfer: {filename} ({file_id}), size: {file_size} bytes")
+            self._publish(FILE_REGISTERED, dict(self.files[file_id]), file_id)
             return True
     
-    def add_chunk(self, file_id: str, chunk_index: int, chunk_data: bytes, is_last: bool) -> bool:
-        """Add a chunk to a file transfer"""
+    def verify_chunk(self, file_id: str, chunk_index: int, chunk_data: bytes, proof: Optional[List[str]]) -> bool:
+        """Check a received chunk against the file's Merkle root (True if the sender sent none)"""
         with self.lock:
-            if file_id not in self.files:
+            file_info = self.files.get(file_id)
+            partial = self.partials.get(file_id)
+        root = file_info.get("merkle_root") if file_info else None
+        if not root or not partial:
+            return True
+        if verify_proof(leaf_hash(chunk_data), chunk_index, partial.total_chunks, proof or [], root):
+            return True
+        with self.lock:
+            self.stats["chunks_rejected"] += 1
+        return False
+    
+    def add_chunk(self, file_id: str, chunk_index: int, chunk_data: bytes, is_last: bool,
+                  proof: Optional[List[str]] = None, proofs: Optional[List[List[str]]] = None) -> bool:
+        """Write a received chunk to its offset in the file's ``.part`` file
+
+        ``chunk_data`` may also be a span of whole consecutive chunks, up to
+        the ``max_chunk_size`` the sender announced; it is written at the
+        offset of ``chunk_index``. The verified Merkle ``proof`` of the chunk
+        (``proofs`` of the span's chunks) is kept while the file is
+        incomplete, so the chunks can be served on to other peers.
+        """
+        with self.lock:
+            file_info = self.files.get(file_id)
+            partial = self.partials.get(file_id)
+            if not file_info or not partial:
                 logger.error(f"Cannot add chunk: file {file_id} not registered")
                 return False
-            
-            if file_id not in self.file_chunks:
-                self.file_chunks[file_id] = {}
-            
-            self.file_chunks[file_id][chunk_index] = chunk_data
-            self.files[file_id]["chunks_received"] = len(self.file_chunks[file_id])
-            
+        
+        offset = chunk_index * partial.chunk_size
+        end = offset + len(chunk_data)
+        if not 0 <= chunk_index < partial.total_chunks or end > partial.file_size:
+            logger.warning(f"Chunk {chunk_index} ({len(chunk_data)} bytes) is outside file {file_id}")
+            return False
+        if len(chunk_data) > partial.chunk_size and (
+                len(chunk_data) > file_info.get("max_chunk_size", partial.chunk_size)
+                or (len(chunk_data) % partial.chunk_size and end != partial.file_size)):
+            logger.warning(f"Rejecting span of {len(chunk_data)} bytes at chunk {chunk_index} of {file_id}: "
+                           f"not whole chunks within the negotiated maximum")
+            return False
+        try:
+            if not partial.write(chunk_index, chunk_data):
+                logger.debug(f"Ignoring duplicate chunk {chunk_index} for file {file_id}")
+                return True
+            if proofs is None and proof is not None:
+                proofs = [proof]
+            if proofs is not None and file_info.get("merkle_root"):
+                for index, chunk_proof in enumerate(proofs, chunk_index):
+                    partial.proofs[index] = chunk_proof
+            if partial.unsaved >= CHECKPOINT_CHUNKS:
+                partial.checkpoint()
+        except OSError as e:
+            logger.error(f"Failed to write chunk {chunk_index} for file {file_id}: {e}")
+            return False
+        
+        with self.lock:
+            file_info["chunks_received"] = partial.received
             logger.debug(f"Added chunk {chunk_index} for file {file_id} (size: {len(chunk_data)} bytes, is_last: {is_last})")
-            
             if is_last:
-                self.files[file_id]["total_chunks"] = chunk_index + 1
-                logger.info(f"Received final chunk {chunk_index} for {file_id}, total chunks: {chunk_index + 1}")
+                logger.info(f"Received final chunk {chunk_index} for {file_id}, total chunks: {partial.total_chunks}")
             
+            self._publish(CHUNK_PROGRESS, {
+                "file_id": file_id,
+                "direction": "incoming",
+                "chunks_received": file_info["chunks_received"],
+                "total_chunks": file_info["total_chunks"],
+                "file_size": file_info["file_size"]
+            }, f"incoming:{file_id}")
             return True
+
+    def add_span(self, file_id: str, chunk_index: int, data: bytes, is_last: bool,
+                 proofs: Optional[List[List[str]]] = None) -> Tuple[List[int], List[int]]:
+        """Verify and write a received chunk or span of consecutive chunks
+
+        Every chunk of the span is checked against the Merkle root on its
+        own, so one bad chunk does not cost the rest. Returns the indices of
+        the chunks written and of those that failed verification.
+        """
+        with self.lock:
+            partial = self.partials.get(file_id)
+        if partial is None:
+            logger.error(f"Cannot add chunks: file {file_id} not registered")
+            return [], []
+        size = partial.chunk_size
+        count = max(1, -(-len(data) // size))
+        proofs = proofs or []
+        view = memoryview(data)
+        verified = [
+            self.verify_chunk(file_id, chunk_index + k, view[k * size:(k + 1) * size],
+                              proofs[k] if k < len(proofs) else None)
+            for k in range(count)
+        ]
+        stored: List[int] = []
+        rejected: List[int] = []
+        k = 0
+        while k < count:
+            if not verified[k]:
+                rejected.append(chunk_index + k)
+                k += 1
+                continue
+            end = k
+            while end < count and verified[end]:
+                end += 1
+            run = data if (k, end) == (0, count) else bytes(view[k * size:end * size])
+            if self.add_chunk(file_id, chunk_index + k, run, is_last and end == count,
+                              proofs=proofs[k:end] if proofs else None):
+                stored.extend(range(chunk_index + k, chunk_index + end))
+            k = end
+        return stored, rejected
+
+    def fill_from_store(self, file_id: str) -> int:
+        """Copy the chunks of an incoming file that the chunk store already holds into its
+        ``.part`` file and mark the transfer chunks they cover; returns the bytes reused"""
+        with self.lock:
+            partial = self.partials.get(file_id)
+            manifest = self.incoming_manifests.get(file_id)
+        if not partial or not manifest:
+            return 0
+        reused = 0
+        marked = 0  # bytes of transfer chunks that need not be sent
+        offset = 0
+        run_start = None  # start of the current run of chunks we hold
+        try:
+            for digest, size in manifest:
+                data = self.chunk_store.read(digest)
+                if data is not None and len(data) == size:
+                    partial.fill(offset, data)
+                    reused += size
+                    run_start = offset if run_start is None else run_start
+                elif run_start is not None:
+                    # Transfer chunks may straddle stored chunks, so mark whole runs at once
+                    marked += partial.mark_range(run_start, offset)
+                    run_start = None
+                offset += size
+            if run_start is not None:
+                marked += partial.mark_range(run_start, offset)
+            partial.checkpoint()
+        except OSError as e:
+            logger.error(f"Failed to fill {file_id} from the chunk store: {e}")
+            return 0
+        with self.lock:
+            file_info = self.files.get(file_id)
+            if file_info:
+                file_info["chunks_received"] = partial.received
+            self.stats["transfer_bytes_saved"] += marked
+        if reused:
+            logger.info(f"Reused {reused} bytes of {file_id} from the chunk store, {marked} need not be sent")
+        return reused
     
     def complete_file(self, file_id: str) -> bool:
-        """Complete file transfer and save to disk"""
+        """Complete a file transfer by renaming its ``.part`` file into place
+
+        Chunks of a file with a Merkle root were verified as they arrived, so
+        the file is not read again here.
+        """
         with self.lock:
             if file_id not in self.files:
                 logger.error(f"Cannot complete file: {file_id} not registered")
                 return False
             
             file_info = self.files[file_id]
-            chunks = self.file_chunks.get(file_id, {})
-            
-            # Check if all chunks are received
-            total_chunks = file_info.get("total_chunks", 0)
-            if total_chunks == 0:
-                logger.warning(f"File {file_id} has no total_chunks set")
+            partial = self.partials.get(file_id)
+            if not partial:
+                logger.warning(f"File {file_id} has no transfer in progress")
                 return False
-                
-            if len(chunks) < total_chunks:
-                logger.warning(f"File {file_id} incomplete: {len(chunks)}/{total_chunks} chunks received")
-                logger.debug(f"Missing chunks: {set(range(total_chunks)) - set(chunks.keys())}")
+            
+            total_chunks = partial.total_chunks
+            if partial.received < total_chunks:
+                logger.warning(f"File {file_id} incomplete: {partial.received}/{total_chunks} chunks received")
+                logger.debug(f"Missing chunks: {partial.missing()[:100]}")
+                try:
+                    partial.checkpoint()
+                except OSError as e:
+                    logger.warning(f"Failed to checkpoint {file_id}: {e}")
                 return False
             
             filename = file_info.get("filename", "unknown")
-            logger.info(f"Assembling file {filename} ({file_id}) from {total_chunks} chunks")
-            
-            # Reassemble file
             file_path = self.storage_dir / file_id
             try:
-                with open(file_path, 'wb') as f:
-                    for i in range(total_chunks):
-                        if i not in chunks:
-                            logger.error(f"Missing chunk {i} for file {file_id}")
-                            return False
-                        f.write(chunks[i])
-                
-                # Update metadata
-                file_info["status"] = "completed"
-                file_info["completed_at"] = datetime.utcnow().isoformat()
-                file_info["file_path"] = str(file_path)
-                
-                # Clean up chunks from memory
-                del self.file_chunks[file_id]
-                
-                self._save_metadata()
-                logger.info(f"File {file_id} ({file_info['filename']}) completed successfully - {total_chunks} chunks assembled")
-                return True
-            except Exception as e:
+                partial.close(sync=True)
+                os.replace(partial.path, file_path)
+            except OSError as e:
                 logger.error(f"Failed to save file {file_id}: {e}", exc_info=True)
                 return False
+            del self.partials[file_id]
+            partial.bitmap_path.unlink(missing_ok=True)
+            
+            # Update metadata
+            file_info["status"] = "completed"
+            file_info["completed_at"] = datetime.utcnow().isoformat()
+            file_info["file_path"] = str(file_path)
+            
+            self._save_metadata()
+            logger.info(f"File {file_id} ({filename}) completed successfully - {total_chunks} chunks received")
+            self._publish(TRANSFER_COMPLETE, dict(file_info), file_id)
+            manifest = self.incoming_manifests.pop(file_id, None)
+            self._schedule_ingest(file_id, [size for _, size in manifest] if manifest else None)
+            return True
     
     def save_file(self, file_id: str, file_data: bytes, filename: str, 
                   mime_type: str, sender_id: str, recipient_id: Optional[str] = None, 
                   folder_path: Optional[str] = None) -> bool:
         """Save a complete file (for direct uploads)"""
-        with self.lock:
-            try:
-                # Handle folder structure
-                if folder_path:
-                    full_dir = self.storage_dir / folder_path
-                    full_dir.mkdir(parents=True, exist_ok=True)
-                    file_path = full_dir / file_id
-                    logger.info(f"Saving file in folder: {folder_path}/{filename} (ID: {file_id})")
-                else:
-                    file_path = self.storage_dir / file_id
-                    logger.info(f"Saving file: {filename} (ID: {file_id})")
-                
-                with open(file_path, 'wb') as f:
-                    f.write(file_data)
-                
+        return self.store_stream(io.BytesIO(file_data), file_id, filename, mime_type,
+                                 sender_id, recipient_id, folder_path)
+    
+    def store_stream(self, source: BinaryIO, file_id: str, filename: str, 
+                     mime_type: str, sender_id: str, recipient_id: Optional[str] = None, 
+                     folder_path: Optional[str] = None) -> bool:
+        """Copy a file-like object into storage, computing its size and SHA-256 on the way.
+
+        The data is copied in bounded chunks to a temp file without holding
+        the lock; only the atomic rename into place and the metadata insert
+        do, so a large upload does not block other file operations.
+        """
+        # Handle folder structure
+        if folder_path:
+            full_dir = self.storage_dir / folder_path
+            full_dir.mkdir(parents=True, exist_ok=True)
+            file_path = full_dir / file_id
+            logger.info(f"Saving file in folder: {folder_path}/{filename} (ID: {file_id})")
+        else:
+            file_path = self.storage_dir / file_id
+            logger.info(f"Saving file: {filename} (ID: {file_id})")
+        
+        tmp_path = self.storage_dir / f"{UPLOAD_PREFIX}{uuid.uuid4().hex}"
+        digest = hashlib.sha256()
+        file_size = 0
+        try:
+            with open(tmp_path, 'wb') as f:
+                while True:
+                    block = source.read(COPY_CHUNK_SIZE)
+                    if not block:
+                        break
+                    digest.update(block)
+                    f.write(block)
+                    file_size += len(block)
+                f.flush()
+                os.fsync(f.fileno())
+            
+            with self.lock:
+                os.replace(tmp_path, file_path)
+                now = datetime.utcnow().isoformat()
                 self.files[file_id] = {
                     "file_id": file_id,
                     "filename": filename,
-                    "file_size": len(file_data),
+                    "file_size": file_size,
                     "mime_type": mime_type,
                     "sender_id": sender_id,
                     "recipient_id": recipient_id,
                     "folder_path": folder_path,
                     "status": "completed",
                     "file_path": str(file_path),
-                    "created_at": datetime.utcnow().isoformat(),
-                    "completed_at": datetime.utcnow().isoformat()
+                    "sha256": digest.hexdigest(),
+                    "created_at": now,
+                    "completed_at": now
                 }
                 self._save_metadata()
-                logger.info(f"File saved successfully: {filename} ({len(file_data)} bytes)")
+                logger.info(f"File saved successfully: {filename} ({file_size} bytes)")
+                self._publish(FILE_REGISTERED, dict(self.files[file_id]), file_id)
+                self._schedule_ingest(file_id)
                 return True
-            except Exception as e:
-                logger.error(f"Failed to save file {filename} (ID: {file_id}): {e}", exc_info=True)
-                return False
+        except Exception as e:
+            logger.error(f"Failed to save file {filename} (ID: {file_id}): {e}", exc_info=True)
+            try:
+                tmp_path.unlink()
+            except OSError:
+                pass
+            return False
     
     def get_file(self, file_id: str) -> Optional[bytes]:
         """Get file data by file_id"""
+        try:
+            f = self.open_file(file_id)
+            if f is None:
+                return None
+            with f:
+                return f.read()
+        except Exception as e:
+            logger.error(f"Failed to read file {file_id}: {e}")
+            return None
+    
+    def open_file(self, file_id: str) -> Optional[BinaryIO]:
+        """Open a completed file for reading, wherever it is stored"""
         with self.lock:
-            if file_id not in self.files:
+            file_info = self.files.get(file_id)
+            if not file_info or file_info.get("status") != "completed":
                 return None
-            
-            file_path = self.storage_dir / file_id
-            if not file_path.exists():
+            if file_info.get("storage") == "chunks":
+                manifest = self._read_manifest(file_id)
+                return ManifestReader(self.chunk_store, manifest) if manifest is not None else None
+            file_path = Path(file_info.get("file_path") or self.storage_dir / file_id)
+            try:
+                return open(file_path, 'rb')
+            except FileNotFoundError:
                 return None
-            
+    
+    def get_stored_file(self, file_id: str) -> Optional[StoredFile]:
+        """Handle for streaming a completed file instead of reading it whole"""
+        with self.lock:
+            file_info = self.files.get(file_id)
+            if not file_info or file_info.get("status") != "completed":
+                return None
+            if file_info.get("storage") == "chunks":
+                return StoredFile(self, file_id, file_info["file_size"], file_info.get("mtime", 0.0))
+            file_path = Path(file_info.get("file_path") or self.storage_dir / file_id)
             try:
-                with open(file_path, 'rb') as f:
-                    return f.read()
-            except Exception as e:
-                logger.error(f"Failed to read file {file_id}: {e}")
+                stat = file_path.stat()
+            except OSError:
+                return None
+            return StoredFile(self, file_id, stat.st_size, stat.st_mtime)
+    
+    def get_file_path(self, file_id: str) -> Optional[Path]:
+        """Path of a completed file that is stored whole (None once it is in the chunk store)"""
+        with self.lock:
+            file_info = self.files.get(file_id)
+            if not file_info or file_info.get("status") != "completed" or file_info.get("storage") == "chunks":
+                return None
+            file_path = Path(file_info.get("file_path") or self.storage_dir / file_id)
+            return file_path if file_path.exists() else None
+    
+    def get_manifest(self, file_id: str) -> Optional[Manifest]:
+        """Chunk manifest of a completed file, if it has been moved into the chunk store"""
+        with self.lock:
+            file_info = self.files.get(file_id)
+            if not file_info or file_info.get("storage") != "chunks":
                 return None
+            return self._read_manifest(file_id)
     
     def get_partial_file(self, file_id: str) -> Optional[bytes]:
-        """Get partial file data (for in-progress transfers)"""
+        """Get partial file data (for in-progress transfers): the prefix received so far"""
         with self.lock:
             if file_id not in self.files:
                 return None
@@ -215,25 +876,40 @@ class FileManager:
             if self.files[file_id].get("status") == "completed":
                 return self.get_file(file_id)
             
-            # Return assembled chunks so far
-            chunks = self.file_chunks.get(file_id, {})
-            if not chunks:
+            partial = self.partials.get(file_id)
+            length = partial.contiguous_bytes() if partial else 0
+            if not length:
                 return None
             
             try:
-                # Assemble available chunks in order
-                sorted_indices = sorted(chunks.keys())
-                partial_data = b''.join([chunks[i] for i in sorted_indices])
-                return partial_data
+                with open(partial.path, 'rb') as f:
+                    return f.read(length)
             except Exception as e:
-                logger.error(f"Failed to assemble partial file {file_id}: {e}")
+                logger.error(f"Failed to read partial file {file_id}: {e}")
+                return None
+    
+    def get_partial_prefix(self, file_id: str) -> Optional[Tuple[Path, int]]:
+        """The ``.part`` file of an incoming transfer and the length of its fully received prefix"""
+        with self.lock:
+            partial = self.partials.get(file_id)
+            if partial is None:
                 return None
+            length = partial.contiguous_bytes()
+            return (partial.path, length) if length else None
     
     def get_file_info(self, file_id: str) -> Optional[Dict]:
         """Get file metadata"""
         with self.lock:
             return self.files.get(file_id)
     
+    def is_shared(self, file_id: str) -> bool:
+        """Whether swarm peers may fetch a file from us: only broadcast files are.
+
+        Uploads and files sent directly to us are never served to others.
+        """
+        with self.lock:
+            return bool(self.files.get(file_id, {}).get("shared"))
+    
     def list_files(self, limit: int = 100) -> List[Dict]:
         """List all files"""
         with self.lock:
@@ -247,19 +923,248 @@ class FileManager:
             if file_id not in self.files:
                 return False
             
-            file_path = self.storage_dir / file_id
+            file_path = Path(self.files[file_id].get("file_path") or self.storage_dir / file_id)
             try:
                 if file_path.exists():
                     file_path.unlink()
+                if self.files[file_id].get("storage") == "chunks":
+                    manifest = self._read_manifest(file_id)
+                    if manifest is not None:
+                        self.chunk_store.release(manifest)
+                    self._manifest_path(file_id).unlink(missing_ok=True)
+                self.incoming_manifests.pop(file_id, None)
+                partial = self.partials.pop(file_id, None)
+                if partial:
+                    partial.close()
+                    partial.path.unlink(missing_ok=True)
+                    partial.bitmap_path.unlink(missing_ok=True)
                 del self.files[file_id]
-                if file_id in self.file_chunks:
-                    del self.file_chunks[file_id]
                 self._save_metadata()
+                self._publish(FILE_DELETED, {"file_id": file_id}, file_id)
                 return True
             except Exception as e:
                 logger.error(f"Failed to delete file {file_id}: {e}")
                 return False
     
+    def missing_ranges(self, file_id: str, cover_tail: bool = False) -> List[List[int]]:
+        """Chunk ranges an incoming transfer still lacks ([] if none or unknown)
+
+        The list is capped at MAX_MISSING_RANGES; with ``cover_tail`` the last
+        range is stretched to the end of the file instead of leaving out
+        whatever lies past the cap.
+        """
+        with self.lock:
+            partial = self.partials.get(file_id)
+        if not partial:
+            return []
+        ranges = partial.missing_ranges()
+        if cover_tail and len(ranges) == MAX_MISSING_RANGES:
+            ranges[-1][1] = partial.total_chunks - 1
+        return ranges
+    
+    def missing_chunks(self, file_id: str) -> List[int]:
+        """Every chunk index an incoming transfer still lacks"""
+        with self.lock:
+            partial = self.partials.get(file_id)
+        return partial.missing() if partial else []
+    
+    def held_ranges(self, file_id: str) -> List[List[int]]:
+        """Chunk ranges of a file we can serve to swarm peers (all of a completed one)
+
+        Chunks of an incomplete file that has a Merkle root are only listed
+        if we still have their proofs, since the peer verifies them.
+        """
+        with self.lock:
+            file_info = self.files.get(file_id)
+            partial = self.partials.get(file_id)
+        if not file_info:
+            return []
+        if file_info.get("status") == "completed":
+            chunk_size = file_info.get("chunk_size", DEFAULT_CHUNK_SIZE)
+            total_chunks = (file_info["file_size"] + chunk_size - 1) // chunk_size
+            return [[0, total_chunks - 1]] if total_chunks and self._file_exists_on_disk(file_id) else []
+        if not partial:
+            return []
+        return partial.held_ranges(proven=bool(file_info.get("merkle_root")))
+    
+    def read_partial_chunk(self, file_id: str, chunk_index: int) -> Optional[Tuple[bytes, Optional[List[str]]]]:
+        """A received chunk of an incomplete file and its Merkle proof, or None if we lack it"""
+        with self.lock:
+            partial = self.partials.get(file_id)
+        if not partial or not 0 <= chunk_index < partial.total_chunks:
+            return None
+        try:
+            data = partial.read(chunk_index)
+        except OSError:
+            return None
+        return (data, partial.proofs.get(chunk_index)) if data is not None else None
+    
+    def incomplete_transfers(self, sender_id: str) -> List[str]:
+        """IDs of unfinished incoming transfers from a peer"""
+        with self.lock:
+            return [file_id for file_id in self.partials
+                    if self.files.get(file_id, {}).get("sender_id") == sender_id]
+    
+    def register_outgoing(self, file_id: str, source: Union[str, os.PathLike, StoredFile], recipients: List[str],
+                          file_size: int, chunk_size: int):
+        """Remember where a file being sent lives, so missing chunks can be resent later"""
+        with self.lock:
+            transfer = {
+                "recipients": list(recipients),
+                "file_size": file_size,
+                "chunk_size": chunk_size,
+                "created_at": datetime.utcnow().timestamp()
+            }
+            if isinstance(source, StoredFile):
+                transfer["stored_file_id"] = source.file_id
+            else:
+                transfer["path"] = str(Path(source).resolve())
+            self.outgoing[file_id] = transfer
+            self._save_outgoing()
+    
+    def outgoing_source(self, transfer: Dict) -> Union[Path, StoredFile, None]:
+        """What to read an outgoing transfer's chunks from, or None if it is gone"""
+        if "stored_file_id" in transfer:
+            return self.get_stored_file(transfer["stored_file_id"])
+        path = Path(transfer.get("path", ""))
+        return path if path.is_file() else None
+    
+    def get_outgoing(self, file_id: str, recipient_id: str) -> Optional[Dict]:
+        with self.lock:
+            transfer = self.outgoing.get(file_id)
+            if transfer and recipient_id in transfer["recipients"]:
+                return dict(transfer)
+            return None
+    
+    def finish_outgoing(self, file_id: str, recipient_id: str) -> bool:
+        """A recipient has the whole file; forget the transfer once every recipient does.
+
+        Returns True if that was the last recipient.
+        """
+        with self.lock:
+            transfer = self.outgoing.get(file_id)
+            if not transfer or recipient_id not in transfer["recipients"]:
+                return False
+            transfer["recipients"].remove(recipient_id)
+            if not transfer["recipients"]:
+                del self.outgoing[file_id]
+            self._save_outgoing()
+            return file_id not in self.outgoing
+    
+    def _schedule_ingest(self, file_id: str, sizes: Optional[List[int]] = None):
+        """Queue a completed file to be moved into the chunk store by the ingest thread"""
+        if not self.dedup:
+            return
+        self.ingest_queue.put((file_id, sizes))
+        with self.lock:
+            if self.ingest_thread is None:
+                self.ingest_thread = threading.Thread(target=self._ingest_loop, name="file-ingest")
+                self.ingest_thread.daemon = True
+                self.ingest_thread.start()
+    
+    def _ingest_loop(self):
+        while True:
+            item = self.ingest_queue.get()
+            try:
+                if item is None:
+                    return
+                self.ingest(*item)
+            except Exception as e:
+                logger.error(f"Error moving {item[0]} into the chunk store: {e}", exc_info=True)
+            finally:
+                self.ingest_queue.task_done()
+    
+    def wait_for_ingest(self, timeout: float = 30.0) -> bool:
+        """Wait until every queued file has been moved into the chunk store"""
+        deadline = time.monotonic() + timeout
+        while self.ingest_queue.unfinished_tasks:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+    
+    def ingest(self, file_id: str, sizes: Optional[List[int]] = None) -> bool:
+        """Move a completed file into the chunk store and replace it with a manifest.
+
+        The file is split at ``sizes`` (the sender's chunk boundaries) when
+        they add up to its size, and by content-defined chunking otherwise.
+        Chunking and hashing happen without the lock; the manifest is made
+        durable before the whole file is removed.
+        """
+        with self.lock:
+            file_info = self.files.get(file_id)
+            if not file_info or file_info.get("status") != "completed" or file_info.get("storage") == "chunks":
+                return False
+            file_path = Path(file_info.get("file_path") or self.storage_dir / file_id)
+        
+        manifest: Manifest = []
+        digest = hashlib.sha256()
+        manifest_path = self._manifest_path(file_id)
+        try:
+            with open(file_path, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                if sizes is not None and sum(sizes) != stat.st_size:
+                    sizes = None
+                for chunk in (split_chunks(f, sizes) if sizes is not None else cdc_chunks(f)):
+                    digest.update(chunk)
+                    manifest.append([self.chunk_store.add(chunk), len(chunk)])
+            tmp_path = manifest_path.with_name(manifest_path.name + ".tmp")
+            with open(tmp_path, 'w') as f:
+                json.dump(manifest, f, separators=(",", ":"))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, manifest_path)
+        except OSError as e:
+            logger.error(f"Failed to move {file_id} into the chunk store: {e}")
+            self.chunk_store.release(manifest)
+            return False
+        
+        with self.lock:
+            file_info = self.files.get(file_id)
+            if not file_info or file_info.get("storage") == "chunks":
+                # Deleted (or stored) while we were chunking it
+                self.chunk_store.release(manifest)
+                if not file_info:
+                    manifest_path.unlink(missing_ok=True)
+                return False
+            file_info["storage"] = "chunks"
+            file_info["chunks"] = len(manifest)
+            file_info["sha256"] = digest.hexdigest()
+            file_info["mtime"] = stat.st_mtime
+            file_info.pop("file_path", None)
+            self._save_metadata()
+            file_path.unlink(missing_ok=True)
+            self.stats["files_chunked"] += 1
+        logger.debug(f"Stored {file_id} as {len(manifest)} chunks")
+        return True
+    
+    def get_stats(self) -> Dict:
+        """Get file storage statistics, including chunk store deduplication"""
+        with self.lock:
+            return {
+                **self.stats,
+                "files": len(self.files),
+                "receiving": len(self.partials),
+                "outgoing": len(self.outgoing),
+                "pending_ingest": self.ingest_queue.unfinished_tasks,
+                "chunk_store": self.chunk_store.get_stats()
+            }
+    
+    def close(self):
+        """Checkpoint unfinished incoming transfers so they can resume after a restart"""
+        with self.lock:
+            partials = list(self.partials.values())
+            ingest_thread, self.ingest_thread = self.ingest_thread, None
+        for partial in partials:
+            try:
+                partial.checkpoint()
+            except OSError as e:
+                logger.warning(f"Failed to checkpoint {partial.path.name}: {e}")
+        if ingest_thread:
+            # Files still queued are picked up again on the next start
+            self.ingest_queue.put(None)
+            ingest_thread.join(timeout=5)
+    
     @staticmethod
     def generate_file_id(filename: str, sender_id: str) -> str:
         """Generate a unique file ID"""
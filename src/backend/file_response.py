@@ -0,0 +1,218 @@
+import os
+import uuid
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import Response
+
+from src.backend.file_manager import StoredFile
+
+MAX_RANGES = 16  # more ranges than this in one request is treated as no Range at all
+READ_BLOCK_SIZE = 256 * 1024
+ZEROCOPY_EXTENSION = "http.response.zerocopysend"
+
+# A body segment is literal bytes (multipart headers) or a (offset, length) slice of the file
+Segment = Union[bytes, Tuple[int, int]]
+Source = Union[Path, StoredFile]
+
+
+def parse_range(header: str, size: int) -> Optional[List[Tuple[int, int]]]:
+    """Parse a ``Range`` header into sorted, merged, inclusive (start, end) byte ranges.
+
+    Returns None when the header is malformed or not in bytes (the whole
+    file should be served) and an empty list when no range is satisfiable.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes":
+        return None
+    ranges = []
+    parts = [part.strip() for part in spec.split(",") if part.strip()]
+    if not parts or len(parts) > MAX_RANGES:
+        return None
+    for part in parts:
+        first, dash, last = part.partition("-")
+        if not dash:
+            return None
+        try:
+            if not first.strip():
+                length = int(last)
+                if length < 0:
+                    return None
+                if length == 0 or size == 0:
+                    continue
+                start, end = max(0, size - length), size - 1
+            else:
+                start = int(first)
+                end = int(last) if last.strip() else None
+                if start < 0 or (end is not None and end < start):
+                    return None
+                if start >= size:
+                    continue
+                end = size - 1 if end is None else min(end, size - 1)
+        except ValueError:
+            return None
+        ranges.append((start, end))
+
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    """Weak comparison, as If-None-Match requires"""
+    if header.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in header.split(",")]
+    return etag in [tag[2:] if tag.startswith("W/") else tag for tag in candidates]
+
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _fileno(f) -> Optional[int]:
+    """The OS file descriptor behind a file object, if it has one (chunk store files do not)"""
+    try:
+        return f.fileno()
+    except (OSError, ValueError):
+        return None
+
+
+class FileRangeResponse(Response):
+    """Sends byte segments of a file without loading it into memory.
+
+    If the ASGI server offers the zero-copy send extension and the file is
+    one file on disk, the file slices are handed to it (which uses
+    ``os.sendfile``); otherwise they are read in bounded blocks in the
+    threadpool.
+    """
+
+    def __init__(self, source: Source, segments: List[Segment], status_code: int,
+                 headers: Dict[str, str], media_type: str):
+        self.source = source
+        self.segments = segments
+        self.status_code = status_code
+        self.media_type = media_type
+        self.background = None
+        length = sum(len(s) if isinstance(s, bytes) else s[1] for s in segments)
+        self.init_headers({**headers, "content-length": str(length)})
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope.get("method") == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        f = self.source.open() if isinstance(self.source, StoredFile) else open(self.source, "rb")
+        with f:
+            fd = _fileno(f)
+            zerocopy = fd is not None and ZEROCOPY_EXTENSION in scope.get("extensions", {})
+            for segment in self.segments:
+                if isinstance(segment, bytes):
+                    await send({"type": "http.response.body", "body": segment, "more_body": True})
+                    continue
+                offset, remaining = segment
+                if zerocopy:
+                    await send({"type": ZEROCOPY_EXTENSION, "file": f, "offset": offset,
+                                "count": remaining, "more_body": True})
+                    continue
+                while remaining > 0:
+                    block = await run_in_threadpool(self._read_at, f, fd, offset, min(READ_BLOCK_SIZE, remaining))
+                    if not block:
+                        break  # the file shrank under us; the client sees a short body
+                    offset += len(block)
+                    remaining -= len(block)
+                    await send({"type": "http.response.body", "body": block, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    @staticmethod
+    def _read_at(f, fd: Optional[int], offset: int, length: int) -> bytes:
+        if fd is not None and hasattr(os, "pread"):
+            return os.pread(fd, length, offset)
+        f.seek(offset)
+        return f.read(length)
+
+
+def file_response(request: Request, source: Source, media_type: str, filename: Optional[str] = None,
+                  disposition: Optional[str] = "attachment", etag: Optional[str] = None,
+                  headers: Optional[Dict[str, str]] = None) -> Response:
+    """Serve a file with ETag/Last-Modified validation and single or multi-part Range support.
+
+    ``source`` is a path or a stored file. ``etag`` should be a content hash
+    when one is known; otherwise one is derived from the file's size and
+    modification time.
+    """
+    if isinstance(source, StoredFile):
+        size, mtime = source.size, source.mtime
+    else:
+        stat = os.stat(source)
+        size, mtime = stat.st_size, stat.st_mtime
+    etag = f'"{etag}"' if etag else f'"{size:x}-{int(mtime * 1e9):x}"'
+    last_modified = formatdate(mtime, usegmt=True)
+    base_headers = {"accept-ranges": "bytes", "etag": etag, "last-modified": last_modified, **(headers or {})}
+    if disposition and filename:
+        base_headers["content-disposition"] = f'{disposition}; filename="{filename}"'
+
+    if _not_modified(request, etag, mtime):
+        return Response(status_code=304, headers={"etag": etag, "last-modified": last_modified})
+
+    ranges = None
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    # If-Range: only honour the Range if the client's copy is still current
+    if range_header and (if_range is None or if_range.strip() in (etag, last_modified)):
+        ranges = parse_range(range_header, size)
+
+    return _ranged_response(source, size, ranges, base_headers, media_type)
+
+
+def prefix_response(request: Request, path: Path, length: int, media_type: str,
+                    headers: Optional[Dict[str, str]] = None) -> Response:
+    """Serve the first ``length`` bytes of a file that is still being written, with Range support.
+
+    The prefix is what has fully arrived of an incoming transfer; it grows,
+    so it is served as a representation of ``length`` bytes and never
+    validated as cacheable.
+    """
+    base_headers = {"accept-ranges": "bytes", "cache-control": "no-store", **(headers or {})}
+    range_header = request.headers.get("range")
+    ranges = parse_range(range_header, length) if range_header else None
+    return _ranged_response(path, length, ranges, base_headers, media_type)
+
+
+def _ranged_response(source: Source, size: int, ranges: Optional[List[Tuple[int, int]]],
+                     base_headers: Dict[str, str], media_type: str) -> Response:
+    """The whole file (``ranges`` None), a 416, or one or several of its byte ranges"""
+    if ranges is None:
+        return FileRangeResponse(source, [(0, size)], 200, base_headers, media_type)
+    if not ranges:
+        return Response(status_code=416, headers={"content-range": f"bytes */{size}", "accept-ranges": "bytes"})
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        base_headers["content-range"] = f"bytes {start}-{end}/{size}"
+        return FileRangeResponse(source, [(start, end - start + 1)], 206, base_headers, media_type)
+
+    boundary = uuid.uuid4().hex
+    segments: List[Segment] = []
+    for start, end in ranges:
+        segments.append((f"--{boundary}\r\nContent-Type: {media_type}\r\n"
+                         f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n").encode("latin-1"))
+        segments.append((start, end - start + 1))
+        segments.append(b"\r\n")
+    segments.append(f"--{boundary}--\r\n".encode("latin-1"))
+    return FileRangeResponse(source, segments, 206, base_headers, f"multipart/byteranges; boundary={boundary}")
@@ -0,0 +1,75 @@
+import hashlib
+from typing import Iterable, List
+
+# Leaves and inner nodes get different prefixes (as in RFC 6962), so an inner
+# node can never be passed off as a chunk or the other way round
+LEAF_PREFIX = b"\x00"
+NODE_PREFIX = b"\x01"
+
+
+def leaf_hash(chunk: bytes) -> bytes:
+    digest = hashlib.sha256(LEAF_PREFIX)
+    digest.update(chunk)
+    return digest.digest()
+
+
+def _node_hash(left: bytes, right: bytes) -> bytes:
+    return hashlib.sha256(NODE_PREFIX + left + right).digest()
+
+
+class MerkleTree:
+    """Binary SHA-256 hash tree over the chunks of a file.
+
+    A node without a sibling is carried up to the next level unchanged. The
+    root identifies the whole file; ``proof`` gives the sibling hashes that
+    let a receiver check one chunk against the root on its own, so every
+    chunk can be verified as it arrives.
+    """
+
+    def __init__(self, leaves: List[bytes]):
+        self.count = len(leaves)
+        self.levels = [leaves]
+        level = leaves
+        while len(level) > 1:
+            level = [_node_hash(level[i], level[i + 1]) if i + 1 < len(level) else level[i]
+                     for i in range(0, len(level), 2)]
+            self.levels.append(level)
+
+    @classmethod
+    def from_chunks(cls, chunks: Iterable[bytes]) -> "MerkleTree":
+        return cls([leaf_hash(chunk) for chunk in chunks])
+
+    @property
+    def root(self) -> str:
+        top = self.levels[-1]
+        return (top[0] if top else hashlib.sha256(b"").digest()).hex()
+
+    def proof(self, index: int) -> List[str]:
+        """Sibling hashes from the leaf at ``index`` up to the root"""
+        proof = []
+        for level in self.levels[:-1]:
+            sibling = index ^ 1
+            if sibling < len(level):
+                proof.append(level[sibling].hex())
+            index //= 2
+        return proof
+
+
+def verify_proof(leaf: bytes, index: int, count: int, proof: List[str], root: str) -> bool:
+    """Check that ``leaf`` is chunk ``index`` of ``count`` in the tree with this root"""
+    if not 0 <= index < count or not isinstance(proof, list):
+        return False
+    node = leaf
+    siblings = iter(proof)
+    size = count
+    try:
+        while size > 1:
+            if index % 2:
+                node = _node_hash(bytes.fromhex(next(siblings)), node)
+            elif index + 1 < size:
+                node = _node_hash(node, bytes.fromhex(next(siblings)))
+            index //= 2
+            size = (size + 1) // 2
+    except (StopIteration, TypeError, ValueError):
+        return False
+    return next(siblings, None) is None and node.hex() == root
@@ -0,0 +1,95 @@
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, List, Tuple
+
+from src.core.message_protocol import MessageType
+
+# Rough per-object overhead so the estimate tracks real memory, not just text
+_OBJECT_OVERHEAD = 64
+
+
+def estimate_size(value: Any) -> int:
+    """Approximate memory held by a JSON-like value"""
+    if isinstance(value, str):
+        return _OBJECT_OVERHEAD + len(value)
+    if isinstance(value, dict):
+        return _OBJECT_OVERHEAD + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return _OBJECT_OVERHEAD + sum(estimate_size(v) for v in value)
+    return 32
+
+
+def summarize_payload(payload: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
+    """Replace bulk file data with a compact summary; returns (payload, summarized)"""
+    content = payload.get("content") or {}
+    # Already-summarized payloads carry no chunk_data and pass through unchanged
+    if payload.get("type") != MessageType.FILE_TRANSFER_CHUNK.value or "chunk_data" not in content:
+        return payload, False
+
+    chunk_data = content.get("chunk_data") or ""
+    summary = {key: value for key, value in payload.items() if key != "content"}
+    summary["content"] = {
+        "file_id": content.get("file_id"),
+        "chunk_index": content.get("chunk_index"),
+        "size": len(chunk_data) * 3 // 4,  # decoded size, from the base64 length
+        "is_last": content.get("is_last", False)
+    }
+    return summary, True
+
+
+class MessageHistory:
+    """Recent message log bounded by both entry count and estimated bytes.
+
+    File chunk payloads are never retained: they are recorded as a summary
+    (file_id, chunk_index, size), so a large transfer costs a few hundred
+    bytes per chunk of history instead of pinning the base64 data.
+    """
+
+    def __init__(self, max_entries: int = 1000, max_bytes: int = 4 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries: Deque[Tuple[Dict[str, Any], int]] = deque()  # newest first
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.stats = {"recorded": 0, "summarized": 0, "evicted": 0}
+
+    def record(self, entry: Dict[str, Any]):
+        """Add an entry ({"direction", "payload", ...}) to the front of the history"""
+        payload, summarized = summarize_payload(entry.get("payload") or {})
+        if summarized:
+            entry = {**entry, "payload": payload}
+        size = estimate_size(entry)
+
+        with self.lock:
+            self.entries.appendleft((entry, size))
+            self.total_bytes += size
+            self.stats["recorded"] += 1
+            if summarized:
+                self.stats["summarized"] += 1
+            # Always keep the newest entry, even if it alone exceeds the budget
+            while len(self.entries) > 1 and (len(self.entries) > self.max_entries
+                                             or self.total_bytes > self.max_bytes):
+                _, evicted_size = self.entries.pop()
+                self.total_bytes -= evicted_size
+                self.stats["evicted"] += 1
+
+    def get(self, limit: int = 100) -> List[Dict[str, Any]]:
+        """Newest entries first"""
+        with self.lock:
+            result = []
+            for entry, _ in self.entries:
+                if len(result) >= limit:
+                    break
+                result.append(entry)
+            return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get history statistics, including estimated memory use"""
+        with self.lock:
+            return {
+                **self.stats,
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "memory_bytes": self.total_bytes,
+                "max_bytes": self.max_bytes
+            }
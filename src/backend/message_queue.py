@@ -1,94 +1,382 @@
-import queue
+import math
 import threading
-from typing import Optional, Callable, Dict, Any
+from collections import OrderedDict, deque
+from typing import Optional, Callable, Dict, Any, Deque, List, Set, Tuple
 import logging
-from datetime import datetime
 import time
 
+from src.backend.metrics import LatencyHistogram
+
+BROADCAST = "*"  # sub-queue key for messages without a recipient
+MAX_RETRY_AFTER = 60  # seconds; cap on the back-off hint given to rejected producers
+
+
+class TimerWheel:
+    """Hashed timer wheel: O(1) scheduling, expiry checked once per tick.
+
+    The wheel is passive; its owner calls ``advance`` once per ``tick`` and
+    gets back the items that became due.
+    """
+
+    def __init__(self, tick: float = 0.1, slots: int = 512):
+        self.tick = tick
+        self.slots: List[List[list]] = [[] for _ in range(slots)]
+        self.current = 0
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def schedule(self, delay: float, item: Any):
+        """Make ``item`` due after roughly ``delay`` seconds (rounded up to a tick)"""
+        ticks = max(1, math.ceil(delay / self.tick))
+        with self.lock:
+            index = (self.current + ticks) % len(self.slots)
+            rounds = (ticks - 1) // len(self.slots)
+            self.slots[index].append([rounds, item])
+            self.size += 1
+
+    def advance(self) -> List[Any]:
+        """Move one tick forward and return the items due now"""
+        with self.lock:
+            self.current = (self.current + 1) % len(self.slots)
+            slot = self.slots[self.current]
+            if not slot:
+                return []
+            due = [item for rounds, item in slot if rounds == 0]
+            self.slots[self.current] = [[rounds - 1, item] for rounds, item in slot if rounds > 0]
+            self.size -= len(due)
+            return due
+
+    def __len__(self) -> int:
+        return self.size
+
+
 class MessageQueue:
-    """Thread-safe message queue with priority support"""
-    
-    def __init__(self, max_size: int = 1000):
-        self.queue = queue.PriorityQueue(maxsize=max_size)
-        self.processing_thread = None
+    """Thread-safe outgoing message queue with priorities and per-peer fairness.
+
+    Messages wait in one sub-queue per (priority, recipient). A pool of sender
+    workers serves the highest non-empty priority, rotating round-robin across
+    its recipients, so one busy peer cannot starve the others. At most one
+    message per recipient is in flight at a time, which keeps each peer's
+    messages in order. Failed sends are retried with exponential backoff from
+    a timer wheel instead of being requeued immediately; the recipient stays
+    parked until then and the retries go back at the head of its sub-queue,
+    so later messages cannot overtake them.
+
+    The handler signals failure by raising or by returning ``False``. An
+    optional batch handler lets a worker take up to ``max_batch`` queued
+    messages for the same recipient and priority at once, so they can share
+    one write; the batch succeeds or fails (and is retried) as a whole.
+
+    The depth counts every message the queue holds: waiting, in flight or
+    waiting for a retry. Producers see backpressure through two watermarks: once the depth reaches
+    ``high_watermark`` the queue is saturated and rejects new messages until
+    workers drain it down to ``low_watermark``. ``put_message`` can wait a
+    bounded time for that, and ``retry_after`` estimates from the measured
+    drain rate how long a rejected producer should back off.
+    """
+
+    def __init__(self, max_size: int = 1000, num_workers: int = 4, max_retries: int = 3,
+                 retry_base_delay: float = 0.5, retry_max_delay: float = 30.0,
+                 high_watermark: Optional[int] = None, low_watermark: Optional[int] = None,
+                 max_batch: int = 64):
+        self.max_size = max_size
+        self.high_watermark = min(high_watermark or max_size, max_size)
+        self.low_watermark = min(low_watermark if low_watermark is not None else self.high_watermark * 3 // 4,
+                                 self.high_watermark - 1)
+        self.num_workers = max(1, num_workers)
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.workers: List[threading.Thread] = []
+        self.timer_thread: Optional[threading.Thread] = None
         self.is_running = False
         self.message_handler: Optional[Callable] = None
+        self.batch_handler: Optional[Callable] = None
+        self.max_batch = max(1, max_batch)
         self.lock = threading.RLock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
         self.logger = logging.getLogger('MessageQueue')
-        
-        # Statistics
+
+        # (priority, recipient) -> FIFO of (priority, enqueued_at, message)
+        self.backlog: Dict[Tuple[int, str], Deque[tuple]] = {}
+        # priority -> recipients with backlog at that priority that are not in flight, in service order
+        self.ready: Dict[int, "OrderedDict[str, None]"] = {}
+        self.recipient_priorities: Dict[str, Set[int]] = {}
+        self.in_flight: Set[str] = set()
+        self.size = 0  # queued, in-flight and retry-pending messages
+        self.saturated = False  # set at the high watermark, cleared at the low one
+        self.retry_wheel = TimerWheel()
+        self.dequeued = 0
+        self.drain_rate = 0.0  # messages/second taken by workers, smoothed
+
+        # Statistics (guarded by self.lock)
         self.stats = {
             "messages_processed": 0,
             "messages_failed": 0,
-            "queue_full_events": 0
+            "queue_full_events": 0,
+            "retries_scheduled": 0,
+            "retries_exhausted": 0,
+            "batches_sent": 0
         }
-    
-    def start(self, message_handler: Callable):
-        """Start the message queue processor"""
+        self.send_latency = LatencyHistogram()  # first enqueue -> successful send
+
+    def start(self, message_handler: Callable, batch_handler: Optional[Callable] = None):
+        """Start the sender workers and the retry timer"""
         self.message_handler = message_handler
+        self.batch_handler = batch_handler
         self.is_running = True
-        
-        self.processing_thread = threading.Thread(target=self._process_messages)
-        self.processing_thread.daemon = True
-        self.processing_thread.start()
-        
-        self.logger.info("Message queue started")
-    
+
+        for index in range(self.num_workers):
+            worker = threading.Thread(target=self._process_messages, name=f"sender-{index}")
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+        self.timer_thread = threading.Thread(target=self._timer_loop, name="sender-retries")
+        self.timer_thread.daemon = True
+        self.timer_thread.start()
+
+        self.logger.info(f"Message queue started with {self.num_workers} workers")
+
     def stop(self):
         """Stop the message queue"""
         self.is_running = False
-        if self.processing_thread:
-            self.processing_thread.join(timeout=5)
+        with self.not_empty:
+            self.not_empty.notify_all()
+            self.not_full.notify_all()
+        for thread in self.workers + [self.timer_thread]:
+            if thread:
+                thread.join(timeout=5)
+        self.workers = []
         self.logger.info("Message queue stopped")
-    
-    def put_message(self, message: Any, priority: int = 5) -> bool:
-        """Add message to queue with priority (1=highest, 10=lowest)"""
-        try:
-            # Create priority item (priority, timestamp, message)
-            # Using timestamp ensures FIFO for same priority
-            item = (priority, time.time(), message)
-            
-            self.queue.put(item, block=False)
+
+    def put_message(self, message: Any, priority: int = 5, timeout: float = 0.0) -> bool:
+        """Add message to queue with priority (1=highest, 10=lowest).
+
+        If the queue is saturated, waits up to ``timeout`` seconds for it to
+        drain to the low watermark; returns False if it does not.
+        """
+        with self.not_empty:
+            if self.saturated and timeout > 0:
+                self.not_full.wait_for(lambda: not self.saturated or not self.is_running, timeout)
+            if self.saturated:
+                self.stats["queue_full_events"] += 1
+                self.logger.warning("Message queue is full")
+                return False
+            self._enqueue((priority, time.time(), message))
+            if self.size >= self.high_watermark:
+                self.saturated = True
             return True
-            
-        except queue.Full:
-            self.stats["queue_full_events"] += 1
-            self.logger.warning("Message queue is full")
-            return False
-    
+
+    def put_messages(self, messages: List[Any], priority: int = 5, timeout: float = 0.0) -> int:
+        """Add several messages under one lock acquisition.
+
+        Waits like ``put_message`` if the queue is saturated, then accepts
+        messages in order while there is room (up to ``max_size``). Returns
+        how many were accepted; the rest were rejected.
+        """
+        with self.not_empty:
+            if self.saturated and timeout > 0:
+                self.not_full.wait_for(lambda: not self.saturated or not self.is_running, timeout)
+            accepted = 0
+            if not self.saturated:
+                enqueued_at = time.time()
+                accepted = min(len(messages), self.max_size - self.size)
+                for message in messages[:accepted]:
+                    self._enqueue((priority, enqueued_at, message))
+                if self.size >= self.high_watermark:
+                    self.saturated = True
+            if accepted < len(messages):
+                self.stats["queue_full_events"] += 1
+                self.logger.warning(f"Message queue is full, rejected {len(messages) - accepted} messages")
+            return accepted
+
+    def retry_after(self) -> int:
+        """Seconds until the queue is expected to accept messages again"""
+        with self.lock:
+            if not self.saturated:
+                return 0
+            excess = max(1, self.size - self.low_watermark)
+            if self.drain_rate <= 0:
+                return MAX_RETRY_AFTER
+            return max(1, min(MAX_RETRY_AFTER, math.ceil(excess / self.drain_rate)))
+
+    @staticmethod
+    def _recipient(message: Any) -> str:
+        return getattr(message, "recipient_id", None) or BROADCAST
+
+    def _enqueue(self, item: tuple, retry: bool = False):
+        """Append an item to its sub-queue, or put a retry back at its head (caller holds the lock)"""
+        priority, _, message = item
+        recipient = self._recipient(message)
+        key = (priority, recipient)
+        if key not in self.backlog:
+            self.backlog[key] = deque()
+            self.recipient_priorities.setdefault(recipient, set()).add(priority)
+            if recipient not in self.in_flight:
+                self.ready.setdefault(priority, OrderedDict())[recipient] = None
+        if retry:
+            # Already counted in size; it goes back in front of everything queued after it
+            self.backlog[key].appendleft(item)
+        else:
+            self.backlog[key].append(item)
+            self.size += 1
+        self.not_empty.notify()
+
+    def _take(self) -> Optional[List[tuple]]:
+        """Pop the next items: highest priority first, round-robin across recipients (caller holds the lock).
+
+        Returns a single item, or up to ``max_batch`` items for one recipient
+        when a batch handler is set.
+        """
+        priorities = [p for p, ring in self.ready.items() if ring]
+        if not priorities:
+            return None
+        priority = min(priorities)
+        ring = self.ready[priority]
+        recipient, _ = ring.popitem(last=False)
+        key = (priority, recipient)
+        items = self.backlog[key]
+        count = min(len(items), self.max_batch) if self.batch_handler else 1
+        taken = [items.popleft() for _ in range(count)]
+        if not items:
+            del self.backlog[key]
+            self.recipient_priorities[recipient].discard(priority)
+        # Park the recipient everywhere until this send finishes, preserving per-peer order
+        for other in self.recipient_priorities.get(recipient, ()):
+            other_ring = self.ready.get(other)
+            if other_ring:
+                other_ring.pop(recipient, None)
+        self.in_flight.add(recipient)
+        self.dequeued += count
+        return taken
+
+    def _settle(self, count: int):
+        """Forget messages that were sent or given up on (caller holds the lock)"""
+        self.size -= count
+        if self.saturated and self.size <= self.low_watermark:
+            self.saturated = False
+            self.not_full.notify_all()
+
+    def _release(self, recipient: str):
+        """Requeue a recipient behind its peers once its send is done (caller holds the lock)"""
+        self.in_flight.discard(recipient)
+        priorities = self.recipient_priorities.get(recipient)
+        if not priorities:
+            self.recipient_priorities.pop(recipient, None)
+            return
+        for priority in priorities:
+            self.ready.setdefault(priority, OrderedDict())[recipient] = None
+        self.not_empty.notify()
+
     def _process_messages(self):
-        """Process messages from the queue"""
+        """Sender worker: take, send, then retry or record latency"""
         while self.is_running:
-            try:
-                # Get message with timeout to allow checking is_running
-                priority, timestamp, message = self.queue.get(timeout=1)
-                
-                # Process message
-                if self.message_handler:
-                    try:
-                        self.message_handler(message)
-                        self.stats["messages_processed"] += 1
-                        message.status = "sent"
-                        
-                    except Exception as e:
-                        self.logger.error(f"Error processing message {message.message_id}: {e}")
-                        self.stats["messages_failed"] += 1
-                        message.status = "failed"
-                        message.retry_count += 1
-                        
-                        # Retry logic (simple version for week 1)
-                        if message.retry_count < 3:
-                            self.put_message(message, priority=8)  # Lower priority for retry
-                
-            except queue.Empty:
+            with self.not_empty:
+                items = self._take()
+                while items is None and self.is_running:
+                    self.not_empty.wait(timeout=1)
+                    items = self._take()
+            if items is None:
                 continue
+
+            retry = None
+            try:
+                retry = self._send(items)
             except Exception as e:
                 self.logger.error(f"Unexpected error in message processor: {e}")
-    
+            finally:
+                with self.not_empty:
+                    if retry:
+                        # The recipient stays parked until its retries are due
+                        delay, retries = retry
+                        self._settle(len(items) - len(retries))
+                        self.retry_wheel.schedule(delay, retries)
+                    else:
+                        self._settle(len(items))
+                        self._release(self._recipient(items[0][2]))
+
+    def _send(self, items: List[tuple]) -> Optional[Tuple[float, List[tuple]]]:
+        """Send items; on failure returns the retry delay and the items to retry"""
+        if not self.message_handler:
+            return None
+        try:
+            if len(items) > 1:
+                failed = self.batch_handler([message for _, _, message in items]) is False
+            else:
+                failed = self.message_handler(items[0][2]) is False
+            error = "handler reported failure"
+        except Exception as e:
+            failed = True
+            error = str(e)
+
+        if not failed:
+            now = time.time()
+            for _, enqueued_at, message in items:
+                message.status = "sent"
+                self.send_latency.observe(now - enqueued_at)
+            with self.lock:
+                self.stats["messages_processed"] += len(items)
+                if len(items) > 1:
+                    self.stats["batches_sent"] += 1
+            return None
+
+        retries = []
+        for item in items:
+            message = item[2]
+            self.logger.error(f"Error processing message {message.message_id}: {error}")
+            message.status = "failed"
+            message.retry_count += 1
+            with self.lock:
+                self.stats["messages_failed"] += 1
+                if message.retry_count >= self.max_retries:
+                    self.stats["retries_exhausted"] += 1
+                    continue
+                self.stats["retries_scheduled"] += 1
+            # Same priority and original enqueue time, so order and latency stay true
+            retries.append(item)
+        if not retries:
+            return None
+        attempts = max(item[2].retry_count for item in retries)
+        return min(self.retry_base_delay * 2 ** (attempts - 1), self.retry_max_delay), retries
+
+    def _timer_loop(self):
+        """Advance the retry wheel, put due retries back in their sub-queues and sample the drain rate"""
+        next_tick = time.monotonic()
+        last_sample, last_dequeued = next_tick, 0
+        while self.is_running:
+            next_tick += self.retry_wheel.tick
+            time.sleep(max(0.0, next_tick - time.monotonic()))
+            due = self.retry_wheel.advance()
+            with self.not_empty:
+                for retries in due:
+                    for item in reversed(retries):
+                        self._enqueue(item, retry=True)
+                    self._release(self._recipient(retries[0][2]))
+                now = time.monotonic()
+                if now - last_sample >= 1.0:
+                    taken = self.dequeued - last_dequeued
+                    # An idle queue says nothing about how fast it drains; keep the last estimate
+                    if taken or self.size:
+                        rate = taken / (now - last_sample)
+                        self.drain_rate = rate if not self.drain_rate else 0.7 * self.drain_rate + 0.3 * rate
+                    last_sample, last_dequeued = now, self.dequeued
+
     def get_stats(self) -> Dict[str, Any]:
         """Get queue statistics"""
-        return {
-            **self.stats,
-            "queue_size": self.queue.qsize(),
-            "is_running": self.is_running
-        }
\ No newline at end of file
+        with self.lock:
+            return {
+                **self.stats,
+                "queue_size": self.size,
+                "max_size": self.max_size,
+                "high_watermark": self.high_watermark,
+                "low_watermark": self.low_watermark,
+                "saturated": self.saturated,
+                "drain_rate": round(self.drain_rate, 2),
+                "in_flight": len(self.in_flight),
+                "scheduled_retries": len(self.retry_wheel),
+                "workers": self.num_workers,
+                "is_running": self.is_running,
+                "send_latency": self.send_latency.snapshot()
+            }
@@ -0,0 +1,189 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import logging
+from typing import Any, Dict, List, Optional
+
+from src.backend.message_history import summarize_payload
+
+logger = logging.getLogger("MessageStore")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    message_id TEXT,
+    direction TEXT NOT NULL,
+    msg_type TEXT,
+    peer_id TEXT,
+    timestamp REAL NOT NULL,
+    entry TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp);
+CREATE INDEX IF NOT EXISTS idx_messages_peer ON messages (peer_id, id);
+CREATE INDEX IF NOT EXISTS idx_messages_type ON messages (msg_type, id);
+"""
+
+INSERT = ("INSERT INTO messages (id, message_id, direction, msg_type, peer_id, timestamp, entry) "
+          "VALUES (?, ?, ?, ?, ?, ?, ?)")
+
+
+class MessageStore:
+    """Persistent message log in SQLite (WAL mode).
+
+    ``record`` assigns the row ID immediately and hands the row to a background
+    writer that inserts in batches, one transaction per batch, so callers on
+    the message path never wait on disk. Row IDs increase monotonically and are
+    the pagination cursors for ``query``; rows become visible to queries once
+    the writer has flushed them (within ``flush_interval``).
+    """
+
+    def __init__(self, db_path: str = "data/messages.db", batch_size: int = 500,
+                 flush_interval: float = 0.2, max_pending: int = 10000):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending: queue.Queue = queue.Queue(maxsize=max_pending)
+        self.writer_thread: Optional[threading.Thread] = None
+        self.is_running = False
+        self.lock = threading.Lock()  # ID assignment and stats; never held across a query
+        self.stats = {"rows_written": 0, "batches": 0, "write_errors": 0, "last_batch_ms": 0.0}
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Readers use their own connection; WAL lets them run alongside the writer. The
+        # connection has its own lock, so a slow query never holds up ``record``
+        self.read_conn = self._connect()
+        self.read_lock = threading.Lock()
+        self.read_conn.executescript(SCHEMA)
+        row = self.read_conn.execute("SELECT MAX(id) FROM messages").fetchone()
+        self._next_id = (row[0] or 0) + 1
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def start(self):
+        """Start the background writer"""
+        self.is_running = True
+        self.writer_thread = threading.Thread(target=self._writer_loop)
+        self.writer_thread.daemon = True
+        self.writer_thread.start()
+        logger.info(f"Message store started ({self.db_path})")
+
+    def stop(self):
+        """Flush pending rows and stop the writer"""
+        self.is_running = False
+        if self.writer_thread:
+            self.writer_thread.join(timeout=5)
+
+    def record(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        """Queue a history entry for storage; returns it with its cursor ``id``"""
+        payload, summarized = summarize_payload(entry.get("payload") or {})
+        entry = {**entry, "payload": payload} if summarized else dict(entry)
+
+        if entry.get("direction") == "outgoing":
+            peer_id = payload.get("recipient_id")
+        else:
+            peer_id = payload.get("sender_id")
+
+        with self.lock:
+            entry["id"] = self._next_id
+            self._next_id += 1
+
+        row = (entry["id"], payload.get("message_id"), entry.get("direction", "incoming"),
+               payload.get("type"), peer_id, time.time(), json.dumps(entry))
+        # Blocks when the writer falls behind, pushing back on the message path
+        self.pending.put(row)
+        return entry
+
+    def flush(self):
+        """Wait until every queued row has been written"""
+        self.pending.join()
+
+    def _writer_loop(self):
+        conn = self._connect()
+        while self.is_running or not self.pending.empty():
+            try:
+                batch = [self.pending.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+
+            started = time.perf_counter()
+            try:
+                with conn:
+                    conn.executemany(INSERT, batch)
+                with self.lock:
+                    self.stats["rows_written"] += len(batch)
+                    self.stats["batches"] += 1
+                    self.stats["last_batch_ms"] = round((time.perf_counter() - started) * 1000, 3)
+            except sqlite3.Error as e:
+                logger.error(f"Failed to write {len(batch)} messages: {e}")
+                with self.lock:
+                    self.stats["write_errors"] += 1
+            finally:
+                for _ in batch:
+                    self.pending.task_done()
+        conn.close()
+
+    def query(self, limit: int = 100, before: Optional[int] = None, after: Optional[int] = None,
+              peer_id: Optional[str] = None, message_type: Optional[str] = None,
+              since: Optional[float] = None, until: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Query stored entries, newest first.
+
+        ``before``/``after`` are entry IDs (exclusive cursors); ``since``/``until``
+        are Unix timestamps of when the entry was recorded.
+        """
+        clauses = []
+        params: List[Any] = []
+        if before is not None:
+            clauses.append("id < ?")
+            params.append(before)
+        if after is not None:
+            clauses.append("id > ?")
+            params.append(after)
+        if peer_id:
+            clauses.append("peer_id = ?")
+            params.append(peer_id)
+        if message_type:
+            clauses.append("msg_type = ?")
+            params.append(message_type)
+        if since is not None:
+            clauses.append("timestamp >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("timestamp <= ?")
+            params.append(until)
+
+        # Paging forward from an `after` cursor walks up from it, then flips to newest-first
+        ascending = after is not None and before is None
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        sql = f"SELECT entry FROM messages {where} ORDER BY id {'ASC' if ascending else 'DESC'} LIMIT ?"
+        params.append(limit)
+
+        with self.read_lock:
+            rows = self.read_conn.execute(sql, params).fetchall()
+        entries = [json.loads(row[0]) for row in rows]
+        if ascending:
+            entries.reverse()
+        return entries
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get store statistics"""
+        with self.lock:
+            stats = {**self.stats, "pending": self.pending.qsize()}
+        try:
+            stats["db_bytes"] = os.path.getsize(self.db_path)
+        except OSError:
+            stats["db_bytes"] = 0
+        return stats
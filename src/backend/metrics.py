@@ -0,0 +1,57 @@
+import bisect
+import threading
+from typing import Any, Dict, Sequence
+
+# Bucket upper bounds in milliseconds; anything slower lands in the overflow bucket
+DEFAULT_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram; O(1) memory regardless of sample count"""
+
+    def __init__(self, buckets_ms: Sequence[float] = DEFAULT_BUCKETS_MS):
+        self.bounds = tuple(sorted(buckets_ms))
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        """Record one latency sample"""
+        ms = seconds * 1000
+        index = bisect.bisect_left(self.bounds, ms)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total_ms += ms
+            if ms > self.max_ms:
+                self.max_ms = ms
+
+    def _percentile(self, fraction: float) -> float:
+        """Upper bound of the bucket holding the given fraction of samples (capped at the max)"""
+        target = fraction * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= target:
+                bound = self.bounds[index] if index < len(self.bounds) else self.max_ms
+                return round(min(bound, self.max_ms), 3)
+        return round(self.max_ms, 3)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Counts per bucket ("le_<ms>") plus summary statistics"""
+        with self.lock:
+            buckets = {f"le_{bound:g}ms": n for bound, n in zip(self.bounds, self.counts)}
+            buckets["overflow"] = self.counts[-1]
+            if not self.count:
+                return {"count": 0, "buckets": buckets}
+            return {
+                "count": self.count,
+                "avg_ms": round(self.total_ms / self.count, 3),
+                "max_ms": round(self.max_ms, 3),
+                "p50_ms": self._percentile(0.5),
+                "p90_ms": self._percentile(0.9),
+                "p99_ms": self._percentile(0.99),
+                "buckets": buckets
+            }
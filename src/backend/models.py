@@ -54,6 +54,12 @@ class Message:
             "retry_count": self.retry_count
         }
     
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'Message':
+        data = dict(data)
+        data["timestamp"] = datetime.fromisoformat(data["timestamp"])
+        return cls(**data)
+    
     def to_wire_format(self) -> Dict[str, Any]:
         """Convert to format for network transmission"""
         return {
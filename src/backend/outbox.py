@@ -0,0 +1,258 @@
+import json
+import os
+import threading
+import logging
+from collections import OrderedDict, deque
+from itertools import islice
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Tuple
+
+logger = logging.getLogger("Outbox")
+
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".log"
+
+
+class Outbox:
+    """Persistent store-and-forward queue of messages for peers that are away.
+
+    Messages live in an append-only log of JSON-line segments. A ``put``
+    record adds a message for a recipient; an ``ack`` record marks that
+    recipient's messages up to a sequence number as delivered, so draining
+    in order never rewrites existing data. Replaying the segments on start
+    rebuilds the per-recipient queues, which is how the outbox survives a
+    restart. Once most of the log is dead (acked) data, ``compact`` rewrites
+    the live records into a fresh segment and deletes the old ones.
+
+    Records are flushed to the OS on every write, which survives a process
+    crash; segments are fsynced when they are rotated or compacted.
+
+    A message that was sent but awaits the peer's delivery ACK is ``hold``-ed:
+    it stays in the log but is no longer pending, and ``settle`` acks it once
+    the ACK (or a final failure) arrives. Holds are kept in memory only, so
+    after a restart such messages are pending again and get sent once more.
+    """
+
+    def __init__(self, directory: str = "data/outbox", max_per_recipient: int = 1000,
+                 max_recipients: int = 1000, segment_bytes: int = 4 * 1024 * 1024,
+                 compact_min_bytes: int = 1024 * 1024):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_per_recipient = max_per_recipient
+        self.max_recipients = max_recipients
+        self.segment_bytes = segment_bytes
+        self.compact_min_bytes = compact_min_bytes
+        self.lock = threading.RLock()
+
+        # recipient -> [(seq, raw put record)], oldest first
+        self.queues: Dict[str, Deque[Tuple[int, bytes]]] = {}
+        # recipient -> {seq: settled} for the oldest messages, sent and awaiting a delivery ACK
+        self.held: Dict[str, "OrderedDict[int, bool]"] = {}
+        self.next_seq = 1
+        self.live_bytes = 0
+        self.log_bytes = 0
+        self.stats = {"stored": 0, "delivered": 0, "rejected": 0, "compactions": 0}
+
+        self._load()
+        segment_ids = self._segment_ids()
+        self.segment_id = segment_ids[-1] if segment_ids else 1
+        self.active = open(self._segment_path(self.segment_id), "ab")
+
+    def _segment_path(self, segment_id: int) -> Path:
+        return self.directory / f"{SEGMENT_PREFIX}{segment_id:06d}{SEGMENT_SUFFIX}"
+
+    def _segment_ids(self) -> List[int]:
+        ids = []
+        for path in self.directory.glob(f"{SEGMENT_PREFIX}*{SEGMENT_SUFFIX}"):
+            try:
+                ids.append(int(path.name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]))
+            except ValueError:
+                continue
+        return sorted(ids)
+
+    def _load(self):
+        """Rebuild the per-recipient queues by replaying every segment"""
+        acked: Dict[str, int] = {}
+        for segment_id in self._segment_ids():
+            path = self._segment_path(segment_id)
+            self.log_bytes += path.stat().st_size
+            with open(path, "rb") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A torn final write from a crash; everything before it is intact
+                        logger.warning(f"Skipping unreadable outbox record in {path.name}")
+                        continue
+                    seq = record.get("seq", 0)
+                    self.next_seq = max(self.next_seq, seq + 1)
+                    recipient = record.get("recipient")
+                    if record.get("op") == "put":
+                        queue = self.queues.setdefault(recipient, deque())
+                        # A crash mid-compaction can leave records in both old and new segments
+                        if seq <= acked.get(recipient, 0) or (queue and seq <= queue[-1][0]):
+                            continue
+                        queue.append((seq, line.rstrip(b"\n")))
+                        self.live_bytes += len(line.rstrip(b"\n")) + 1
+                    elif record.get("op") == "ack":
+                        acked[recipient] = max(acked.get(recipient, 0), seq)
+                        self._drop_acked(recipient, seq)
+        self.queues = {recipient: queue for recipient, queue in self.queues.items() if queue}
+        pending = sum(len(q) for q in self.queues.values())
+        if pending:
+            logger.info(f"Outbox loaded {pending} pending messages for {len(self.queues)} peers")
+
+    def _drop_acked(self, recipient: str, upto: int) -> int:
+        queue = self.queues.get(recipient)
+        dropped = 0
+        held = self.held.get(recipient)
+        while queue and queue[0][0] <= upto:
+            seq, raw = queue.popleft()
+            self.live_bytes -= len(raw) + 1
+            dropped += 1
+            if held:
+                held.pop(seq, None)
+        if queue is not None and not queue:
+            del self.queues[recipient]
+        if held is not None and not held:
+            del self.held[recipient]
+        return dropped
+
+    def _append(self, record: Dict[str, Any]) -> bytes:
+        """Write one record to the active segment (caller holds the lock)"""
+        raw = json.dumps(record, separators=(",", ":")).encode("utf-8")
+        self.active.write(raw + b"\n")
+        self.active.flush()
+        self.log_bytes += len(raw) + 1
+        if self.active.tell() >= self.segment_bytes:
+            self._rotate()
+        return raw
+
+    def _rotate(self):
+        """Seal the active segment and start a new one"""
+        self.active.flush()
+        os.fsync(self.active.fileno())
+        self.active.close()
+        self.segment_id += 1
+        self.active = open(self._segment_path(self.segment_id), "ab")
+
+    def put(self, recipient: str, message: Dict[str, Any]) -> bool:
+        """Store a message for a recipient; False if its outbox is full"""
+        with self.lock:
+            queue = self.queues.get(recipient)
+            if (queue is not None and len(queue) >= self.max_per_recipient) or \
+                    (queue is None and len(self.queues) >= self.max_recipients):
+                self.stats["rejected"] += 1
+                logger.warning(f"Outbox full for {recipient}, rejecting message")
+                return False
+            seq = self.next_seq
+            self.next_seq += 1
+            raw = self._append({"op": "put", "seq": seq, "recipient": recipient, "message": message})
+            self.queues.setdefault(recipient, deque()).append((seq, raw))
+            self.live_bytes += len(raw) + 1
+            self.stats["stored"] += 1
+            return True
+
+    def peek(self, recipient: str, limit: int = 64) -> List[Tuple[int, Dict[str, Any]]]:
+        """Oldest pending (not held) messages for a recipient as (seq, message)"""
+        with self.lock:
+            queue = self.queues.get(recipient) or ()
+            skip = len(self.held.get(recipient) or ())
+            batch = list(islice(queue, skip, skip + limit))
+        return [(seq, json.loads(raw)["message"]) for seq, raw in batch]
+
+    def hold(self, recipient: str, seqs: List[int]):
+        """Mark peeked messages as sent and awaiting their delivery ACK"""
+        with self.lock:
+            held = self.held.setdefault(recipient, OrderedDict())
+            for seq in seqs:
+                held[seq] = False
+
+    def release(self, recipient: str, seqs: List[int]):
+        """Make held messages pending again (their send failed)"""
+        with self.lock:
+            held = self.held.get(recipient)
+            if held is None:
+                return
+            for seq in seqs:
+                held.pop(seq, None)
+            if not held:
+                del self.held[recipient]
+
+    def settle(self, recipient: str, seq: int):
+        """A held message was acknowledged (or given up on); ack every settled one in order"""
+        with self.lock:
+            held = self.held.get(recipient)
+            if not held or seq not in held:
+                return
+            held[seq] = True
+            upto = 0
+            for held_seq, settled in held.items():
+                if not settled:
+                    break
+                upto = held_seq
+            if upto:
+                self.ack(recipient, upto)
+
+    def ack(self, recipient: str, upto: int):
+        """Mark a recipient's messages up to ``upto`` as delivered"""
+        with self.lock:
+            delivered = self._drop_acked(recipient, upto)
+            if not delivered:
+                return
+            self._append({"op": "ack", "seq": upto, "recipient": recipient})
+            self.stats["delivered"] += delivered
+            if self.log_bytes >= self.compact_min_bytes and self.log_bytes > 2 * self.live_bytes:
+                self.compact()
+
+    def pending(self, recipient: str) -> int:
+        """Messages for a recipient that have not been sent yet (held ones excluded)"""
+        with self.lock:
+            queue = self.queues.get(recipient)
+            return len(queue) - len(self.held.get(recipient) or ()) if queue else 0
+
+    def recipients(self) -> List[str]:
+        with self.lock:
+            return list(self.queues)
+
+    def compact(self):
+        """Rewrite the live records into a new segment and delete the old ones"""
+        with self.lock:
+            old_ids = self._segment_ids()
+            self.active.close()
+            self.segment_id = (old_ids[-1] if old_ids else self.segment_id) + 1
+            path = self._segment_path(self.segment_id)
+            tmp_path = path.with_suffix(".tmp")
+            live = sorted((seq, raw) for queue in self.queues.values() for seq, raw in queue)
+            with open(tmp_path, "wb") as f:
+                for _, raw in live:
+                    f.write(raw + b"\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+            for segment_id in old_ids:
+                self._segment_path(segment_id).unlink()
+            self.active = open(path, "ab")
+            self.log_bytes = self.live_bytes = path.stat().st_size
+            self.stats["compactions"] += 1
+            logger.info(f"Compacted outbox to {len(live)} live messages ({self.log_bytes} bytes)")
+
+    def close(self):
+        with self.lock:
+            if not self.active.closed:
+                self.active.flush()
+                os.fsync(self.active.fileno())
+                self.active.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get outbox statistics"""
+        with self.lock:
+            return {
+                **self.stats,
+                "pending": sum(len(q) for q in self.queues.values()),
+                "held": sum(len(h) for h in self.held.values()),
+                "recipients": len(self.queues),
+                "live_bytes": self.live_bytes,
+                "log_bytes": self.log_bytes,
+                "segments": len(self._segment_ids())
+            }
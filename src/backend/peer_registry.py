@@ -3,15 +3,18 @@ from typing import Dict, List, Optional, Set
 from datetime import datetime, timedelta
 import logging
 from src.backend.models import Peer
+from src.backend.event_bus import PEER_STATUS
 
 
 class PeerRegistry:
     """In-memory registry of known peers"""
     
-    def __init__(self):
+    def __init__(self, event_bus=None):
         self.peers: Dict[str, Peer] = {}  # peer_id -> Peer
         self.lock = threading.RLock()
         self.logger = logging.getLogger('PeerRegistry')
+        # Optional EventBus notified of peer status changes
+        self.event_bus = event_bus
         
         # Cleanup thread for offline peers
         self.cleanup_interval = 60  # seconds
@@ -41,6 +44,7 @@ class PeerRegistry:
             
             action = "registered" if is_new else "updated"
             self.logger.info(f"Peer {peer.peer_id} {action}")
+            self._publish(peer)
             
             return is_new
     
@@ -63,22 +67,33 @@ class PeerRegistry:
         """Update peer status"""
         with self.lock:
             if peer_id in self.peers:
-                self.peers[peer_id].status = status
-                self.peers[peer_id].last_seen = datetime.now()
+                peer = self.peers[peer_id]
+                changed = peer.status != status
+                peer.status = status
+                peer.last_seen = datetime.now()
+                if changed:
+                    self._publish(peer)
     
     def mark_peer_seen(self, peer_id: str):
         """Update last seen timestamp"""
         with self.lock:
             if peer_id in self.peers:
-                self.peers[peer_id].last_seen = datetime.now()
-                self.peers[peer_id].status = "online"
+                peer = self.peers[peer_id]
+                peer.last_seen = datetime.now()
+                if peer.status != "online":
+                    peer.status = "online"
+                    self._publish(peer)
     
     def remove_peer(self, peer_id: str) -> bool:
         """Remove a peer from registry"""
         with self.lock:
             if peer_id in self.peers:
-                del self.peers[peer_id]
+                peer = self.peers.pop(peer_id)
+                peer_info = peer.to_dict()
+                peer_info["status"] = "removed"
                 self.logger.info(f"Peer {peer_id} removed")
+                if self.event_bus:
+                    self.event_bus.publish(PEER_STATUS, peer_info, key=peer_id)
                 return True
             return False
     
@@ -100,6 +115,12 @@ class PeerRegistry:
                 if peer.status == "online" and peer.last_seen < threshold:
                     peer.status = "offline"
                     self.logger.info(f"Peer {peer.peer_id} marked offline")
+                    self._publish(peer)
+    
+    def _publish(self, peer: Peer):
+        """Notify the event bus of a peer's current state"""
+        if self.event_bus:
+            self.event_bus.publish(PEER_STATUS, peer.to_dict(), key=peer.peer_id)
     
     def find_route_to_peer(self, target_peer_id: str) -> Optional[List[str]]:
         """Simple routing - for week 1, just direct connection"""
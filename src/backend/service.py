@@ -1,26 +1,50 @@
 import threading
 from collections import deque
-from typing import Deque, Dict, List, Optional
+from contextlib import nullcontext
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
 from datetime import datetime
 import logging
 import logging.config
 import os
 import yaml
-import json
 
 from src.core.peer_node import PeerNode
+from src.core.bandwidth import BULK, CONTROL, BandwidthShaper
 from src.core.connection_manager import ConnectionManager
-from src.core.message_protocol import MessageProtocol, MessageType
+from src.core.dispatcher import ShardedDispatcher
+from src.core.message_protocol import MessageProtocol, MessageType, Capability
 from src.backend.peer_registry import PeerRegistry
 from src.backend.message_queue import MessageQueue
+from src.backend.message_history import MessageHistory
+from src.backend.message_store import MessageStore
+from src.backend.outbox import Outbox
+from src.backend.event_bus import EventBus, MESSAGE, MESSAGE_STATUS, CHUNK_PROGRESS, TRANSFER_COMPLETE
+from src.backend.delivery import DeliveryTracker
+from src.backend.chunk_sizing import ChunkSizer, LinkStats, span_limit
+from src.backend.merkle import MerkleTree
 from src.backend.models import Peer, Message
-from src.backend.file_manager import FileManager
+from src.backend.swarm import SwarmDownload
+from src.backend.transfer_manager import TransferCancelled, TransferJob, TransferManager
+from src.backend.file_manager import DEFAULT_CHUNK_SIZE, FileManager, StoredFile, chunk_stream, open_source, read_at
 from src.security.peer_identity import PeerIdentity
 from src.security.message_validator import MessageValidator
+from src.security.message_signer import MessageSigner
+from src.security.rate_limiter import RateLimiter
 import base64
+import time
+import uuid
+import zlib
 
 logger = logging.getLogger("P2PService")
 
+MAX_RESUME_STALLS = 3  # resume requests in a row without progress before giving up on a transfer
+MAX_MANIFEST_CHUNKS = 8192  # larger files are sent without offering their manifest (it must fit in one message)
+WANT_TIMEOUT = 5.0  # how long a sender waits for the receiver's want list before sending everything
+MAX_CACHED_TREES = 64  # Merkle trees of sent files kept for resending chunks without re-reading the file
+SWARM_QUERY_TIMEOUT = 2.0  # how long a swarm download waits for peers to say which chunks they hold
+SWARM_TICK = 0.05  # longest a swarm download waits between scheduling passes
+RTT_PROBE_TIMEOUT = 1.0  # how long a sender waits for pongs before sizing chunk spans without an RTT
+
 
 class P2PService:
     """High-level service that exposes peer operations for the API layer."""
@@ -36,16 +60,66 @@ class P2PService:
         self.port = port
         self.identity = PeerIdentity(identity_file)  # type: ignore
         self.validator = MessageValidator()
-        self.peer_registry = PeerRegistry()
-        self.message_queue = MessageQueue()
-        self.file_manager = FileManager()
-        self.messages: Deque[Dict] = deque(maxlen=1000)
+        self.rate_limiter = RateLimiter()
+        self.bandwidth = BandwidthShaper()
+        self.signer = MessageSigner(self.identity)
+        # Push channel for dashboards (see /api/events)
+        self.events = EventBus()
+        self.peer_registry = PeerRegistry(event_bus=self.events)
+        self.message_queue = MessageQueue(
+            max_size=int(os.getenv("SEND_QUEUE_SIZE", "1000")),
+            num_workers=int(os.getenv("SEND_WORKERS", "4"))
+        )
+        self.file_manager = FileManager(event_bus=self.events, dedup=os.getenv("FILE_DEDUP", "0") == "1")
+        self.history = MessageHistory(
+            max_entries=int(os.getenv("MESSAGE_HISTORY_MAX_ENTRIES", "1000")),
+            max_bytes=int(os.getenv("MESSAGE_HISTORY_MAX_BYTES", str(4 * 1024 * 1024)))
+        )
+        # Durable, queryable log; the in-memory history serves the latest page.
+        # One database per port so several peers can run from the same directory
+        self.message_store = MessageStore(os.getenv("MESSAGE_DB_PATH", f"data/messages-{port}.db"))
+        # Direct messages for peers that are away wait here until they reconnect
+        self.outbox = Outbox(
+            os.getenv("OUTBOX_DIR", f"data/outbox-{port}"),
+            max_per_recipient=int(os.getenv("OUTBOX_MAX_PER_PEER", "1000"))
+        )
+        self.draining: set = set()  # peers whose outbox is being drained
+        self.outbox_deliveries: Dict[str, int] = {}  # message_id -> outbox seq of a drained message awaiting its ACK
+        self.resuming: set = set()  # (peer_id, file_id) pairs whose missing chunks are being resent
+        self.resume_progress: Dict[str, Tuple[int, int]] = {}  # file_id -> (chunks at last request, stalls)
+        self.pending_wants: Dict[Tuple[str, str], list] = {}  # (peer_id, file_id) -> [Event, wanted ranges]
+        self.sending: set = set()  # (peer_id, file_id) pairs whose initial send is still running
+        self.outgoing_trees: Dict[str, MerkleTree] = {}  # file_id -> Merkle tree of a resumable sent file
+        self.swarms: Dict[str, SwarmDownload] = {}  # file_id -> swarm download in progress
+        self.swarm_queries: Dict[str, list] = {}  # file_id -> [Event, {peer_id: have}, peers asked]
+        self.serving: Dict[Tuple[str, str], deque] = {}  # (peer_id, file_id) -> chunk ranges still to send
+        self.links = LinkStats()  # per-peer RTT and goodput, for sizing the chunk spans of transfers
+        self.pings: Dict[str, Tuple[float, threading.Event]] = {}  # peer_id -> (ping sent at, pong received)
+        # File sends and swarm downloads started through the API run here as background jobs
+        self.transfers = TransferManager(max_concurrent=int(os.getenv("TRANSFER_CONCURRENCY", "2")))
+        self.delivery = DeliveryTracker(
+            send_ack=self._send_delivery_ack,
+            retransmit=self._retransmit_messages,
+            on_status=self._on_delivery_status,
+            max_unacked=int(os.getenv("OUTBOX_MAX_PER_PEER", "1000"))
+        )
         self.lock = threading.RLock()
+        self.handlers: Dict[str, Callable[[str, Dict], None]] = {}
+        self._register_default_handlers()
 
-        # Set up networking components
+        # Set up networking components; reader threads only frame and enqueue
+        self.dispatcher = ShardedDispatcher(
+            self._handle_incoming_batch,
+            num_workers=int(os.getenv("DISPATCH_WORKERS", "4"))
+        )
         self.connection_manager = ConnectionManager(
             message_handler=self._handle_incoming_message,
-            peer_registry=self.peer_registry
+            peer_registry=self.peer_registry,
+            max_message_size=self.validator.max_message_size,
+            rate_limiter=self.rate_limiter,
+            frame_signer=self.signer.sign_frame,
+            dispatcher=self.dispatcher,
+            shaper=self.bandwidth
         )
         self.peer_node = PeerNode(port=port, peer_id=self.identity.peer_id)  # type: ignore
         self.peer_node.connection_manager = self.connection_manager
@@ -80,7 +154,10 @@ class P2PService:
     def _start_components(self):
         """Start background components."""
         self.peer_registry.start()
-        self.message_queue.start(self._send_message_handler)
+        self.message_store.start()
+        self.delivery.start()
+        self.dispatcher.start()
+        self.message_queue.start(self._send_message_handler, self._send_message_batch)
         self.peer_node.start()
 
         # Register self
@@ -98,95 +175,185 @@ class P2PService:
         self.message_queue.stop()
         self.peer_registry.stop()
         self.peer_node.stop()
+        self.dispatcher.stop()
+        self.delivery.stop()
+        self.message_store.stop()
+        self.outbox.close()
+        self.transfers.stop()
+        self.file_manager.close()
 
     # ------------------------------------------------------------------
     # Incoming message handling
     # ------------------------------------------------------------------
+    def register_handler(self, msg_type: MessageType, handler: Callable[[str, Dict], None]):
+        """Register the handler for a message type (called as handler(peer_id, message))"""
+        self.handlers[msg_type.value] = handler
+
+    def _register_default_handlers(self):
+        self.register_handler(MessageType.HANDSHAKE, self._handle_handshake)
+        self.register_handler(MessageType.TEXT, self._handle_text_message)
+        self.register_handler(MessageType.PING, self._handle_ping)
+        self.register_handler(MessageType.PONG, self._handle_pong)
+        self.register_handler(MessageType.ACK, self._handle_ack)
+        self.register_handler(MessageType.FILE_TRANSFER_REQUEST, self._handle_file_transfer_request)
+        self.register_handler(MessageType.FILE_TRANSFER_CHUNK, self._handle_file_transfer_chunk)
+        self.register_handler(MessageType.FILE_TRANSFER_COMPLETE, self._handle_file_transfer_complete)
+        self.register_handler(MessageType.FILE_TRANSFER_ACK, self._handle_file_transfer_ack)
+        self.register_handler(MessageType.FILE_TRANSFER_RESUME, self._handle_file_transfer_resume)
+        self.register_handler(MessageType.FILE_TRANSFER_WANT, self._handle_file_transfer_want)
+        self.register_handler(MessageType.FILE_SWARM_QUERY, self._handle_file_swarm_query)
+        self.register_handler(MessageType.FILE_SWARM_HAVE, self._handle_file_swarm_have)
+        self.register_handler(MessageType.FILE_SWARM_FETCH, self._handle_file_swarm_fetch)
+
     def _handle_incoming_message(self, peer_id: str, raw_message: str):
+        """Handle a single frame delivered without the dispatcher"""
+        self._handle_incoming_batch(peer_id, [raw_message.encode()])
+
+    def _handle_incoming_batch(self, peer_id: str, frames: List[bytes]):
+        """Decode, validate and authenticate a batch of frames, then dispatch each in order"""
+        decoded = []
+        for frame in frames:
+            item = self._decode_incoming(peer_id, frame)
+            if item:
+                decoded.append(item)
+        if not decoded:
+            return
+
+        errors = self.signer.verify_batch(
+            [(message["sender_id"], payload, signature) for message, payload, signature in decoded]
+        )
+        for (message, _, _), error in zip(decoded, errors):
+            if not error:
+                _, error = self.validator.check_replay(message, peer_id)
+            if error:
+                logger.warning("Rejected message from %s: %s", peer_id, error)
+                continue
+            self._dispatch_message(peer_id, message)
+
+    def _decode_incoming(self, peer_id: str, frame: bytes) -> Optional[Tuple[Dict, bytes, Optional[bytes]]]:
+        """Decode and validate one frame; returns (message, signed payload, signature)"""
         try:
-            if not raw_message or not raw_message.strip():
+            if not frame or not frame.strip():
                 logger.debug(f"Ignoring empty message from {peer_id}")
-                return
-                
-            message_dict = MessageProtocol.decode_message(raw_message.encode())
+                return None
+
+            message_dict = MessageProtocol.decode_message(frame)
             if not message_dict:
                 logger.warning(f"Received message with invalid format from {peer_id}")
-                logger.debug(f"Invalid message content (first 100 chars): {raw_message[:100]}")
-                return
+                logger.debug(f"Invalid message content (first 100 bytes): {frame[:100]!r}")
+                return None
 
-            is_valid, error = self.validator.validate_message(message_dict)
+            is_signed = message_dict.pop("sig", None) is not None
+            # The message ID is recorded for replay protection once the signature checks out
+            is_valid, error = self.validator.validate_message(message_dict, check_replay=False)
             if not is_valid:
                 logger.warning("Invalid message from %s: %s", peer_id, error)
-                return
+                return None
+
+            if message_dict["type"] == MessageType.HANDSHAKE.value:
+                # The handshake carries the key its own signature is checked with
+                self._register_signing_key(message_dict)
 
-            self.peer_registry.mark_peer_seen(message_dict["sender_id"])
-            msg_type = message_dict["type"]
-
-            if msg_type == MessageType.HANDSHAKE.value:
-                self._handle_handshake(peer_id, message_dict)  # Pass peer_id to handshake handler
-            elif msg_type == MessageType.TEXT.value:
-                self._handle_text_message(message_dict)
-            elif msg_type == MessageType.PING.value:
-                self._handle_ping(message_dict)
-            elif msg_type == MessageType.FILE_TRANSFER_REQUEST.value:
-                self._handle_file_transfer_request(message_dict)
-            elif msg_type == MessageType.FILE_TRANSFER_CHUNK.value:
-                self._handle_file_transfer_chunk(message_dict)
-            elif msg_type == MessageType.FILE_TRANSFER_COMPLETE.value:
-                self._handle_file_transfer_complete(message_dict)
-            elif msg_type == MessageType.FILE_TRANSFER_ACK.value:
-                self._handle_file_transfer_ack(message_dict)
+            payload, signature = MessageProtocol.split_signature(frame) if is_signed else (frame, None)
+            return message_dict, payload, signature
+        except Exception as exc:
+            logger.error("Error decoding incoming message from %s: %s", peer_id, exc, exc_info=True)
+            return None
+
+    def _dispatch_message(self, peer_id: str, message: Dict):
+        """Route an authenticated message to its registered handler"""
+        try:
+            self.peer_registry.mark_peer_seen(message["sender_id"])
+            content = message.get("content")
+            if isinstance(content, dict) and "delivery" in content:
+                if not self.delivery.on_receive(message["sender_id"], content["delivery"]):
+                    logger.debug(f"Dropping duplicate delivery of {message['message_id']} from {peer_id}")
+                    return
+
+            handler = self.handlers.get(message["type"])
+            if handler:
+                handler(peer_id, message)
             else:
-                logger.warning(f"Unknown message type: {msg_type} from {peer_id}")
+                logger.debug(f"No handler for message type {message['type']} from {peer_id}")
 
+            # Delivery ACKs are protocol bookkeeping, not conversation history
+            if message["type"] == MessageType.ACK.value:
+                return
             self._record_message({
                 "direction": "incoming",
-                "payload": message_dict,
+                "payload": message,
                 "received_at": datetime.utcnow().isoformat()
             })
-        except json.JSONDecodeError as json_error:
-            logger.error(f"JSON decode error from {peer_id}: {json_error}")
-            logger.debug(f"Failed message (first 200 chars): {raw_message[:200]}")
         except Exception as exc:
             logger.error("Error handling incoming message from %s: %s", peer_id, exc, exc_info=True)
 
+    def _create_handshake(self) -> bytes:
+        """Build our handshake, advertising every capability this node supports"""
+        capabilities = set(MessageProtocol.CAPABILITIES)
+        if not self.signer.sign_messages:
+            capabilities.discard(Capability.SIGNED_MESSAGES.value)
+        return MessageProtocol.create_handshake(
+            self.identity.peer_id,
+            {
+                "address": "localhost",
+                "port": self.port,
+                "public_key": self.identity.get_public_key_string(),
+                **self.signer.handshake_fields()
+            },
+            capabilities
+        )
+
+    def _register_signing_key(self, message: Dict):
+        """Verify and cache the signing key a peer sent in its handshake"""
+        sender_id = message["sender_id"]
+        peer_info = message.get("content") or {}
+        capabilities = MessageProtocol.negotiate_capabilities(peer_info.get("capabilities"))
+        signs_messages = Capability.SIGNED_MESSAGES.value in capabilities
+        if not self.signer.register_peer_key(sender_id, peer_info, signs_messages) and signs_messages:
+            logger.warning(f"Could not verify signing key of {sender_id[:16]}...")
+
     def _handle_handshake(self, temp_peer_id: str, message: Dict):
         """Handle handshake message and associate temp peer ID with real peer ID"""
         sender_id = message["sender_id"]
+        peer_info = message.get("content", {})
+        capabilities = MessageProtocol.negotiate_capabilities(peer_info.get("capabilities"))
         
         # If we already have this peer connected with their real ID, don't respond again
         if sender_id in self.connection_manager.get_active_connections():
+            self.connection_manager.set_peer_capabilities(sender_id, capabilities)
+            self.delivery.resend_unacked(sender_id)
+            self._start_outbox_drain(sender_id)
+            self._request_resumes(sender_id)
             logger.debug(f"Handshake from {sender_id[:16]}... already established, skipping response")
             return
         
-        peer_info = message.get("content", {})
         peer = Peer(
             peer_id=sender_id,
             address=peer_info.get("address", "unknown"),
             port=peer_info.get("port", 0),
-            public_key=peer_info.get("public_key")
+            public_key=peer_info.get("public_key"),
+            metadata={"capabilities": sorted(capabilities)}
         )
         self.peer_registry.register_peer(peer)
         # Use the temp_peer_id from the connection, not constructed from message content
         self.connection_manager.associate_temp_id_with_peer_id(temp_peer_id, sender_id)
-        logger.info(f"Handshake complete: {temp_peer_id} -> {sender_id[:16]}...")
+        self.connection_manager.set_peer_capabilities(sender_id, capabilities)
+        logger.info(f"Handshake complete: {temp_peer_id} -> {sender_id[:16]}... "
+                    f"(capabilities: {sorted(capabilities) or 'none'})")
         
         # Send handshake response back
-        response = MessageProtocol.create_handshake(
-            self.identity.peer_id,
-            {
-                "address": "localhost",
-                "port": self.port,
-                "public_key": self.identity.get_public_key_string()
-            }
-        )
-        self.connection_manager.send_message(sender_id, response)
+        self.connection_manager.send_message(sender_id, self._create_handshake(), traffic_class=CONTROL)
+        # Unacknowledged messages from before the disconnect go first, then the outbox
+        self.delivery.resend_unacked(sender_id)
+        self._start_outbox_drain(sender_id)
+        # Ask for whatever interrupted file transfers from this peer still lack
+        self._request_resumes(sender_id)
 
-    def _handle_text_message(self, message: Dict):
+    def _handle_text_message(self, peer_id: str, message: Dict):
         # For now, we only record the message. Additional logic could go here.
         pass
 
-    def _handle_ping(self, message: Dict):
+    def _handle_ping(self, peer_id: str, message: Dict):
         pong = MessageProtocol.create_message(
             MessageType.PONG,
             self.identity.peer_id,
@@ -194,10 +361,40 @@ class P2PService:
         )
         self.connection_manager.send_message(
             message["sender_id"],
-            MessageProtocol.encode_message(pong)
+            MessageProtocol.encode_message(pong),
+            traffic_class=CONTROL
         )
+
+    def _handle_pong(self, peer_id: str, message: Dict):
+        with self.lock:
+            probe = self.pings.pop(message["sender_id"], None)
+        if probe:
+            sent_at, answered = probe
+            self.links.record_rtt(message["sender_id"], time.monotonic() - sent_at)
+            answered.set()
+
+    def _measure_rtt(self, peer_ids: List[str]) -> Optional[float]:
+        """The largest RTT to these peers, pinging those without a recent sample (None if none answer)"""
+        waiting = []
+        for peer_id in peer_ids:
+            if self.links.rtt(peer_id) is not None:
+                continue
+            answered = threading.Event()
+            with self.lock:
+                self.pings[peer_id] = (time.monotonic(), answered)
+            ping = MessageProtocol.create_message(MessageType.PING, self.identity.peer_id, peer_id)
+            if self.connection_manager.send_message(peer_id, MessageProtocol.encode_message(ping),
+                                                    traffic_class=CONTROL):
+                waiting.append((peer_id, answered))
+        deadline = time.monotonic() + RTT_PROBE_TIMEOUT
+        for peer_id, answered in waiting:
+            if not answered.wait(max(0.0, deadline - time.monotonic())):
+                with self.lock:
+                    self.pings.pop(peer_id, None)
+        rtts = [rtt for rtt in (self.links.rtt(peer_id) for peer_id in peer_ids) if rtt is not None]
+        return max(rtts) if rtts else None
     
-    def _handle_file_transfer_request(self, message: Dict):
+    def _handle_file_transfer_request(self, peer_id: str, message: Dict):
         """Handle incoming file transfer request"""
         content = message.get("content", {})
         file_id = content.get("file_id")
@@ -219,13 +416,26 @@ class P2PService:
             return
         
         # Register the file
-        self.file_manager.register_file(
-            file_id, filename, file_size, mime_type, sender_id, recipient_id
+        manifest = content.get("manifest")
+        registered = self.file_manager.register_file(
+            file_id, filename, file_size, mime_type, sender_id, recipient_id,
+            chunk_size=content.get("chunk_size", DEFAULT_CHUNK_SIZE), manifest=manifest,
+            merkle_root=content.get("merkle_root"), max_chunk_size=content.get("max_chunk_size"),
+            shared=recipient_id is None
         )
         transfer_type = "broadcast" if recipient_id is None else "direct"
         logger.info(f"Receiving file {filename} ({file_id}) from {sender_id} ({transfer_type})")
+        
+        if manifest and registered:
+            # The sender waits for our answer: tell it which chunks we lack after reusing what we have
+            self.file_manager.fill_from_store(file_id)
+            want = MessageProtocol.create_file_transfer_want(
+                self.identity.peer_id, sender_id, file_id,
+                self.file_manager.missing_ranges(file_id, cover_tail=True)
+            )
+            self.connection_manager.send_message(sender_id, want, traffic_class=CONTROL)
     
-    def _handle_file_transfer_chunk(self, message: Dict):
+    def _handle_file_transfer_chunk(self, peer_id: str, message: Dict):
         """Handle incoming file transfer chunk"""
         content = message.get("content", {})
         file_id = content.get("file_id")
@@ -245,15 +455,55 @@ class P2PService:
         
         try:
             chunk_data = base64.b64decode(chunk_data_b64)
-            success = self.file_manager.add_chunk(file_id, chunk_index, chunk_data, is_last)
-            if success:
-                logger.debug(f"Received chunk {chunk_index} for file {file_id} (is_last={is_last}, size={len(chunk_data)} bytes)")
-            else:
+            encoding = content.get("encoding")
+            if encoding == "zlib":
+                # Inflate no further than the largest span the transfer allows: a small
+                # frame must not expand past what max_message_size was meant to bound
+                file_info = self.file_manager.get_file_info(file_id) or {}
+                limit = file_info.get("max_chunk_size") or file_info.get("chunk_size") or DEFAULT_CHUNK_SIZE
+                chunk_data = self._decode_chunk(chunk_data, limit)
+                if chunk_data is None:
+                    logger.warning(f"Rejected chunk {chunk_index} of {file_id}: inflates past {limit} bytes")
+                    return
+            elif encoding:
+                logger.warning(f"Unsupported chunk encoding {encoding!r} for file {file_id}")
+                return
+            proofs = content.get("proofs")
+            if proofs is None and content.get("proof") is not None:
+                proofs = [content["proof"]]
+            # The message may carry a span of consecutive chunks; it is written at the offset of chunk_index
+            swarm = self.swarms.get(file_id)
+            stored, rejected = self.file_manager.add_span(file_id, chunk_index, chunk_data, is_last, proofs)
+            if rejected:
+                # Ask for just these chunks again rather than waiting for the transfer to end
+                logger.warning(f"{len(rejected)} chunks of {file_id} from {rejected[0]} failed verification, "
+                               f"requesting them again")
+                if swarm:
+                    for index in rejected:
+                        swarm.rejected(message["sender_id"], index)
+                elif self.connection_manager.peer_supports(message["sender_id"], Capability.RESUMABLE_TRANSFERS):
+                    ranges: List[List[int]] = []
+                    for index in rejected:
+                        if ranges and ranges[-1][1] == index - 1:
+                            ranges[-1][1] = index
+                        else:
+                            ranges.append([index, index])
+                    request = MessageProtocol.create_file_transfer_resume(
+                        self.identity.peer_id, message["sender_id"], file_id, ranges
+                    )
+                    self.connection_manager.send_message(message["sender_id"], request, traffic_class=CONTROL)
+            if swarm:
+                for index in stored:
+                    swarm.received(message["sender_id"], index)
+            if stored:
+                logger.debug(f"Received chunks {stored[0]}-{stored[-1]} for file {file_id} "
+                             f"(is_last={is_last}, size={len(chunk_data)} bytes)")
+            elif not rejected:
                 logger.warning(f"Failed to add chunk {chunk_index} for file {file_id}")
         except Exception as e:
             logger.error(f"Failed to process file chunk {chunk_index} for {file_id}: {e}")
     
-    def _handle_file_transfer_complete(self, message: Dict):
+    def _handle_file_transfer_complete(self, peer_id: str, message: Dict):
         """Handle file transfer complete notification"""
         content = message.get("content", {})
         file_id = content.get("file_id")
@@ -271,6 +521,11 @@ class P2PService:
         
         # Complete the file
         success = self.file_manager.complete_file(file_id)
+        if success:
+            self.resume_progress.pop(file_id, None)
+        elif self._request_resume(message["sender_id"], file_id):
+            # The sender will resend just the missing chunks and complete again
+            return
         
         # Send acknowledgment only for direct transfers or if we are a recipient
         if recipient_id is not None or success:
@@ -282,7 +537,8 @@ class P2PService:
             )
             self.connection_manager.send_message(
                 message["sender_id"],
-                ack
+                ack,
+                traffic_class=CONTROL
             )
         
         if success:
@@ -292,7 +548,7 @@ class P2PService:
         else:
             logger.warning(f"File transfer failed: {file_id}")
     
-    def _handle_file_transfer_ack(self, message: Dict):
+    def _handle_file_transfer_ack(self, peer_id: str, message: Dict):
         """Handle file transfer acknowledgment"""
         content = message.get("content", {})
         file_id = content.get("file_id")
@@ -300,35 +556,488 @@ class P2PService:
         
         if success:
             logger.info(f"File transfer acknowledged: {file_id}")
+            if self.file_manager.finish_outgoing(file_id, message["sender_id"]):
+                self.outgoing_trees.pop(file_id, None)
         else:
             logger.warning(f"File transfer rejected: {file_id}")
+        self.events.publish(TRANSFER_COMPLETE, {
+            "file_id": file_id,
+            "direction": "outgoing",
+            "peer_id": message["sender_id"],
+            "success": success
+        }, key=f"outgoing:{file_id}:{message['sender_id']}")
 
-    def _send_message_handler(self, message: Message):
+    def _request_resume(self, peer_id: str, file_id: str, reset: bool = False) -> bool:
+        """Ask a peer to resend the chunks an incoming file lacks; False if that is not possible"""
+        if not self.connection_manager.peer_supports(peer_id, Capability.RESUMABLE_TRANSFERS):
+            return False
+        missing = self.file_manager.missing_ranges(file_id)
+        file_info = self.file_manager.get_file_info(file_id)
+        if not missing or not file_info:
+            return False
+        received = file_info.get("chunks_received", 0)
+        with self.lock:
+            last_received, stalls = self.resume_progress.get(file_id, (-1, 0))
+            stalls = 0 if reset or received != last_received else stalls + 1
+            abandoned = stalls >= MAX_RESUME_STALLS
+            if abandoned:
+                self.resume_progress.pop(file_id, None)
+            else:
+                self.resume_progress[file_id] = (received, stalls)
+        if abandoned:
+            # Nothing will fill the rest in; free the preallocated .part
+            logger.warning(f"Giving up on resuming {file_id}: no progress after {stalls} requests")
+            self.file_manager.delete_file(file_id)
+            return False
+        request = MessageProtocol.create_file_transfer_resume(self.identity.peer_id, peer_id, file_id, missing)
+        logger.info(f"Requesting {len(missing)} missing chunk ranges of {file_id} from {peer_id[:16]}...")
+        return self.connection_manager.send_message(peer_id, request, traffic_class=CONTROL)
+
+    def _request_resumes(self, peer_id: str):
+        for file_id in self.file_manager.incomplete_transfers(peer_id):
+            self._request_resume(peer_id, file_id, reset=True)
+
+    def _handle_file_transfer_resume(self, peer_id: str, message: Dict):
+        """A receiver lacks some chunks of a file we sent: resend only those"""
+        content = message.get("content", {})
+        file_id = content.get("file_id")
+        requester = message["sender_id"]
+        ranges = [r for r in content.get("missing", [])
+                  if isinstance(r, list) and len(r) == 2 and all(isinstance(v, int) for v in r) and r[0] <= r[1]]
+        transfer = self.file_manager.get_outgoing(file_id, requester)
+        if not transfer:
+            logger.warning(f"Cannot resume {file_id} for {requester[:16]}...: transfer unknown or expired")
+            return
+        with self.lock:
+            if (requester, file_id) in self.resuming:
+                return
+            self.resuming.add((requester, file_id))
+        thread = threading.Thread(target=self._resend_chunks, args=(requester, file_id, transfer, ranges),
+                                  name=f"resume-{file_id[:8]}")
+        thread.daemon = True
+        thread.start()
+
+    def _handle_file_transfer_want(self, peer_id: str, message: Dict):
+        """The receiver of a file we offered a manifest for says which chunks it needs"""
+        content = message.get("content", {})
+        waiter = self.pending_wants.get((message["sender_id"], content.get("file_id")))
+        if waiter:
+            waiter[1] = content.get("missing", [])
+            waiter[0].set()
+
+    def _await_want(self, peer_id: str, file_id: str, total_chunks: int) -> Optional[bytearray]:
+        """Wait for a peer's want list; returns a flag per chunk, or None to send everything"""
+        waiter = self.pending_wants.get((peer_id, file_id))
         try:
-            wire_format = message.to_wire_format()
-            encoded = MessageProtocol.encode_message(wire_format)
+            if not waiter or not waiter[0].wait(WANT_TIMEOUT):
+                logger.warning(f"No want list from {peer_id[:16]}... for {file_id}, sending every chunk")
+                return None
+            wanted = bytearray(total_chunks)
+            for r in waiter[1]:
+                if isinstance(r, list) and len(r) == 2 and all(isinstance(v, int) for v in r):
+                    for index in range(max(0, r[0]), min(r[1], total_chunks - 1) + 1):
+                        wanted[index] = 1
+            return wanted
+        finally:
+            self.pending_wants.pop((peer_id, file_id), None)
+
+    def _resend_chunks(self, peer_id: str, file_id: str, transfer: Dict, ranges: List[List[int]]):
+        """Retransmit the requested chunk ranges from the source file, then complete again"""
+        try:
+            source = self.file_manager.outgoing_source(transfer)
+            if source is None:
+                logger.warning(f"Cannot resume {file_id}: its source is gone")
+                return
+            file_size, chunk_size = transfer["file_size"], transfer["chunk_size"]
+            total_chunks = (file_size + chunk_size - 1) // chunk_size
+            compress = self.connection_manager.peer_supports(peer_id, Capability.ZLIB_CHUNKS)
+            tree = None
+            if self.connection_manager.peer_supports(peer_id, Capability.MERKLE_PROOFS):
+                tree = self._merkle_tree(file_id, source, chunk_size)
+            sent = 0
+            with open_source(source) as (size, f):
+                if size != file_size:
+                    logger.warning(f"Cannot resume {file_id}: {source} changed since it was sent")
+                    return
+                for start, end in ranges:
+                    for index in range(max(0, start), min(end, total_chunks - 1) + 1):
+                        chunk = read_at(f, index * chunk_size, chunk_size)
+                        chunk_b64, encoding = self._encode_chunk(chunk, compress)
+                        chunk_msg = MessageProtocol.create_file_transfer_chunk(
+                            self.identity.peer_id, peer_id, file_id, index, chunk_b64,
+                            index == total_chunks - 1, encoding, tree.proof(index) if tree else None
+                        )
+                        if not self.connection_manager.send_message(peer_id, chunk_msg, traffic_class=BULK):
+                            logger.warning(f"Connection lost while resending {file_id} to {peer_id[:16]}...")
+                            return
+                        sent += 1
+            if (peer_id, file_id) not in self.sending:
+                # While the initial send is still running, it sends the completion itself
+                complete_msg = MessageProtocol.create_file_transfer_complete(self.identity.peer_id, peer_id, file_id)
+                self.connection_manager.send_message(peer_id, complete_msg, traffic_class=CONTROL)
+            logger.info(f"Resent {sent} missing chunks of {file_id} to {peer_id[:16]}...")
+        except Exception as e:
+            logger.error(f"Error resending chunks of {file_id}: {e}", exc_info=True)
+        finally:
+            with self.lock:
+                self.resuming.discard((peer_id, file_id))
+
+    def _handle_file_swarm_query(self, peer_id: str, message: Dict):
+        """A peer is looking for sources of a file"""
+        # Answering may mean hashing the whole file; keep that off the dispatch worker
+        thread = threading.Thread(target=self._answer_swarm_query,
+                                  args=(message["sender_id"], message["content"]["file_id"]),
+                                  name="swarm-query")
+        thread.daemon = True
+        thread.start()
 
-            if message.recipient_id:
-                success = self.connection_manager.send_message(
-                    message.recipient_id,
-                    encoded
+    def _answer_swarm_query(self, peer_id: str, file_id: str):
+        """Tell a peer which chunks of a file we hold, and the file's Merkle root if we know it
+
+        Only broadcast files are offered; for any other file we say we hold none of it.
+        """
+        try:
+            file_info, ranges = None, []
+            if self.file_manager.is_shared(file_id):
+                file_info = self.file_manager.get_file_info(file_id)
+                ranges = self.file_manager.held_ranges(file_id)
+            merkle_root = None
+            if file_info and ranges:
+                file_info = {**file_info, "chunk_size": file_info.get("chunk_size", DEFAULT_CHUNK_SIZE)}
+                merkle_root = file_info.get("merkle_root")
+                stored_file = self.file_manager.get_stored_file(file_id)
+                if stored_file and self.connection_manager.peer_supports(peer_id, Capability.MERKLE_PROOFS):
+                    merkle_root = self._merkle_tree(file_id, stored_file, file_info["chunk_size"]).root
+            have = MessageProtocol.create_file_swarm_have(
+                self.identity.peer_id, peer_id, file_id, file_info, ranges, merkle_root
+            )
+            self.connection_manager.send_message(peer_id, have, traffic_class=CONTROL)
+        except Exception as e:
+            logger.error(f"Error answering swarm query for {file_id}: {e}", exc_info=True)
+
+    def _handle_file_swarm_have(self, peer_id: str, message: Dict):
+        content = message.get("content", {})
+        with self.lock:
+            waiter = self.swarm_queries.get(content.get("file_id"))
+            if waiter and message["sender_id"] in waiter[2]:
+                waiter[1][message["sender_id"]] = content
+                if len(waiter[1]) == len(waiter[2]):
+                    waiter[0].set()
+
+    def _handle_file_swarm_fetch(self, peer_id: str, message: Dict):
+        """A swarm downloader asks us for chunks; queue them behind any we are still sending it"""
+        content = message.get("content", {})
+        key = (message["sender_id"], content.get("file_id"))
+        with self.lock:
+            queued = self.serving.get(key)
+            if queued is not None:
+                queued.extend(content.get("ranges", []))
+                return
+            self.serving[key] = deque(content.get("ranges", []))
+        thread = threading.Thread(target=self._serve_chunks, args=key, name=f"swarm-serve-{key[1][:8]}")
+        thread.daemon = True
+        thread.start()
+
+    def _next_served_range(self, key: Tuple[str, str]) -> Optional[List[int]]:
+        with self.lock:
+            queued = self.serving.get(key)
+            if queued:
+                return queued.popleft()
+            self.serving.pop(key, None)
+            return None
+
+    def _serve_chunks(self, peer_id: str, file_id: str):
+        """Send the chunk ranges a swarm downloader asked for, from our copy of the file
+
+        A completed file is read from storage and its chunks carry proofs
+        from our own Merkle tree; chunks of a file we are still receiving are
+        read from its ``.part`` file with the proofs that came with them.
+        """
+        key = (peer_id, file_id)
+        with self.lock:
+            queued = self.serving.get(key)
+        sent = 0
+        try:
+            file_info = self.file_manager.get_file_info(file_id)
+            if not file_info or not self.file_manager.is_shared(file_id):
+                logger.warning(f"Swarm peer {peer_id[:16]}... asked for unknown or unshared file {file_id}")
+                return
+            chunk_size = file_info.get("chunk_size", DEFAULT_CHUNK_SIZE)
+            total_chunks = (file_info["file_size"] + chunk_size - 1) // chunk_size
+            compress = self.connection_manager.peer_supports(peer_id, Capability.ZLIB_CHUNKS)
+            stored_file = self.file_manager.get_stored_file(file_id)
+            tree = None
+            if stored_file and self.connection_manager.peer_supports(peer_id, Capability.MERKLE_PROOFS):
+                tree = self._merkle_tree(file_id, stored_file, chunk_size)
+            with open_source(stored_file) if stored_file else nullcontext((0, None)) as (_, f):
+                while True:
+                    requested = self._next_served_range(key)
+                    if requested is None:
+                        break
+                    for index in range(max(0, requested[0]), min(requested[1], total_chunks - 1) + 1):
+                        if f is not None:
+                            chunk, proof = read_at(f, index * chunk_size, chunk_size), None
+                            if tree:
+                                proof = tree.proof(index)
+                        else:
+                            held = self.file_manager.read_partial_chunk(file_id, index)
+                            if held is None:
+                                continue
+                            chunk, proof = held
+                        chunk_b64, encoding = self._encode_chunk(chunk, compress)
+                        chunk_msg = MessageProtocol.create_file_transfer_chunk(
+                            self.identity.peer_id, peer_id, file_id, index, chunk_b64,
+                            index == total_chunks - 1, encoding, proof
+                        )
+                        if not self.connection_manager.send_message(peer_id, chunk_msg, traffic_class=BULK):
+                            logger.warning(f"Connection lost while serving {file_id} to {peer_id[:16]}...")
+                            return
+                        sent += 1
+            logger.info(f"Served {sent} chunks of {file_id} to swarm peer {peer_id[:16]}...")
+        except Exception as e:
+            logger.error(f"Error serving chunks of {file_id}: {e}", exc_info=True)
+        finally:
+            with self.lock:
+                # A fetch arriving after our queue ran dry has started a new queue and thread
+                if self.serving.get(key) is queued:
+                    self.serving.pop(key)
+
+    def _query_swarm(self, file_id: str, peers: List[str]) -> Dict[str, Dict]:
+        """Ask peers which chunks of a file they hold; returns the answers that came in time"""
+        waiter = [threading.Event(), {}, set(peers)]
+        with self.lock:
+            self.swarm_queries[file_id] = waiter
+        try:
+            for peer_id in peers:
+                query = MessageProtocol.create_file_swarm_query(self.identity.peer_id, peer_id, file_id)
+                self.connection_manager.send_message(peer_id, query, traffic_class=CONTROL)
+            waiter[0].wait(SWARM_QUERY_TIMEOUT)
+            with self.lock:
+                return dict(waiter[1])
+        finally:
+            with self.lock:
+                self.swarm_queries.pop(file_id, None)
+
+    def _merkle_tree(self, file_id: str, source: Union[bytes, str, os.PathLike, StoredFile],
+                     chunk_size: int) -> MerkleTree:
+        """Merkle tree over a file's chunks, cached for files that can be resent later"""
+        tree = self.outgoing_trees.get(file_id)
+        if tree is None:
+            with chunk_stream(source, chunk_size) as (_, chunks):
+                tree = MerkleTree.from_chunks(chunks)
+            if not isinstance(source, bytes):
+                self.outgoing_trees[file_id] = tree
+                while len(self.outgoing_trees) > MAX_CACHED_TREES:
+                    self.outgoing_trees.pop(next(iter(self.outgoing_trees)))
+        return tree
+    
+    def _send_message_handler(self, message: Message) -> bool:
+        """Send one queued message; returning False makes the queue retry it"""
+        return self._send_message_batch([message])
+
+    def _send_message_batch(self, messages: List[Message]) -> bool:
+        """Send queued messages for one recipient (or broadcasts) with one write per peer"""
+        try:
+            recipient_id = messages[0].recipient_id
+            if recipient_id:
+                # Keep per-peer order: once anything is waiting in the outbox, queue behind it
+                if (self.outbox.pending(recipient_id)
+                        or recipient_id not in self.connection_manager.get_active_connections()):
+                    return self._store_batch_for_later(messages)
+                wire_formats, tracked = [], False
+                for message in messages:
+                    wire_format, tracked = self._direct_wire_format(message)
+                    wire_formats.append(wire_format)
+                success = self.connection_manager.send_messages(
+                    recipient_id,
+                    [MessageProtocol.encode_message(wire_format) for wire_format in wire_formats]
                 )
                 if not success:
-                    logger.warning("Failed to send message to %s", message.recipient_id)
+                    logger.warning("Failed to send message to %s", recipient_id)
+                    if not tracked:
+                        return False
+                    # Keep tracked messages durable: the outbox resends them once the peer is back
+                    self._untrack(recipient_id, wire_formats)
+                    return self._store_batch_for_later(messages)
             else:
-                self.connection_manager.broadcast_message(encoded)
+                wire_formats = [message.to_wire_format() for message in messages]
+                self.connection_manager.broadcast_messages(
+                    [MessageProtocol.encode_message(wire_format) for wire_format in wire_formats]
+                )
 
-            self._record_message({
-                "direction": "outgoing",
-                "payload": wire_format,
-                "sent_at": datetime.utcnow().isoformat()
-            })
+            sent_at = datetime.utcnow().isoformat()
+            for wire_format in wire_formats:
+                self._record_message({
+                    "direction": "outgoing",
+                    "payload": wire_format,
+                    "sent_at": sent_at
+                })
+            return True
         except Exception as exc:
             logger.error("Failed to send message: %s", exc, exc_info=True)
+            return False
 
-    def _record_message(self, entry: Dict):
+    def _untrack(self, peer_id: str, wire_formats: List[Dict]):
+        """Stop tracking the delivery of messages that were never written"""
+        for wire_format in wire_formats:
+            self.delivery.untrack(peer_id, wire_format["content"]["delivery"]["seq"])
+
+    def _direct_wire_format(self, message: Message) -> Tuple[Dict, bool]:
+        """Wire format for a direct message, with a delivery seq if the peer ACKs"""
+        wire_format = message.to_wire_format()
+        if not self.connection_manager.peer_supports(message.recipient_id, Capability.DELIVERY_ACKS):
+            return wire_format, False
+        wire_format["content"] = {
+            **wire_format["content"],
+            "delivery": self.delivery.track(message.recipient_id, message)
+        }
+        return wire_format, True
+
+    # ------------------------------------------------------------------
+    # Delivery acknowledgements
+    # ------------------------------------------------------------------
+    def _handle_ack(self, peer_id: str, message: Dict):
+        self.delivery.on_ack(message["sender_id"], message.get("content") or {})
+
+    def _send_delivery_ack(self, peer_id: str, content: Dict) -> bool:
+        ack = MessageProtocol.create_delivery_ack(
+            self.identity.peer_id, peer_id, content["epoch"], content["ack"], content["missing"]
+        )
+        return self.connection_manager.send_message(peer_id, ack, traffic_class=CONTROL)
+
+    def _retransmit_messages(self, peer_id: str, items: List[Tuple[int, Message]]) -> bool:
+        """Resend tracked messages under their original seq, in one write"""
+        if peer_id not in self.connection_manager.get_active_connections():
+            return False
+        frames = []
+        for seq, message in items:
+            wire_format = message.to_wire_format()
+            # Fresh envelope: the receiver's replay check would drop a reused ID,
+            # and the seq is what it deduplicates on
+            wire_format["message_id"] = f"{message.message_id}:{uuid.uuid4().hex[:8]}"
+            wire_format["timestamp"] = time.time()
+            wire_format["content"] = {**wire_format["content"],
+                                      "delivery": self.delivery.delivery_field(peer_id, seq)}
+            frames.append(MessageProtocol.encode_message(wire_format))
+        return self.connection_manager.send_messages(peer_id, frames)
+
+    def _on_delivery_status(self, peer_id: str, message: Message):
+        with self.lock:
+            outbox_seq = self.outbox_deliveries.pop(message.message_id, None)
+        if outbox_seq is not None:
+            # Delivered or given up on: only now does it leave the durable outbox
+            self.outbox.settle(peer_id, outbox_seq)
+        self.events.publish(MESSAGE_STATUS, {
+            "message_id": message.message_id,
+            "peer_id": peer_id,
+            "status": message.status
+        }, key=message.message_id)
+
+    # ------------------------------------------------------------------
+    # Store-and-forward for peers that are away
+    # ------------------------------------------------------------------
+    def _store_for_later(self, message: Message) -> bool:
+        if not self.outbox.put(message.recipient_id, message.to_dict()):
+            return False
+        logger.info(f"Stored message {message.message_id} for {message.recipient_id[:16]}... in the outbox")
+        self._start_outbox_drain(message.recipient_id)
+        return True
+
+    def _store_batch_for_later(self, messages: List[Message]) -> bool:
+        """Store a recipient's messages in order until its outbox is full; report the rest failed
+
+        Returns False only if nothing was stored, so the queue retries the
+        whole batch; retrying part of it would store the other messages twice.
+        """
+        stored = 0
+        for message in messages:
+            if not self._store_for_later(message):
+                break
+            stored += 1
+        if not stored:
+            return False
+        for message in messages[stored:]:
+            # Stopping at the first refusal keeps later messages from overtaking a lost one
+            logger.warning(f"Dropping message {message.message_id} for {message.recipient_id[:16]}...: outbox full")
+            message.status = "failed"
+            self.events.publish(MESSAGE_STATUS, {
+                "message_id": message.message_id,
+                "peer_id": message.recipient_id,
+                "status": message.status
+            }, key=message.message_id)
+        return True
+
+    def _start_outbox_drain(self, peer_id: str):
+        """Start draining a connected peer's outbox unless a drain is already running"""
         with self.lock:
-            self.messages.appendleft(entry)
+            if (peer_id in self.draining or not self.outbox.pending(peer_id)
+                    or peer_id not in self.connection_manager.get_active_connections()):
+                return
+            self.draining.add(peer_id)
+        thread = threading.Thread(target=self._drain_outbox, args=(peer_id,), name=f"outbox-{peer_id[:8]}")
+        thread.daemon = True
+        thread.start()
+
+    def _drain_outbox(self, peer_id: str, batch_size: int = 64):
+        """Send a peer's stored messages in order, one write per batch"""
+        sent = 0
+        while True:
+            with self.lock:
+                batch = self.outbox.peek(peer_id, batch_size)
+                # Checked under the lock so a concurrent _store_for_later either lands
+                # in this drain's next batch or starts a new drain
+                if not batch or peer_id not in self.connection_manager.get_active_connections():
+                    self.draining.discard(peer_id)
+                    break
+
+            frames = []
+            payloads = []
+            tracked = False
+            seqs = [seq for seq, _ in batch]
+            for seq, data in batch:
+                message = Message.from_dict(data)
+                # Stamp with the send time; the receiver rejects stale timestamps
+                message.timestamp = datetime.now()
+                wire_format, tracked = self._direct_wire_format(message)
+                if tracked:
+                    with self.lock:
+                        self.outbox_deliveries[message.message_id] = seq
+                payloads.append(wire_format)
+                frames.append(MessageProtocol.encode_message(wire_format))
+            if tracked:
+                # Held until the delivery ACK, so an unacknowledged message survives a restart;
+                # held before the write since the ACK can come back before send_messages returns
+                self.outbox.hold(peer_id, seqs)
+
+            if not self.connection_manager.send_messages(peer_id, frames):
+                if tracked:
+                    # Never written: back to pending in the outbox, not left to the tracker
+                    self._untrack(peer_id, payloads)
+                    with self.lock:
+                        for payload in payloads:
+                            self.outbox_deliveries.pop(payload["message_id"], None)
+                    self.outbox.release(peer_id, seqs)
+                with self.lock:
+                    self.draining.discard(peer_id)
+                break
+            if not tracked:
+                self.outbox.ack(peer_id, seqs[-1])
+            sent += len(batch)
+            for payload in payloads:
+                self._record_message({
+                    "direction": "outgoing",
+                    "payload": payload,
+                    "sent_at": datetime.utcnow().isoformat()
+                })
+        if sent:
+            logger.info(f"Delivered {sent} stored messages to {peer_id[:16]}...")
+
+    def _record_message(self, entry: Dict):
+        entry = self.message_store.record(entry)
+        self.history.record(entry)
+        # Chunks surface as chunk_progress events rather than one event per chunk
+        if entry["payload"].get("type") != MessageType.FILE_TRANSFER_CHUNK.value:
+            self.events.publish(MESSAGE, entry)
 
     # ------------------------------------------------------------------
     # Public API
@@ -341,9 +1050,43 @@ class P2PService:
             "messages_processed": stats["messages_processed"],
             "messages_failed": stats["messages_failed"],
             "queue_size": stats["queue_size"],
-            "active_connections": self.connection_manager.get_active_connections()
+            "message_queue": stats,
+            "active_connections": self.connection_manager.get_active_connections(),
+            "validation": self.validator.get_stats(),
+            "connections": self.connection_manager.get_stats(),
+            "rate_limiting": self.rate_limiter.get_stats(),
+            "bandwidth": self.bandwidth.get_stats(),
+            "signing": self.signer.get_stats(),
+            "dispatch": self.dispatcher.get_stats(),
+            "message_history": self.history.get_stats(),
+            "message_store": self.message_store.get_stats(),
+            "events": self.events.get_stats(),
+            "outbox": self.outbox.get_stats(),
+            "delivery": self.delivery.get_stats(),
+            "files": self.file_manager.get_stats(),
+            "swarms": self.get_swarm_stats(),
+            "transfers": self.transfers.get_stats(),
+            "links": self.links.get_stats()
         }
 
+    def get_rate_limits(self) -> Dict:
+        return self.rate_limiter.get_limits()
+
+    def update_rate_limits(self, **limits) -> Dict:
+        """Adjust per-peer rate limits at runtime (raises ValueError on bad input)"""
+        updated = self.rate_limiter.set_limits(**limits)
+        logger.info(f"Rate limits updated: {updated}")
+        return updated
+
+    def get_bandwidth_limits(self) -> Dict:
+        return self.bandwidth.get_limits()
+
+    def update_bandwidth_limits(self, **limits) -> Dict:
+        """Adjust outgoing bandwidth limits at runtime (raises ValueError on bad input)"""
+        updated = self.bandwidth.set_limits(**limits)
+        logger.info(f"Bandwidth limits updated: {updated}")
+        return updated
+
     def list_peers(self) -> List[Dict]:
         peers = self.peer_registry.get_all_peers()
         return [peer.to_dict() for peer in peers]
@@ -360,15 +1103,7 @@ class P2PService:
         temp_peer_id = f"{host}:{port}"
         self.connection_manager.add_connection(sock, (host, port), temp_peer_id)
 
-        handshake = MessageProtocol.create_handshake(
-            self.identity.peer_id,
-            {
-                "address": "localhost",
-                "port": self.port,
-                "public_key": self.identity.get_public_key_string()
-            }
-        )
-        self.connection_manager.send_message(temp_peer_id, handshake)
+        self.connection_manager.send_message(temp_peer_id, self._create_handshake(), traffic_class=CONTROL)
 
         peer = Peer(
             peer_id=temp_peer_id,
@@ -379,7 +1114,8 @@ class P2PService:
         self.peer_registry.register_peer(peer)
         return True
 
-    def send_text_message(self, recipient_id: str, text: str) -> bool:
+    def send_text_message(self, recipient_id: str, text: str, timeout: float = 0.0) -> bool:
+        """Queue a text message; waits up to ``timeout`` seconds if the send queue is saturated"""
         import uuid
 
         message = Message(
@@ -390,9 +1126,9 @@ class P2PService:
             content={"text": text}
         )
 
-        return self.message_queue.put_message(message)
+        return self.message_queue.put_message(message, timeout=timeout)
 
-    def broadcast_text_message(self, text: str) -> bool:
+    def broadcast_text_message(self, text: str, timeout: float = 0.0) -> bool:
         import uuid
 
         message = Message(
@@ -402,65 +1138,200 @@ class P2PService:
             message_type="text",
             content={"text": text}
         )
-        return self.message_queue.put_message(message)
+        return self.message_queue.put_message(message, timeout=timeout)
 
-    def get_messages(self, limit: int = 100) -> List[Dict]:
-        with self.lock:
-            return list(list(self.messages)[0:limit])
+    def send_text_messages(self, items: List[Tuple[Optional[str], str]],
+                           timeout: float = 0.0) -> List[Optional[str]]:
+        """Queue many (recipient_id, text) messages at once; a None recipient broadcasts.
+
+        Returns each item's message ID, or None where the saturated queue rejected it.
+        """
+        messages = [
+            Message(
+                message_id=str(uuid.uuid4()),
+                sender_id=self.identity.peer_id,
+                recipient_id=recipient_id or None,
+                message_type="text",
+                content={"text": text}
+            )
+            for recipient_id, text in items
+        ]
+        accepted = self.message_queue.put_messages(messages, timeout=timeout)
+        return [message.message_id if index < accepted else None for index, message in enumerate(messages)]
+
+    def get_messages(self, limit: int = 100, before: Optional[int] = None, after: Optional[int] = None,
+                     peer_id: Optional[str] = None, message_type: Optional[str] = None,
+                     since: Optional[float] = None, until: Optional[float] = None) -> List[Dict]:
+        """Recorded messages, newest first; ``before``/``after`` are entry ``id`` cursors"""
+        filtered = any(value is not None for value in (before, after, peer_id, message_type, since, until))
+        if not filtered:
+            # The latest page comes from memory, which also covers rows not yet flushed
+            recent = self.history.get(limit)
+            if len(recent) == limit:
+                return recent
+        return self.message_store.query(limit=limit, before=before, after=after, peer_id=peer_id,
+                                        message_type=message_type, since=since, until=until)
     
-    def send_file(self, recipient_id: str, file_data: bytes, filename: str, 
-                  mime_type: str = "application/octet-stream") -> bool:
-        """Send a file to a specific peer"""
-        import uuid
-        import time
-        
+    @staticmethod
+    def _encode_chunk(chunk: bytes, compress: bool) -> Tuple[str, Optional[str]]:
+        """Base64-encode a chunk, zlib-compressing it first when that shrinks it"""
+        if compress:
+            packed = zlib.compress(chunk, 1)
+            if len(packed) < len(chunk):
+                return base64.b64encode(packed).decode('utf-8'), "zlib"
+        return base64.b64encode(chunk).decode('utf-8'), None
+    
+    @staticmethod
+    def _decode_chunk(packed: bytes, limit: int) -> Optional[bytes]:
+        """Inflate a zlib-compressed chunk; None if it is truncated or would exceed ``limit`` bytes"""
+        inflater = zlib.decompressobj()
+        chunk = inflater.decompress(packed, limit)
+        if inflater.unconsumed_tail or not inflater.eof:
+            return None
+        return chunk
+    
+    def _publish_send_progress(self, file_id: str, recipient_id: Optional[str], chunks_sent: int,
+                               total_chunks: int, file_size: int):
+        self.events.publish(CHUNK_PROGRESS, {
+            "file_id": file_id,
+            "direction": "outgoing",
+            "recipient_id": recipient_id,
+            "chunks_sent": chunks_sent,
+            "total_chunks": total_chunks,
+            "file_size": file_size
+        }, key=f"outgoing:{file_id}:{recipient_id}")
+
+    def _send_span(self, recipient_id: Optional[str], file_id: str, first: int, data: bytes, count: int,
+                   total_chunks: int, compress: bool, tree: Optional[MerkleTree]) -> bool:
+        """Send ``count`` consecutive chunks starting at ``first`` in one message (``recipient_id`` None broadcasts)"""
+        chunk_b64, encoding = self._encode_chunk(data, compress)
+        last = first + count - 1
+        proofs = [tree.proof(index) for index in range(first, last + 1)] if tree else None
+        chunk_msg = MessageProtocol.create_file_transfer_chunk(
+            self.identity.peer_id, recipient_id, file_id, first, chunk_b64, last == total_chunks - 1, encoding,
+            proofs[0] if proofs and count == 1 else None, proofs if proofs and count > 1 else None
+        )
+        if recipient_id is None:
+            self.connection_manager.broadcast_message(chunk_msg, exclude_peer=self.identity.peer_id,
+                                                      traffic_class=BULK)
+            return True
+        return self.connection_manager.send_message(recipient_id, chunk_msg, traffic_class=BULK)
+
+    def _send_chunks(self, recipient_id: Optional[str], file_id: str, chunks: Iterator[memoryview],
+                     file_size: int, chunk_size: int, sizer: ChunkSizer, compress: bool,
+                     tree: Optional[MerkleTree], wanted: Optional[bytearray] = None,
+                     job: Optional[TransferJob] = None) -> bool:
+        """Send a file's chunks in spans of the size ``sizer`` picks; False if the connection was lost
+
+        Chunks that are not ``wanted`` are skipped and end the span before
+        them. ``recipient_id`` None broadcasts the chunks.
+        """
+        total_chunks = (file_size + chunk_size - 1) // chunk_size
+        span: List[bytes] = []
+        first = 0
+        mark = time.monotonic()
+        for i, chunk in enumerate(chunks):
+            if job:
+                job.checkpoint(i * chunk_size)
+            if wanted is not None and not wanted[i]:
+                self._publish_send_progress(file_id, recipient_id, i + 1, total_chunks, file_size)
+                mark = time.monotonic()
+                continue
+            if not span:
+                first = i
+            ends_run = i == total_chunks - 1 or (wanted is not None and not wanted[i + 1])
+            if len(span) + 1 < sizer.chunks() and not ends_run:
+                # Chunks are views into a reused read buffer: keep a copy until the span goes out
+                span.append(bytes(chunk))
+                continue
+            data = b"".join(span + [chunk]) if span else chunk
+            if not self._send_span(recipient_id, file_id, first, data, len(span) + 1, total_chunks, compress, tree):
+                logger.error(f"Failed to send chunks {first}-{i} of {file_id} to {recipient_id}")
+                return False
+            span = []
+            now = time.monotonic()
+            sizer.record(len(data), now - mark)
+            mark = now
+            self._publish_send_progress(file_id, recipient_id, i + 1, total_chunks, file_size)
+        return True
+    
+    def send_file(self, recipient_id: str, file_data: Union[bytes, str, os.PathLike, StoredFile], filename: str, 
+                  mime_type: str = "application/octet-stream", job: Optional[TransferJob] = None) -> bool:
+        """Send a file to a specific peer
+
+        ``file_data`` is the file content, a path or a stored file; those are
+        streamed from disk chunk by chunk instead of being loaded into memory.
+        For a stored file in the chunk store, the request carries its
+        manifest and only the chunks the peer does not already hold are sent.
+        When run as a background ``job``, progress is reported to it after
+        every chunk, where it may also be paused or cancelled. Peers that
+        negotiated adaptive chunks get spans of several chunks per message,
+        sized from the RTT and the goodput the transfer achieves.
+        """
         # Generate file ID
         file_id = FileManager.generate_file_id(filename, self.identity.peer_id)
-        logger.info(f"Sending file {filename} ({len(file_data)} bytes) to peer {recipient_id} (ID: {file_id})")
-        
-        # Send file transfer request
-        request = MessageProtocol.create_file_transfer_request(
-            self.identity.peer_id,
-            recipient_id,
-            file_id,
-            filename,
-            len(file_data),
-            mime_type
-        )
-        
-        if not self.connection_manager.send_message(recipient_id, request):
-            logger.error(f"Failed to send file transfer request to {recipient_id}")
-            return False
-        
-        # Split file into chunks (32KB chunks to avoid message size issues)
-        chunk_size = 32 * 1024
-        total_chunks = (len(file_data) + chunk_size - 1) // chunk_size
-        logger.info(f"Splitting file {filename} into {total_chunks} chunks of {chunk_size} bytes each")
+        # The chunk grid that resumes, Merkle proofs and want lists refer to; spans are whole chunks of it
+        chunk_size = DEFAULT_CHUNK_SIZE
+        max_chunk_size = None
+        sizer = ChunkSizer(chunk_size, chunk_size)
+        if self.connection_manager.peer_supports(recipient_id, Capability.ADAPTIVE_CHUNKS):
+            max_chunk_size = span_limit(chunk_size, self.validator.max_message_size)
+            sizer = ChunkSizer(chunk_size, max_chunk_size, self._measure_rtt([recipient_id]),
+                               self.links.goodput(recipient_id))
         
         try:
-            for i in range(total_chunks):
-                start = i * chunk_size
-                end = min(start + chunk_size, len(file_data))
-                chunk = file_data[start:end]
-                chunk_b64 = base64.b64encode(chunk).decode('utf-8')
-                is_last = (i == total_chunks - 1)
+            # Hashing the chunks up front lets the receiver verify each one as it arrives
+            tree = None
+            if self.connection_manager.peer_supports(recipient_id, Capability.MERKLE_PROOFS):
+                tree = self._merkle_tree(file_id, file_data, chunk_size)
+            self.sending.add((recipient_id, file_id))
+            with chunk_stream(file_data, chunk_size) as (file_size, chunks):
+                logger.info(f"Sending file {filename} ({file_size} bytes) to peer {recipient_id} (ID: {file_id})")
+                if not isinstance(file_data, bytes):
+                    # Files on disk can be re-read later to resend chunks the peer missed
+                    self.file_manager.register_outgoing(file_id, file_data, [recipient_id], file_size, chunk_size)
+                
+                manifest = None
+                if isinstance(file_data, StoredFile) and \
+                        self.connection_manager.peer_supports(recipient_id, Capability.DEDUP_CHUNKS):
+                    manifest = self.file_manager.get_manifest(file_data.file_id)
+                    if manifest and len(manifest) > MAX_MANIFEST_CHUNKS:
+                        manifest = None
+                    if manifest:
+                        self.pending_wants[(recipient_id, file_id)] = [threading.Event(), None]
                 
-                chunk_msg = MessageProtocol.create_file_transfer_chunk(
+                # Send file transfer request
+                request = MessageProtocol.create_file_transfer_request(
                     self.identity.peer_id,
                     recipient_id,
                     file_id,
-                    i,
-                    chunk_b64,
-                    is_last
+                    filename,
+                    file_size,
+                    mime_type,
+                    chunk_size,
+                    manifest,
+                    tree.root if tree else None,
+                    max_chunk_size
                 )
                 
-                if not self.connection_manager.send_message(recipient_id, chunk_msg):
-                    logger.error(f"Failed to send chunk {i} to {recipient_id}")
+                if not self.connection_manager.send_message(recipient_id, request, traffic_class=CONTROL):
+                    logger.error(f"Failed to send file transfer request to {recipient_id}")
+                    self.pending_wants.pop((recipient_id, file_id), None)
                     return False
                 
-                # Small delay between chunks to prevent overwhelming the receiver
-                if i < total_chunks - 1:
-                    time.sleep(0.01)  # 10ms delay
+                total_chunks = (file_size + chunk_size - 1) // chunk_size
+                logger.info(f"Splitting file {filename} into {total_chunks} chunks of {chunk_size} bytes each")
+                compress = self.connection_manager.peer_supports(recipient_id, Capability.ZLIB_CHUNKS)
+                wanted = self._await_want(recipient_id, file_id, total_chunks) if manifest else None
+                if wanted is not None:
+                    logger.info(f"{recipient_id[:16]}... already holds {total_chunks - sum(wanted)} "
+                                f"of {total_chunks} chunks of {filename}")
+                
+                if not self._send_chunks(recipient_id, file_id, chunks, file_size, chunk_size, sizer,
+                                         compress, tree, wanted, job):
+                    return False
+                if max_chunk_size:
+                    self.links.record_goodput(recipient_id, sizer.goodput)
             
             # Send completion message
             complete_msg = MessageProtocol.create_file_transfer_complete(
@@ -468,25 +1339,34 @@ class P2PService:
                 recipient_id,
                 file_id
             )
-            if not self.connection_manager.send_message(recipient_id, complete_msg):
+            if not self.connection_manager.send_message(recipient_id, complete_msg, traffic_class=CONTROL):
                 logger.error(f"Failed to send completion message to {recipient_id}")
                 return False
             
-            logger.info(f"File {filename} ({total_chunks} chunks) sent to {recipient_id}")
+            logger.info(f"File {filename} ({total_chunks} chunks) sent to {recipient_id} "
+                        f"(final span {sizer.size} bytes)")
             return True
+        except TransferCancelled:
+            # The receiver keeps what it has, but must not get the rest resent on reconnect
+            logger.info(f"Sending {filename} to {recipient_id} cancelled")
+            self.file_manager.finish_outgoing(file_id, recipient_id)
+            raise
         except Exception as e:
             logger.error(f"Error sending file {filename}: {e}", exc_info=True)
             return False
+        finally:
+            self.sending.discard((recipient_id, file_id))
     
-    def broadcast_file(self, file_data: bytes, filename: str, 
-                       mime_type: str = "application/octet-stream") -> bool:
-        """Broadcast a file to all connected peers"""
-        import uuid
-        import time
-        
+    def broadcast_file(self, file_data: Union[bytes, str, os.PathLike, StoredFile], filename: str, 
+                       mime_type: str = "application/octet-stream", job: Optional[TransferJob] = None) -> bool:
+        """Broadcast a file to all connected peers
+
+        ``file_data`` is the file content, a path or a stored file. Each chunk is read and
+        encoded once and the same frame goes to every peer. ``job`` is as for ``send_file``;
+        spans of several chunks are used only if every peer negotiated adaptive chunks.
+        """
         # Generate file ID
         file_id = FileManager.generate_file_id(filename, self.identity.peer_id)
-        logger.info(f"Broadcasting file {filename} ({len(file_data)} bytes) (ID: {file_id})")
         
         # Get all connected peers
         connected_peers = self.connection_manager.get_active_connections()
@@ -500,49 +1380,53 @@ class P2PService:
             logger.warning("No other peers to broadcast file to (only self connected)")
             return False
         
-        logger.info(f"Broadcasting to {len(connected_peers)} peers: {connected_peers}")
-        
-        # Send file transfer request to all peers
-        request = MessageProtocol.create_file_transfer_request(
-            self.identity.peer_id,
-            None,  # None means broadcast
-            file_id,
-            filename,
-            len(file_data),
-            mime_type
+        chunk_size = DEFAULT_CHUNK_SIZE
+        max_chunk_size = None
+        sizer = ChunkSizer(chunk_size, chunk_size)
+        if all(self.connection_manager.peer_supports(peer_id, Capability.ADAPTIVE_CHUNKS)
+               for peer_id in connected_peers):
+            # Sized for the slowest link: every peer gets the same spans
+            max_chunk_size = span_limit(chunk_size, self.validator.max_message_size)
+            sizer = ChunkSizer(chunk_size, max_chunk_size, self._measure_rtt(connected_peers))
+        # Broadcast chunks are shared, so only compress if every recipient can decode them
+        compress = all(
+            self.connection_manager.peer_supports(peer_id, Capability.ZLIB_CHUNKS)
+            for peer_id in connected_peers
         )
         
-        # Broadcast the request
-        self.connection_manager.broadcast_message(request, exclude_peer=self.identity.peer_id)
-        
-        # Split file into chunks (32KB chunks to avoid message size issues)
-        chunk_size = 32 * 1024
-        total_chunks = (len(file_data) + chunk_size - 1) // chunk_size
-        logger.info(f"Splitting file {filename} into {total_chunks} chunks of {chunk_size} bytes each")
-        
         try:
-            for i in range(total_chunks):
-                start = i * chunk_size
-                end = min(start + chunk_size, len(file_data))
-                chunk = file_data[start:end]
-                chunk_b64 = base64.b64encode(chunk).decode('utf-8')
-                is_last = (i == total_chunks - 1)
+            tree = None
+            if all(self.connection_manager.peer_supports(peer_id, Capability.MERKLE_PROOFS)
+                   for peer_id in connected_peers):
+                tree = self._merkle_tree(file_id, file_data, chunk_size)
+            self.sending.update((peer_id, file_id) for peer_id in connected_peers)
+            with chunk_stream(file_data, chunk_size) as (file_size, chunks):
+                logger.info(f"Broadcasting file {filename} ({file_size} bytes) (ID: {file_id})")
+                logger.info(f"Broadcasting to {len(connected_peers)} peers: {connected_peers}")
+                if not isinstance(file_data, bytes):
+                    self.file_manager.register_outgoing(file_id, file_data, connected_peers, file_size, chunk_size)
                 
-                chunk_msg = MessageProtocol.create_file_transfer_chunk(
+                # Send file transfer request to all peers
+                request = MessageProtocol.create_file_transfer_request(
                     self.identity.peer_id,
                     None,  # None means broadcast
                     file_id,
-                    i,
-                    chunk_b64,
-                    is_last
+                    filename,
+                    file_size,
+                    mime_type,
+                    chunk_size,
+                    merkle_root=tree.root if tree else None,
+                    max_chunk_size=max_chunk_size
                 )
                 
-                # Broadcast each chunk
-                self.connection_manager.broadcast_message(chunk_msg, exclude_peer=self.identity.peer_id)
+                # Broadcast the request
+                self.connection_manager.broadcast_message(request, exclude_peer=self.identity.peer_id, traffic_class=CONTROL)
+                
+                total_chunks = (file_size + chunk_size - 1) // chunk_size
+                logger.info(f"Splitting file {filename} into {total_chunks} chunks of {chunk_size} bytes each")
                 
-                # Small delay between chunks to prevent overwhelming receivers
-                if i < total_chunks - 1:
-                    time.sleep(0.01)  # 10ms delay
+                # None means broadcast
+                self._send_chunks(None, file_id, chunks, file_size, chunk_size, sizer, compress, tree, job=job)
             
             # Send completion message to all peers
             complete_msg = MessageProtocol.create_file_transfer_complete(
@@ -550,13 +1434,129 @@ class P2PService:
                 None,  # None means broadcast
                 file_id
             )
-            self.connection_manager.broadcast_message(complete_msg, exclude_peer=self.identity.peer_id)
+            self.connection_manager.broadcast_message(complete_msg, exclude_peer=self.identity.peer_id, traffic_class=CONTROL)
             
             logger.info(f"File {filename} ({total_chunks} chunks) broadcasted to {len(connected_peers)} peers")
             return True
+        except TransferCancelled:
+            logger.info(f"Broadcast of {filename} cancelled")
+            for peer_id in connected_peers:
+                self.file_manager.finish_outgoing(file_id, peer_id)
+            raise
         except Exception as e:
             logger.error(f"Error broadcasting file {filename}: {e}", exc_info=True)
             return False
+        finally:
+            self.sending.difference_update((peer_id, file_id) for peer_id in connected_peers)
+    
+    def swarm_download(self, file_id: str, strategy: str = "rarest", job: Optional[TransferJob] = None) -> bool:
+        """Fetch a file from every connected peer that holds it, in parallel
+
+        Peers that hold only part of the file (e.g. because they are still
+        receiving a broadcast) serve the chunks they have. If peers disagree
+        about the file, the description most of them give is used. Chunks of
+        an interrupted (or cancelled) download are kept, so calling this
+        again resumes it. ``job`` is as for ``send_file``.
+        """
+        file_info = self.file_manager.get_file_info(file_id)
+        if file_info and file_info.get("status") == "completed":
+            return True
+        peers = [peer_id for peer_id in self.connection_manager.get_active_connections()
+                 if peer_id != self.identity.peer_id
+                 and self.connection_manager.peer_supports(peer_id, Capability.SWARM)]
+        if not peers:
+            logger.warning(f"No connected peers support swarm downloads of {file_id}")
+            return False
+        
+        haves = self._query_swarm(file_id, peers)
+        groups: Dict[Tuple, List[str]] = {}
+        for peer_id, have in haves.items():
+            if have.get("ranges"):
+                key = (have["file_size"], have["chunk_size"], have.get("merkle_root"))
+                groups.setdefault(key, []).append(peer_id)
+        if not groups:
+            logger.warning(f"None of {len(peers)} peers holds any of {file_id}")
+            return False
+        (file_size, chunk_size, merkle_root), holders = max(groups.items(), key=lambda group: len(group[1]))
+        
+        if not file_info:
+            have = haves[holders[0]]
+            if not self.file_manager.register_file(
+                file_id, have.get("filename") or file_id, file_size,
+                have.get("mime_type") or "application/octet-stream", holders[0], self.identity.peer_id,
+                # Holders only offer broadcast files, so our copy is one too
+                chunk_size=chunk_size, merkle_root=merkle_root, shared=True
+            ):
+                return False
+        elif (file_info["file_size"], file_info.get("chunk_size", DEFAULT_CHUNK_SIZE),
+              file_info.get("merkle_root")) != (file_size, chunk_size, merkle_root):
+            logger.warning(f"Our partial copy of {file_id} does not match the one peers hold")
+            return False
+        
+        try:
+            swarm = SwarmDownload(file_id, file_size, chunk_size, self.file_manager.missing_chunks(file_id), strategy)
+        except ValueError as e:
+            logger.warning(str(e))
+            return False
+        for peer_id in holders:
+            swarm.add_source(peer_id, haves[peer_id]["ranges"])
+        with self.lock:
+            self.swarms[file_id] = swarm
+        if job:
+            job.total_bytes = file_size
+            job.filename = (self.file_manager.get_file_info(file_id) or {}).get("filename", job.filename)
+        logger.info(f"Swarm downloading {file_id} ({file_size} bytes) from {len(holders)} peers ({strategy} first)")
+        try:
+            while not swarm.done():
+                connected = set(self.connection_manager.get_active_connections())
+                for peer_id in swarm.source_ids():
+                    if peer_id not in connected:
+                        swarm.remove_source(peer_id)
+                if not swarm.can_finish():
+                    logger.warning(f"Swarm download of {file_id} stopped: no source left for its missing chunks")
+                    return False
+                for peer_id, ranges in swarm.schedule():
+                    fetch = MessageProtocol.create_file_swarm_fetch(self.identity.peer_id, peer_id, file_id, ranges)
+                    if not self.connection_manager.send_message(peer_id, fetch, traffic_class=CONTROL):
+                        swarm.remove_source(peer_id)
+                swarm.wait(SWARM_TICK)
+                if job:
+                    job.checkpoint(file_size - swarm.bytes_missing())
+        finally:
+            with self.lock:
+                self.swarms.pop(file_id, None)
+        
+        success = self.file_manager.complete_file(file_id)
+        stats = swarm.get_stats()
+        logger.info(f"Swarm download of {file_id} {'finished' if success else 'failed'} in {stats['elapsed']}s: "
+                    f"{stats['blocks_reassigned']} blocks reassigned, {stats['duplicate_chunks']} duplicate chunks")
+        return success
+    
+    def get_swarm_stats(self) -> Dict[str, Dict]:
+        with self.lock:
+            swarms = list(self.swarms.values())
+        return {swarm.file_id: swarm.get_stats() for swarm in swarms}
+    
+    def queue_file_send(self, recipient_id: Optional[str], stored_file: StoredFile, filename: str,
+                        mime_type: str = "application/octet-stream", priority: int = 5) -> TransferJob:
+        """Send (or, without a recipient, broadcast) a stored file as a background job"""
+        if recipient_id:
+            return self.transfers.submit(
+                "send", stored_file.file_id, filename, recipient_id, stored_file.size,
+                lambda job: self.send_file(recipient_id, stored_file, filename, mime_type, job), priority
+            )
+        return self.transfers.submit(
+            "broadcast", stored_file.file_id, filename, None, stored_file.size,
+            lambda job: self.broadcast_file(stored_file, filename, mime_type, job), priority
+        )
+    
+    def queue_swarm_download(self, file_id: str, strategy: str = "rarest", priority: int = 5) -> TransferJob:
+        """Swarm download a file as a background job"""
+        file_info = self.file_manager.get_file_info(file_id) or {}
+        return self.transfers.submit(
+            "download", file_id, file_info.get("filename", file_id), None, file_info.get("file_size", 0),
+            lambda job: self.swarm_download(file_id, strategy, job), priority
+        )
     
     def list_files(self, limit: int = 100) -> List[Dict]:
         """List all files"""
@@ -0,0 +1,272 @@
+import bisect
+import logging
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger("Swarm")
+
+BLOCK_CHUNKS = 16  # consecutive chunks requested from one source at a time
+PIPELINE_BLOCKS = 2  # blocks outstanding per source, so it does not idle between requests
+STALL_TIMEOUT = 5.0  # a block with no new chunk for this long is taken away from its source
+MAX_STALLS = 3  # stalled blocks before a source is dropped
+MAX_REJECTED = 3  # chunks failing verification before a source is dropped
+SLOW_FACTOR = 2.0  # an idle source takes over a block it would finish this many times sooner
+STRATEGIES = ("rarest", "fastest")
+
+
+class _Source:
+    """A peer holding (part of) the file, with its measured throughput"""
+
+    def __init__(self, peer_id: str, ranges: List[List[int]]):
+        self.peer_id = peer_id
+        self.starts = [start for start, _ in ranges]
+        self.ends = [end for _, end in ranges]
+        self.blocks: Set[int] = set()  # blocks currently assigned to it
+        self.bytes_received = 0
+        self.busy_time = 0.0  # seconds spent with at least one block assigned
+        self.busy_since: Optional[float] = None
+        self.stalls = 0
+        self.rejected = 0
+
+    def holds(self, index: int) -> bool:
+        position = bisect.bisect_right(self.starts, index) - 1
+        return position >= 0 and index <= self.ends[position]
+
+    def rate(self, now: float) -> Optional[float]:
+        """Bytes per second while it had work, or None before anything arrived"""
+        busy = self.busy_time + (now - self.busy_since if self.busy_since is not None else 0.0)
+        if not self.bytes_received or busy <= 0:
+            return None
+        return self.bytes_received / busy
+
+
+class SwarmDownload:
+    """Schedules the missing chunks of one file across the peers that hold them.
+
+    Chunks are requested in blocks of ``BLOCK_CHUNKS`` and each source is
+    kept busy with up to ``PIPELINE_BLOCKS`` blocks. With the "rarest"
+    strategy the blocks the fewest sources hold go first, so they are
+    fetched before those sources can leave; with "fastest" the blocks go in
+    file order. Either way the sources with the best measured throughput
+    pick first. A block whose source stalls is handed to another source,
+    and once nothing is left unassigned an idle source takes over a block
+    from a much slower one.
+    """
+
+    def __init__(self, file_id: str, file_size: int, chunk_size: int, missing: Iterable[int],
+                 strategy: str = "rarest"):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown swarm strategy {strategy!r}")
+        self.file_id = file_id
+        self.file_size = file_size
+        self.chunk_size = chunk_size
+        self.strategy = strategy
+        self.missing: Set[int] = set(missing)
+        self.blocks: Dict[int, Set[int]] = {}  # block -> chunks of it still missing
+        for index in self.missing:
+            self.blocks.setdefault(index // BLOCK_CHUNKS, set()).add(index)
+        self.assigned: Dict[int, Tuple[str, float]] = {}  # block -> (peer_id, time of its last chunk)
+        self.sources: Dict[str, _Source] = {}
+        self.lock = threading.Lock()
+        self.progress = threading.Event()  # set whenever a chunk arrives or a source goes away
+        self.started = time.time()
+        self.stats = {"chunks_received": 0, "duplicate_chunks": 0, "chunks_rejected": 0,
+                      "blocks_requested": 0, "blocks_reassigned": 0, "sources_dropped": 0}
+
+    def _chunk_bytes(self, index: int) -> int:
+        return min(self.chunk_size, self.file_size - index * self.chunk_size)
+
+    def add_source(self, peer_id: str, ranges: List[List[int]]):
+        """Register a peer and the inclusive chunk ranges it holds"""
+        with self.lock:
+            self.sources[peer_id] = _Source(peer_id, sorted(ranges))
+
+    def remove_source(self, peer_id: str):
+        with self.lock:
+            self._drop(peer_id, time.time())
+
+    def _drop(self, peer_id: str, now: float):
+        source = self.sources.pop(peer_id, None)
+        if source is None:
+            return
+        for block in list(source.blocks):
+            self._unassign(block, now)
+        self.stats["sources_dropped"] += 1
+        self.progress.set()
+
+    def _assign(self, block: int, source: _Source, now: float):
+        if not source.blocks:
+            source.busy_since = now
+        source.blocks.add(block)
+        self.assigned[block] = (source.peer_id, now)
+        self.stats["blocks_requested"] += 1
+
+    def _unassign(self, block: int, now: float):
+        peer_id, _ = self.assigned.pop(block, (None, 0.0))
+        source = self.sources.get(peer_id)
+        if source is None:
+            return
+        source.blocks.discard(block)
+        if not source.blocks and source.busy_since is not None:
+            source.busy_time += now - source.busy_since
+            source.busy_since = None
+
+    def _can_fetch(self, source: _Source, block: int) -> bool:
+        return all(source.holds(index) for index in self.blocks[block])
+
+    def _pick_block(self, source: _Source) -> Optional[int]:
+        candidates = [block for block in self.blocks
+                      if block not in self.assigned and self._can_fetch(source, block)]
+        if not candidates:
+            return None
+        if self.strategy == "fastest":
+            return min(candidates)
+        return min(candidates, key=lambda block: (
+            sum(1 for other in self.sources.values() if self._can_fetch(other, block)), block
+        ))
+
+    def _steal_block(self, source: _Source, now: float) -> Optional[int]:
+        """A block that this (idle) source would finish much sooner than its current one"""
+        rate = source.rate(now)
+        if rate is None:
+            return None
+        best, best_time = None, 0.0
+        for block, (peer_id, _) in self.assigned.items():
+            owner = self.sources.get(peer_id)
+            owner_rate = owner.rate(now) if owner else None
+            if owner is source or owner_rate is None or not self._can_fetch(source, block):
+                continue
+            remaining = sum(self._chunk_bytes(index) for index in self.blocks[block])
+            owner_time = remaining / owner_rate
+            if owner_time > SLOW_FACTOR * remaining / rate and owner_time > best_time:
+                best, best_time = block, owner_time
+        if best is not None:
+            logger.info(f"Moving block {best} of {self.file_id} from a slow source to {source.peer_id[:16]}...")
+            self._unassign(best, now)
+            self.stats["blocks_reassigned"] += 1
+        return best
+
+    def _ranges(self, block: int) -> List[List[int]]:
+        ranges: List[List[int]] = []
+        for index in sorted(self.blocks[block]):
+            if ranges and ranges[-1][1] == index - 1:
+                ranges[-1][1] = index
+            else:
+                ranges.append([index, index])
+        return ranges
+
+    def schedule(self, now: Optional[float] = None) -> List[Tuple[str, List[List[int]]]]:
+        """Reassign stalled blocks and fill every source's pipeline.
+
+        Returns the (peer_id, chunk ranges) requests to send.
+        """
+        now = time.time() if now is None else now
+        requests = []
+        with self.lock:
+            for block, (peer_id, last_progress) in list(self.assigned.items()):
+                if now - last_progress < STALL_TIMEOUT:
+                    continue
+                logger.info(f"Block {block} of {self.file_id} stalled at {peer_id[:16]}..., reassigning it")
+                self._unassign(block, now)
+                self.stats["blocks_reassigned"] += 1
+                source = self.sources.get(peer_id)
+                if source is not None:
+                    source.stalls += 1
+                    if source.stalls >= MAX_STALLS:
+                        logger.warning(f"Dropping swarm source {peer_id[:16]}...: it keeps stalling")
+                        self._drop(peer_id, now)
+
+            # Sources that have not been measured yet go first, so they get measured
+            by_speed = sorted(self.sources.values(), key=lambda s: -(s.rate(now) or float("inf")))
+            for source in by_speed:
+                while len(source.blocks) < PIPELINE_BLOCKS:
+                    block = self._pick_block(source)
+                    if block is None:
+                        block = self._steal_block(source, now)
+                    if block is None:
+                        break
+                    self._assign(block, source, now)
+                    requests.append((source.peer_id, self._ranges(block)))
+        return requests
+
+    def received(self, peer_id: str, index: int, size: Optional[int] = None, now: Optional[float] = None) -> bool:
+        """Record a chunk that was verified and stored; False if we already had it"""
+        now = time.time() if now is None else now
+        with self.lock:
+            source = self.sources.get(peer_id)
+            if source is not None:
+                source.bytes_received += self._chunk_bytes(index) if size is None else size
+            if index not in self.missing:
+                self.stats["duplicate_chunks"] += 1
+                return False
+            self.missing.discard(index)
+            self.stats["chunks_received"] += 1
+            block = index // BLOCK_CHUNKS
+            pending = self.blocks[block]
+            pending.discard(index)
+            if not pending:
+                self._unassign(block, now)
+                del self.blocks[block]
+            elif block in self.assigned:
+                self.assigned[block] = (self.assigned[block][0], now)
+        self.progress.set()
+        return True
+
+    def rejected(self, peer_id: str, index: int):
+        """A chunk from this source failed verification: request its block again"""
+        now = time.time()
+        with self.lock:
+            self.stats["chunks_rejected"] += 1
+            block = index // BLOCK_CHUNKS
+            if block in self.assigned:
+                self._unassign(block, now)
+            source = self.sources.get(peer_id)
+            if source is not None:
+                source.rejected += 1
+                if source.rejected >= MAX_REJECTED:
+                    logger.warning(f"Dropping swarm source {peer_id[:16]}...: it sent {source.rejected} bad chunks")
+                    self._drop(peer_id, now)
+        self.progress.set()
+
+    def bytes_missing(self) -> int:
+        with self.lock:
+            return sum(self._chunk_bytes(index) for index in self.missing)
+
+    def source_ids(self) -> List[str]:
+        with self.lock:
+            return list(self.sources)
+
+    def done(self) -> bool:
+        return not self.missing
+
+    def can_finish(self) -> bool:
+        """Whether the remaining sources between them hold every missing chunk"""
+        with self.lock:
+            return all(any(source.holds(index) for source in self.sources.values()) for index in self.missing)
+
+    def wait(self, timeout: float):
+        """Sleep until a chunk arrives or ``timeout`` passes"""
+        self.progress.wait(timeout)
+        self.progress.clear()
+
+    def get_stats(self) -> Dict:
+        now = time.time()
+        with self.lock:
+            return {
+                **self.stats,
+                "file_id": self.file_id,
+                "strategy": self.strategy,
+                "chunks_missing": len(self.missing),
+                "elapsed": round(now - self.started, 3),
+                "sources": {
+                    peer_id: {
+                        "bytes_received": source.bytes_received,
+                        "rate": round(source.rate(now) or 0.0),
+                        "blocks": len(source.blocks),
+                        "stalls": source.stalls,
+                        "rejected": source.rejected
+                    }
+                    for peer_id, source in self.sources.items()
+                }
+            }
@@ -0,0 +1,263 @@
+import itertools
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger("TransferManager")
+
+# Job states
+QUEUED = "queued"  # waiting for a free slot (new, or resumed after a pause)
+RUNNING = "running"
+PAUSED = "paused"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+CANCELLING = "cancelling"  # only reported: a cancelled job that has not reached its next checkpoint yet
+FINISHED_STATES = (COMPLETED, FAILED, CANCELLED)
+
+MAX_FINISHED_JOBS = 200  # finished jobs kept for listing; the oldest are forgotten first
+
+
+class TransferCancelled(Exception):
+    """Raised inside a transfer at its next checkpoint once its job is cancelled"""
+
+
+class TransferJob:
+    """One file transfer run by the TransferManager, with its progress.
+
+    The transfer function calls ``checkpoint`` between chunks: that records
+    progress, blocks while the job is paused and raises TransferCancelled
+    once it is cancelled.
+    """
+
+    def __init__(self, manager: "TransferManager", kind: str, file_id: str, filename: str,
+                 peer_id: Optional[str], total_bytes: int, priority: int,
+                 run: Callable[["TransferJob"], bool]):
+        self.manager = manager
+        self.transfer_id = uuid.uuid4().hex
+        self.kind = kind  # "send", "broadcast" or "download"
+        self.file_id = file_id
+        self.filename = filename
+        self.peer_id = peer_id
+        self.total_bytes = total_bytes
+        self.priority = priority
+        self.run = run
+        self.sequence = next(manager.sequence)  # FIFO order within a priority
+        self.state = QUEUED
+        self.started = False
+        self.cancelled = False
+        self.bytes_done = 0
+        self.active_time = 0.0  # seconds spent running, excluding pauses and queueing
+        self.running_since: Optional[float] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    def checkpoint(self, bytes_done: Optional[int] = None):
+        """Record progress; block while paused; raise TransferCancelled if cancelled"""
+        self.manager._checkpoint(self, bytes_done)
+
+    def rate(self, now: float) -> float:
+        """Average bytes per second while running"""
+        active = self.active_time + (now - self.running_since if self.running_since is not None else 0.0)
+        return self.bytes_done / active if active > 0 else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        now = time.time()
+        rate = self.rate(now)
+        remaining = max(0, self.total_bytes - self.bytes_done)
+        return {
+            "transfer_id": self.transfer_id,
+            "kind": self.kind,
+            "file_id": self.file_id,
+            "filename": self.filename,
+            "peer_id": self.peer_id,
+            "state": CANCELLING if self.cancelled and self.state not in FINISHED_STATES else self.state,
+            "priority": self.priority,
+            "bytes_done": self.bytes_done,
+            "total_bytes": self.total_bytes,
+            "progress": round(self.bytes_done / self.total_bytes, 4) if self.total_bytes else 1.0,
+            "rate": round(rate),
+            "eta": round(remaining / rate, 1) if self.state == RUNNING and rate > 0 else None,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at
+        }
+
+
+class TransferManager:
+    """Runs file transfers in the background, at most ``max_concurrent`` at a time.
+
+    Jobs start in priority order (1=highest, 10=lowest, FIFO within a
+    priority) whenever a slot is free. Each running job has its own thread.
+    A paused job gives up its slot; once resumed it queues for a slot again
+    and carries on from where it stopped. Cancelling takes effect at the
+    transfer's next checkpoint, or at once for a job that has not started.
+    """
+
+    def __init__(self, max_concurrent: int = 2):
+        self.max_concurrent = max(1, max_concurrent)
+        self.jobs: "OrderedDict[str, TransferJob]" = OrderedDict()
+        self.sequence = itertools.count()
+        self.running = 0
+        self.lock = threading.RLock()
+        self.changed = threading.Condition(self.lock)
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "cancelled": 0}
+
+    def submit(self, kind: str, file_id: str, filename: str, peer_id: Optional[str], total_bytes: int,
+               run: Callable[[TransferJob], bool], priority: int = 5) -> TransferJob:
+        """Queue a transfer; ``run(job)`` performs it and returns whether it succeeded"""
+        with self.lock:
+            job = TransferJob(self, kind, file_id, filename, peer_id, total_bytes,
+                              min(10, max(1, priority)), run)
+            self.jobs[job.transfer_id] = job
+            self.stats["submitted"] += 1
+            logger.info(f"Queued {kind} of {filename} as transfer {job.transfer_id} (priority {job.priority})")
+            self._schedule()
+            return job
+
+    def _schedule(self):
+        """Hand free slots to the best waiting jobs (caller holds the lock)"""
+        while self.running < self.max_concurrent:
+            waiting = [job for job in self.jobs.values() if job.state == QUEUED and not job.cancelled]
+            if not waiting:
+                return
+            job = min(waiting, key=lambda j: (j.priority, j.sequence))
+            self._set_running(job)
+            if job.started:
+                # A resumed job's thread is waiting in checkpoint for its slot
+                self.changed.notify_all()
+                continue
+            job.started = True
+            thread = threading.Thread(target=self._run, args=(job,), name=f"transfer-{job.transfer_id[:8]}")
+            thread.daemon = True
+            thread.start()
+
+    def _set_running(self, job: TransferJob):
+        job.state = RUNNING
+        job.running_since = time.time()
+        self.running += 1
+
+    def _leave_running(self, job: TransferJob, state: str):
+        """Move a running job to another state, freeing its slot (caller holds the lock)"""
+        if job.state == RUNNING:
+            self.running -= 1
+            job.active_time += time.time() - job.running_since
+            job.running_since = None
+        job.state = state
+
+    def _run(self, job: TransferJob):
+        error = None
+        try:
+            success = job.run(job)
+        except TransferCancelled:
+            success = False
+        except Exception as e:
+            logger.error(f"Transfer {job.transfer_id} failed: {e}", exc_info=True)
+            success, error = False, str(e)
+        with self.lock:
+            if job.cancelled:
+                state = CANCELLED
+            else:
+                state = COMPLETED if success else FAILED
+            self._finish(job, state, error)
+            self._schedule()
+
+    def _finish(self, job: TransferJob, state: str, error: Optional[str] = None):
+        self._leave_running(job, state)
+        job.error = error
+        job.finished_at = time.time()
+        if state == COMPLETED:
+            job.bytes_done = job.total_bytes
+        self.stats[state] += 1
+        logger.info(f"Transfer {job.transfer_id} ({job.filename}) {state}")
+        self.changed.notify_all()
+        finished = [tid for tid, j in self.jobs.items() if j.state in FINISHED_STATES]
+        for transfer_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[transfer_id]
+
+    def _checkpoint(self, job: TransferJob, bytes_done: Optional[int]):
+        with self.lock:
+            if bytes_done is not None:
+                job.bytes_done = bytes_done
+            while not job.cancelled and job.state != RUNNING:
+                self.changed.wait()
+            if job.cancelled:
+                raise TransferCancelled(job.transfer_id)
+
+    def pause(self, transfer_id: str) -> bool:
+        with self.lock:
+            job = self.jobs.get(transfer_id)
+            if not job or job.state not in (QUEUED, RUNNING):
+                return False
+            self._leave_running(job, PAUSED)
+            self._schedule()
+            return True
+
+    def resume(self, transfer_id: str) -> bool:
+        with self.lock:
+            job = self.jobs.get(transfer_id)
+            if not job or job.state != PAUSED:
+                return False
+            job.state = QUEUED
+            self._schedule()
+            return True
+
+    def cancel(self, transfer_id: str) -> bool:
+        with self.lock:
+            job = self.jobs.get(transfer_id)
+            if not job or job.state in FINISHED_STATES:
+                return False
+            job.cancelled = True
+            if not job.started:
+                self._finish(job, CANCELLED)
+            else:
+                # The transfer stops at its next checkpoint; it keeps its slot until then
+                self.changed.notify_all()
+            return True
+
+    def set_priority(self, transfer_id: str, priority: int) -> bool:
+        with self.lock:
+            job = self.jobs.get(transfer_id)
+            if not job or job.state in FINISHED_STATES:
+                return False
+            job.priority = min(10, max(1, priority))
+            return True
+
+    def get_job(self, transfer_id: str) -> Optional[TransferJob]:
+        with self.lock:
+            return self.jobs.get(transfer_id)
+
+    def list_jobs(self, state: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Jobs newest first, optionally only those in one state"""
+        with self.lock:
+            jobs = [job for job in self.jobs.values() if state is None or job.state == state]
+            return [job.to_dict() for job in reversed(jobs)]
+
+    def wait(self, transfer_id: str, timeout: Optional[float] = None) -> Optional[str]:
+        """Block until a job finishes; returns its final state (None on timeout or unknown job)"""
+        deadline = None if timeout is None else time.time() + timeout
+        with self.lock:
+            job = self.jobs.get(transfer_id)
+            while job and job.state not in FINISHED_STATES:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.changed.wait(remaining)
+            return job.state if job else None
+
+    def stop(self):
+        """Cancel every unfinished job (at shutdown)"""
+        with self.lock:
+            for transfer_id in [tid for tid, job in self.jobs.items() if job.state not in FINISHED_STATES]:
+                self.cancel(transfer_id)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            states: Dict[str, int] = {}
+            for job in self.jobs.values():
+                states[job.state] = states.get(job.state, 0) + 1
+            return {**self.stats, "max_concurrent": self.max_concurrent, "running": self.running, "states": states}
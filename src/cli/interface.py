@@ -252,7 +252,8 @@ class P2PCLI:
                     "address": "localhost",
                     "port": self.port,
                     "public_key": self.identity.get_public_key_string()
-                }
+                },
+                capabilities=[]  # the CLI only speaks the base protocol
             )
             self.connection_manager.send_message(temp_peer_id, handshake)
             peer = Peer(
@@ -0,0 +1,181 @@
+import os
+import threading
+from typing import Any, Dict, Optional
+
+import yaml
+
+from src.security.rate_limiter import TokenBucket
+
+# Traffic classes of outgoing frames
+CONTROL = "control"  # handshakes, acks, transfer and swarm requests: charged but never delayed
+MESSAGE = "message"  # chat messages
+BULK = "bulk"  # file chunks
+TRAFFIC_CLASSES = (CONTROL, MESSAGE, BULK)
+SHAPED_CLASSES = (MESSAGE, BULK)
+
+
+class BandwidthShaper:
+    """Hierarchical token-bucket shaping of outgoing traffic.
+
+    Every frame is charged to three buckets: the node-wide one, the one of
+    the peer it goes to and the one of its traffic class (shared by all
+    peers). The writer then waits for the most indebted of them, so each
+    level stays within its rate over time. Rates are bytes per second and 0
+    means unlimited; with no limit set nothing is ever delayed.
+
+    Control frames are charged like the rest but never wait, so handshakes,
+    acks and transfer requests get through a saturated link; the bulk and
+    message traffic behind them pays off the debt instead.
+    """
+
+    def __init__(self, config_path: str = "config/security.yaml"):
+        self.global_rate = 0.0
+        self.peer_rate = 0.0  # default for every peer
+        self.peer_rates: Dict[str, float] = {}  # per-peer overrides of peer_rate
+        self.class_rates: Dict[str, float] = {traffic_class: 0.0 for traffic_class in SHAPED_CLASSES}
+        self.burst_seconds = 1.0
+        self.global_bucket = TokenBucket(0.0, 1.0)
+        self.class_buckets = {traffic_class: TokenBucket(0.0, 1.0) for traffic_class in SHAPED_CLASSES}
+        self.peer_buckets: Dict[str, TokenBucket] = {}
+        self.shaping = False  # whether any limit is set
+        self.lock = threading.Lock()
+        self.bytes_sent = {traffic_class: 0 for traffic_class in TRAFFIC_CLASSES}
+        self.stats = {"throttle_events": 0, "throttled_seconds": 0.0}
+        self._load_config(config_path)
+
+    def _load_config(self, config_path: str):
+        """Load bandwidth limits from the security config if available"""
+        if not config_path or not os.path.exists(config_path):
+            return
+        with open(config_path, 'r') as f:
+            config = yaml.safe_load(f) or {}
+        bandwidth = config.get("bandwidth", {})
+        self.set_limits(
+            global_rate=bandwidth.get("global_rate"),
+            peer_rate=bandwidth.get("peer_rate"),
+            class_rates=bandwidth.get("class_rates"),
+            peer_rates=bandwidth.get("peer_rates"),
+            burst_seconds=bandwidth.get("burst_seconds")
+        )
+
+    def _capacity(self, rate: float) -> float:
+        return max(rate * self.burst_seconds, 1.0)
+
+    def _peer_rate(self, peer_id: str) -> float:
+        return self.peer_rates.get(peer_id, self.peer_rate)
+
+    @staticmethod
+    def _check_rate(name: str, value: Any) -> float:
+        if value < 0:
+            raise ValueError(f"{name} must not be negative")
+        return float(value)
+
+    def set_limits(self, global_rate: Optional[float] = None, peer_rate: Optional[float] = None,
+                   class_rates: Optional[Dict[str, float]] = None,
+                   peer_rates: Optional[Dict[str, Optional[float]]] = None,
+                   burst_seconds: Optional[float] = None) -> Dict[str, Any]:
+        """Adjust limits at runtime; transfers already running pick up the new rates at once.
+
+        A ``None`` argument leaves that limit as it is; a ``None`` value in
+        ``peer_rates`` removes the override so the peer falls back to
+        ``peer_rate``.
+        """
+        class_rates = class_rates or {}
+        peer_rates = peer_rates or {}
+        unknown = set(class_rates) - set(SHAPED_CLASSES)
+        if unknown:
+            raise ValueError(f"Unknown traffic classes: {', '.join(sorted(unknown))} "
+                             f"(shaped classes are {', '.join(SHAPED_CLASSES)})")
+        if burst_seconds is not None and burst_seconds <= 0:
+            raise ValueError("burst_seconds must be positive")
+
+        with self.lock:
+            # Validate everything before changing anything
+            new_global = self.global_rate if global_rate is None else self._check_rate("global_rate", global_rate)
+            new_peer = self.peer_rate if peer_rate is None else self._check_rate("peer_rate", peer_rate)
+            new_classes = {traffic_class: self._check_rate(f"class_rates.{traffic_class}", rate)
+                           for traffic_class, rate in class_rates.items() if rate is not None}
+            new_overrides = {peer_id: None if rate is None else self._check_rate(f"peer_rates.{peer_id}", rate)
+                             for peer_id, rate in peer_rates.items()}
+
+            if burst_seconds is not None:
+                self.burst_seconds = float(burst_seconds)
+            self.global_rate = new_global
+            self.peer_rate = new_peer
+            self.class_rates.update(new_classes)
+            for peer_id, rate in new_overrides.items():
+                if rate is None:
+                    self.peer_rates.pop(peer_id, None)
+                else:
+                    self.peer_rates[peer_id] = rate
+
+            self.global_bucket.set_rate(self.global_rate, self._capacity(self.global_rate))
+            for traffic_class, bucket in self.class_buckets.items():
+                rate = self.class_rates[traffic_class]
+                bucket.set_rate(rate, self._capacity(rate))
+            for peer_id, bucket in self.peer_buckets.items():
+                rate = self._peer_rate(peer_id)
+                bucket.set_rate(rate, self._capacity(rate))
+            self.shaping = (self.global_rate > 0 or self.peer_rate > 0
+                            or any(rate > 0 for rate in self.class_rates.values())
+                            or any(rate > 0 for rate in self.peer_rates.values()))
+            return self._limits()
+
+    def _limits(self) -> Dict[str, Any]:
+        return {
+            "global_rate": self.global_rate,
+            "peer_rate": self.peer_rate,
+            "class_rates": dict(self.class_rates),
+            "peer_rates": dict(self.peer_rates),
+            "burst_seconds": self.burst_seconds
+        }
+
+    def get_limits(self) -> Dict[str, Any]:
+        with self.lock:
+            return self._limits()
+
+    def delay(self, peer_id: str, traffic_class: str, num_bytes: int) -> float:
+        """Charge a frame to its buckets; returns the seconds to wait before writing it"""
+        with self.lock:
+            self.bytes_sent[traffic_class] = self.bytes_sent.get(traffic_class, 0) + num_bytes
+            if not self.shaping:
+                return 0.0
+            wait = self.global_bucket.consume(num_bytes)
+            bucket = self.peer_buckets.get(peer_id)
+            if bucket is None:
+                rate = self._peer_rate(peer_id)
+                bucket = self.peer_buckets[peer_id] = TokenBucket(rate, self._capacity(rate))
+            wait = max(wait, bucket.consume(num_bytes))
+            if traffic_class in self.class_buckets:
+                wait = max(wait, self.class_buckets[traffic_class].consume(num_bytes))
+            if traffic_class == CONTROL or wait <= 0:
+                return 0.0
+            self.stats["throttle_events"] += 1
+            self.stats["throttled_seconds"] += wait
+            return wait
+
+    def rename_peer(self, old_id: str, new_id: str):
+        """Carry a peer's bucket over when its temporary ID is replaced after handshake"""
+        with self.lock:
+            bucket = self.peer_buckets.pop(old_id, None)
+            if bucket is not None:
+                rate = self._peer_rate(new_id)
+                bucket.set_rate(rate, self._capacity(rate))
+                self.peer_buckets[new_id] = bucket
+
+    def forget_peer(self, peer_id: str):
+        """Drop a peer's bucket when the connection goes away (its override is kept)"""
+        with self.lock:
+            self.peer_buckets.pop(peer_id, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get bandwidth shaping statistics"""
+        with self.lock:
+            return {
+                **self._limits(),
+                "shaping": self.shaping,
+                "bytes_sent": dict(self.bytes_sent),
+                "throttle_events": self.stats["throttle_events"],
+                "throttled_seconds": round(self.stats["throttled_seconds"], 3),
+                "tracked_peers": len(self.peer_buckets)
+            }
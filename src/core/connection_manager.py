@@ -1,9 +1,11 @@
 import socket
 import threading
-from typing import Dict, Tuple, List, Optional
+import time
+from typing import Dict, Tuple, List, Optional, Iterable, Set
 import logging
 from collections import defaultdict
 from src.backend.models import Peer
+from src.core.bandwidth import MESSAGE
  # to avoid circular import
 class Connection:
     def __init__(self, socket: socket.socket, address: Tuple[str, int], peer_id: Optional[str] = None):
@@ -12,22 +14,49 @@ class Connection:
         self.peer_id = peer_id
         self.is_active = True
         self.lock = threading.Lock()
+        self.shard = 0  # dispatcher worker that handles this connection's frames
+        # Capabilities negotiated during the handshake (empty for legacy peers)
+        self.capabilities: Set[str] = set()
+    
+    def supports(self, capability) -> bool:
+        """Check whether a negotiated capability (Capability or str) is enabled"""
+        return getattr(capability, "value", capability) in self.capabilities
 
 class ConnectionManager:
-    def __init__(self, message_handler=None, peer_registry=None):
+    def __init__(self, message_handler=None, peer_registry=None, max_message_size: int = 1024 * 1024,
+                 rate_limiter=None, frame_signer=None, dispatcher=None, shaper=None):
         self.connections: Dict[str, Connection] = {}  # peer_id -> Connection
         self.address_to_peer: Dict[Tuple[str, int], str] = {}  # address -> peer_id
         self.lock = threading.RLock()
         self.message_handler = message_handler
         self.peer_registry = peer_registry   # ✅ store registry if provided
         self.logger = logging.getLogger('ConnectionManager')
+        # Frames larger than this are discarded before they are decoded
+        self.max_message_size = max_message_size
+        self.stats = {"oversized_frames": 0}
+        # Optional RateLimiter; over-limit peers are paused, never dropped
+        self.rate_limiter = rate_limiter
+        # Optional callable that signs every outgoing frame
+        self.frame_signer = frame_signer
+        # Optional ShardedDispatcher; without one frames are handled on the reader thread
+        self.dispatcher = dispatcher
+        # Optional BandwidthShaper; without one frames go out at line rate
+        self.shaper = shaper
+    
     def add_connection(self, sock: socket.socket, address: Tuple[str, int], peer_id: Optional[str] = None):
         """Add a new connection"""
         with self.lock:
             if not peer_id:
                 peer_id = f"{address[0]}:{address[1]}"
-        
+            existing = self.connections.get(peer_id)
+            if existing is not None and existing.socket is sock:
+                # Already registered (the peer node adds the sockets it opens); a second
+                # reader thread on the same socket would split frames between them
+                return
+
             conn = Connection(sock, address, peer_id)
+            if self.dispatcher:
+                conn.shard = self.dispatcher.assign_shard()
             self.connections[peer_id] = conn
             self.address_to_peer[address] = peer_id
 
@@ -50,6 +79,11 @@ class ConnectionManager:
     def _handle_connection(self, conn: Connection):
         """Handle incoming messages from a connection"""
         buffer = b""
+        discarding = False  # skipping the rest of an oversized frame
+        limiter = self.rate_limiter
+        
+        if limiter:
+            self._pause(conn, limiter.connection_delay(conn.address[0]))
         
         while conn.is_active:
             try:
@@ -59,17 +93,37 @@ class ConnectionManager:
                     self.logger.info(f"Connection closed by peer {conn.peer_id}")
                     break
                 
+                # Not reading lets the socket buffers fill, which throttles the sender
+                if limiter:
+                    self._pause(conn, limiter.bytes_delay(conn.peer_id, len(data)))
+                
                 buffer += data
                 
-                # Try to extract complete messages
-                while b'\n' in buffer:
-                    line, buffer = buffer.split(b'\n', 1)
+                # Extract every complete message in one pass; the tail is a partial frame
+                lines = buffer.split(b'\n')
+                buffer = lines.pop()
+                frames = []
+                for line in lines:
+                    if discarding:
+                        discarding = False
+                        continue
+                    if len(line) > self.max_message_size:
+                        self._reject_oversized(conn, len(line))
+                        continue
                     if line:  # Skip empty lines
-                        if self.message_handler and conn.peer_id:
-                            try:
-                                self.message_handler(conn.peer_id, line.decode('utf-8'))
-                            except Exception as msg_error:
-                                self.logger.error(f"Error processing message from {conn.peer_id}: {msg_error}")
+                        if limiter:
+                            self._pause(conn, limiter.message_delay(conn.peer_id))
+                        frames.append(line)
+                if frames:
+                    self._deliver(conn, frames)
+                
+                # A partial frame already over the limit can never become valid
+                if not discarding and len(buffer) > self.max_message_size:
+                    self._reject_oversized(conn, len(buffer))
+                    buffer = b""
+                    discarding = True
+                elif discarding:
+                    buffer = b""
                         
             except ConnectionResetError:
                 self.logger.warning(f"Connection reset by peer {conn.peer_id}")
@@ -82,35 +136,101 @@ class ConnectionManager:
         if conn.peer_id:
             self.remove_connection(conn.peer_id)
     
-    def send_message(self, peer_id: str, message: bytes) -> bool:
+    def _deliver(self, conn: Connection, frames: List[bytes]):
+        """Hand frames to the dispatcher, or process them inline if there is none"""
+        if self.dispatcher:
+            self.dispatcher.submit(conn, frames)
+            return
+        if not (self.message_handler and conn.peer_id):
+            return
+        for frame in frames:
+            try:
+                self.message_handler(conn.peer_id, frame.decode('utf-8'))
+            except Exception as msg_error:
+                self.logger.error(f"Error processing message from {conn.peer_id}: {msg_error}")
+    
+    def _pause(self, conn: Connection, seconds: float):
+        """Stop reading from a connection for a while (rate limit backpressure)"""
+        if seconds <= 0:
+            return
+        self.logger.debug(f"Throttling {conn.peer_id} for {seconds:.3f}s")
+        deadline = time.monotonic() + seconds
+        while conn.is_active:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(remaining, 0.25))
+    
+    def _reject_oversized(self, conn: Connection, size: int):
+        self.stats["oversized_frames"] += 1
+        self.logger.warning(f"Discarding oversized frame from {conn.peer_id}: "
+                            f"{size} bytes exceeds limit of {self.max_message_size}")
+    
+    def send_message(self, peer_id: str, message: bytes, presigned: bool = False,
+                     traffic_class: str = MESSAGE) -> bool:
         """Send message to a specific peer"""
+        if self.frame_signer and not presigned:
+            message = self.frame_signer(message)
+        if self.shaper:
+            # Wait off the shaping delay before taking any lock, so other peers are not held up
+            delay = self.shaper.delay(peer_id, traffic_class, len(message) + 1)
+            if delay > 0:
+                with self.lock:
+                    conn = self.connections.get(peer_id)
+                if conn:
+                    self._pause(conn, delay)
         with self.lock:
-            if peer_id in self.connections:
-                conn = self.connections[peer_id]
-                try:
-                    with conn.lock:
-                        conn.socket.sendall(message + b'\n')
-                    self.logger.debug(f"Sent message to {peer_id} ({len(message)} bytes)")
-                    return True
-                except Exception as e:
-                    self.logger.error(f"Failed to send message to {peer_id}: {e}")
+            conn = self.connections.get(peer_id)
+        if not conn:
+            self.logger.warning(f"Cannot send message to {peer_id}: peer not connected")
+            return False
+        # Only this connection's lock is held while writing, so a slow peer
+        # does not stall sends to other peers or connection bookkeeping
+        try:
+            with conn.lock:
+                conn.socket.sendall(message + b'\n')
+        except Exception as e:
+            self.logger.error(f"Failed to send message to {peer_id}: {e}")
+            with self.lock:
+                # The peer may have reconnected meanwhile; keep the new connection
+                if self.connections.get(peer_id) is conn:
                     self.remove_connection(peer_id)
-            else:
-                self.logger.warning(f"Cannot send message to {peer_id}: peer not connected")
-        return False
+            return False
+        self.logger.debug(f"Sent message to {peer_id} ({len(message)} bytes)")
+        return True
     
-    def broadcast_message(self, message: bytes, exclude_peer: Optional[str] = None):
+    def send_messages(self, peer_id: str, messages: List[bytes], traffic_class: str = MESSAGE) -> bool:
+        """Send several frames to one peer with a single write"""
+        if self.frame_signer:
+            messages = [self.frame_signer(message) for message in messages]
+        return self.send_message(peer_id, b'\n'.join(messages), presigned=True, traffic_class=traffic_class)
+    
+    def broadcast_message(self, message: bytes, exclude_peer: Optional[str] = None,
+                          traffic_class: str = MESSAGE):
         """Broadcast message to all connected peers"""
-        with self.lock:
-            peer_count = 0
-            excluded_count = 0
-            for peer_id, conn in list(self.connections.items()):
-                if peer_id != exclude_peer:
-                    if self.send_message(peer_id, message):
-                        peer_count += 1
-                else:
-                    excluded_count += 1
-            self.logger.debug(f"Broadcasted message to {peer_count} peers (excluded {excluded_count} peers)")
+        # Sign once; every recipient gets the same frame
+        if self.frame_signer:
+            message = self.frame_signer(message)
+        # Not under the lock: a shaped send may wait, and that must not block other writers
+        peer_count = 0
+        excluded_count = 0
+        for peer_id in self.get_active_connections():
+            if peer_id != exclude_peer:
+                if self.send_message(peer_id, message, presigned=True, traffic_class=traffic_class):
+                    peer_count += 1
+            else:
+                excluded_count += 1
+        self.logger.debug(f"Broadcasted message to {peer_count} peers (excluded {excluded_count} peers)")
+    
+    def broadcast_messages(self, messages: List[bytes], exclude_peer: Optional[str] = None,
+                           traffic_class: str = MESSAGE):
+        """Broadcast several frames, signed once and sent to each peer in a single write"""
+        if self.frame_signer:
+            messages = [self.frame_signer(message) for message in messages]
+        payload = b'\n'.join(messages)
+        for peer_id in self.get_active_connections():
+            if peer_id != exclude_peer:
+                self.send_message(peer_id, payload, presigned=True, traffic_class=traffic_class)
     
     def remove_connection(self, peer_id: str):
         """Remove a connection"""
@@ -126,9 +246,34 @@ class ConnectionManager:
                 del self.connections[peer_id]
                 if conn.address in self.address_to_peer:
                     del self.address_to_peer[conn.address]
+                if self.rate_limiter:
+                    self.rate_limiter.forget_peer(peer_id)
+                if self.shaper:
+                    self.shaper.forget_peer(peer_id)
                 
                 self.logger.info(f"Removed connection for peer {peer_id}")
     
+    def set_peer_capabilities(self, peer_id: str, capabilities: Iterable[str]) -> bool:
+        """Store the negotiated capability set on a peer's connection"""
+        with self.lock:
+            conn = self.connections.get(peer_id)
+            if not conn:
+                return False
+            conn.capabilities = set(capabilities)
+            self.logger.debug(f"Capabilities for {peer_id}: {sorted(conn.capabilities)}")
+            return True
+    
+    def peer_supports(self, peer_id: str, capability) -> bool:
+        """Check whether a connected peer negotiated a capability"""
+        with self.lock:
+            conn = self.connections.get(peer_id)
+            return bool(conn and conn.supports(capability))
+    
+    def get_stats(self) -> Dict[str, int]:
+        """Get connection statistics"""
+        with self.lock:
+            return {**self.stats, "active_connections": len(self.connections)}
+    
     def get_active_connections(self) -> List[str]:
         """Get list of active peer IDs"""
         with self.lock:
@@ -143,6 +288,10 @@ class ConnectionManager:
             conn = self.connections.pop(temp_id)
             conn.peer_id = real_id
             self.connections[real_id] = conn
+            if self.rate_limiter:
+                self.rate_limiter.rename_peer(temp_id, real_id)
+            if self.shaper:
+                self.shaper.rename_peer(temp_id, real_id)
 
             # Update address→peer map
             for addr, pid in list(self.address_to_peer.items()):
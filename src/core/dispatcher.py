@@ -0,0 +1,91 @@
+import queue
+import threading
+import logging
+from typing import Any, Callable, Dict, List
+
+
+class ShardedDispatcher:
+    """Worker pool that processes received frames off the socket reader threads.
+
+    Every connection is pinned to one worker shard, so frames from the same
+    peer are handled strictly in order while different peers are processed in
+    parallel. Shards are assigned per connection rather than by hashing the
+    peer ID because a connection's ID changes from ``host:port`` to the real
+    peer ID during the handshake, and re-sharding then could reorder frames.
+
+    Each shard queue is bounded: when a shard falls behind, ``submit`` blocks
+    the reader, which stops reading and lets TCP push back on the sender.
+    """
+
+    def __init__(self, handler: Callable[[str, List[bytes]], None], num_workers: int = 4,
+                 max_pending: int = 1024):
+        self.handler = handler
+        self.num_workers = max(1, num_workers)
+        self.shards: List[queue.Queue] = [queue.Queue(maxsize=max_pending) for _ in range(self.num_workers)]
+        self.workers: List[threading.Thread] = []
+        self.is_running = False
+        self._next_shard = 0
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger('Dispatcher')
+        self.stats = {"batches": 0, "frames": 0, "errors": 0}
+
+    def start(self):
+        """Start the worker threads"""
+        self.is_running = True
+        for index, shard in enumerate(self.shards):
+            worker = threading.Thread(target=self._worker_loop, args=(shard,), name=f"dispatch-{index}")
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+        self.logger.info(f"Dispatcher started with {self.num_workers} workers")
+
+    def stop(self):
+        """Stop the worker threads"""
+        self.is_running = False
+        for worker in self.workers:
+            worker.join(timeout=5)
+        self.workers = []
+
+    def assign_shard(self) -> int:
+        """Pick the shard for a new connection (round-robin)"""
+        with self.lock:
+            shard = self._next_shard
+            self._next_shard = (self._next_shard + 1) % self.num_workers
+            return shard
+
+    def submit(self, conn: Any, frames: List[bytes]):
+        """Queue all frames read from one recv() for the connection's shard.
+
+        ``conn`` must have ``shard`` and ``peer_id`` attributes; the peer ID is
+        read when the batch is processed so frames queued behind a handshake
+        see the ID it established.
+        """
+        self.shards[conn.shard].put((conn, frames))
+
+    def _worker_loop(self, shard: queue.Queue):
+        while self.is_running:
+            try:
+                # Timeout so the loop notices stop()
+                conn, frames = shard.get(timeout=1)
+            except queue.Empty:
+                continue
+            try:
+                self.handler(conn.peer_id, frames)
+            except Exception as e:
+                self.logger.error(f"Error dispatching frames from {conn.peer_id}: {e}", exc_info=True)
+                with self.lock:
+                    self.stats["errors"] += 1
+            with self.lock:
+                self.stats["batches"] += 1
+                self.stats["frames"] += len(frames)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get dispatcher statistics"""
+        with self.lock:
+            batches = self.stats["batches"]
+            return {
+                **self.stats,
+                "workers": self.num_workers,
+                "avg_batch_size": round(self.stats["frames"] / batches, 2) if batches else 0.0,
+                "pending": [shard.qsize() for shard in self.shards]
+            }
@@ -1,6 +1,7 @@
+import base64
 import json
 import time
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Iterable, Set, Tuple
 from enum import Enum
 
 class MessageType(Enum):
@@ -14,9 +15,29 @@ class MessageType(Enum):
     FILE_TRANSFER_CHUNK = "file_transfer_chunk"
     FILE_TRANSFER_COMPLETE = "file_transfer_complete"
     FILE_TRANSFER_ACK = "file_transfer_ack"
+    FILE_TRANSFER_RESUME = "file_transfer_resume"
+    FILE_TRANSFER_WANT = "file_transfer_want"
+    FILE_SWARM_QUERY = "file_swarm_query"
+    FILE_SWARM_HAVE = "file_swarm_have"
+    FILE_SWARM_FETCH = "file_swarm_fetch"
+
+class Capability(Enum):
+    """Optional protocol features advertised in the handshake"""
+    ZLIB_CHUNKS = "zlib_chunks"
+    SIGNED_MESSAGES = "signed_messages"
+    DELIVERY_ACKS = "delivery_acks"
+    RESUMABLE_TRANSFERS = "resumable_transfers"
+    DEDUP_CHUNKS = "dedup_chunks"
+    MERKLE_PROOFS = "merkle_proofs"
+    SWARM = "swarm"
+    ADAPTIVE_CHUNKS = "adaptive_chunks"
 
 class MessageProtocol:
     VERSION = "1.0"
+    CAPABILITIES = frozenset(cap.value for cap in Capability)
+    # Signed frames are the encoded message with this trailing field spliced in,
+    # so peers that do not verify signatures still parse them as plain JSON
+    SIGNATURE_SUFFIX = b', "sig": "'
     
     @staticmethod
     def create_message(msg_type: MessageType, sender_id: str, 
@@ -60,12 +81,60 @@ class MessageProtocol:
         return None
     
     @staticmethod
-    def create_handshake(peer_id: str, peer_info: Dict[str, Any]) -> bytes:
-        """Create handshake message"""
+    def attach_signature(frame: bytes, signature: bytes) -> bytes:
+        """Append a signature over ``frame`` (an encoded message) as its last field"""
+        return (frame[:-1] + MessageProtocol.SIGNATURE_SUFFIX
+                + base64.b64encode(signature) + b'"}')
+    
+    @staticmethod
+    def split_signature(frame: bytes) -> Tuple[bytes, Optional[bytes]]:
+        """Recover the signed bytes and signature from a frame (signature is None if unsigned)"""
+        if frame.endswith(b'"}'):
+            idx = frame.rfind(MessageProtocol.SIGNATURE_SUFFIX)
+            if idx != -1:
+                try:
+                    signature = base64.b64decode(frame[idx + len(MessageProtocol.SIGNATURE_SUFFIX):-2], validate=True)
+                except (ValueError, TypeError):
+                    return frame, None
+                return frame[:idx] + b'}', signature
+        return frame, None
+    
+    @staticmethod
+    def create_handshake(peer_id: str, peer_info: Dict[str, Any],
+                         capabilities: Optional[Iterable[str]] = None) -> bytes:
+        """Create handshake message advertising our supported capabilities"""
+        if capabilities is None:
+            capabilities = MessageProtocol.CAPABILITIES
+        content = dict(peer_info)
+        content["capabilities"] = sorted(capabilities)
         message = MessageProtocol.create_message(
             MessageType.HANDSHAKE,
             peer_id,
-            content=peer_info
+            content=content
+        )
+        return MessageProtocol.encode_message(message)
+    
+    @staticmethod
+    def negotiate_capabilities(remote_capabilities: Any) -> Set[str]:
+        """Intersect a peer's advertised capabilities with our own.
+        
+        Peers that predate capability negotiation send none, which yields an
+        empty set and keeps every connection to them on the legacy code paths.
+        """
+        if not isinstance(remote_capabilities, (list, tuple, set, frozenset)):
+            return set()
+        return {cap for cap in remote_capabilities
+                if isinstance(cap, str) and cap in MessageProtocol.CAPABILITIES}
+    
+    @staticmethod
+    def create_delivery_ack(sender_id: str, recipient_id: str, epoch: str, ack: int,
+                            missing: Optional[List[List[int]]] = None) -> bytes:
+        """Create a cumulative ACK: every seq up to ``ack`` arrived, ``missing`` ranges did not"""
+        message = MessageProtocol.create_message(
+            MessageType.ACK,
+            sender_id,
+            recipient_id,
+            content={"epoch": epoch, "ack": ack, "missing": missing or []}
         )
         return MessageProtocol.encode_message(message)
     
@@ -83,36 +152,76 @@ class MessageProtocol:
     @staticmethod
     def create_file_transfer_request(sender_id: str, recipient_id: Optional[str], 
                                      file_id: str, filename: str, 
-                                     file_size: int, mime_type: str) -> bytes:
-        """Create file transfer request message"""
+                                     file_size: int, mime_type: str,
+                                     chunk_size: Optional[int] = None,
+                                     manifest: Optional[List[List[Any]]] = None,
+                                     merkle_root: Optional[str] = None,
+                                     max_chunk_size: Optional[int] = None) -> bytes:
+        """Create file transfer request message
+        
+        ``chunk_size`` tells the receiver where each chunk index starts in the
+        file; receivers assume 32KB when it is missing. ``manifest`` lists the
+        file's content-defined chunks as [sha256, size]; the receiver answers
+        it with a file_transfer_want before any chunk is sent. ``merkle_root``
+        is the root of the hash tree over the chunks; each chunk then carries
+        its proof. ``max_chunk_size`` (a multiple of ``chunk_size``, only for
+        recipients that negotiated adaptive chunks) is the largest span of
+        consecutive chunks one chunk message may carry.
+        """
+        content = {
+            "file_id": file_id,
+            "filename": filename,
+            "file_size": file_size,
+            "mime_type": mime_type
+        }
+        if chunk_size:
+            content["chunk_size"] = chunk_size
+        if manifest:
+            content["manifest"] = manifest
+        if merkle_root:
+            content["merkle_root"] = merkle_root
+        if max_chunk_size:
+            content["max_chunk_size"] = max_chunk_size
         message = MessageProtocol.create_message(
             MessageType.FILE_TRANSFER_REQUEST,
             sender_id,
             recipient_id,
-            content={
-                "file_id": file_id,
-                "filename": filename,
-                "file_size": file_size,
-                "mime_type": mime_type
-            }
+            content=content
         )
         return MessageProtocol.encode_message(message)
     
     @staticmethod
     def create_file_transfer_chunk(sender_id: str, recipient_id: Optional[str],
                                    file_id: str, chunk_index: int,
-                                   chunk_data: str, is_last: bool) -> bytes:
-        """Create file transfer chunk message (chunk_data should be base64 encoded)"""
+                                   chunk_data: str, is_last: bool,
+                                   encoding: Optional[str] = None,
+                                   proof: Optional[List[str]] = None,
+                                   proofs: Optional[List[List[str]]] = None) -> bytes:
+        """Create file transfer chunk message (chunk_data should be base64 encoded)
+        
+        ``encoding`` names a transform applied before base64 (e.g. "zlib") and
+        must only be set when the recipient negotiated the matching capability.
+        ``proof`` holds the Merkle sibling hashes of this chunk. A message may
+        carry a span of consecutive chunks starting at ``chunk_index`` when the
+        transfer request allowed it; ``proofs`` then has one proof per chunk.
+        """
+        content = {
+            "file_id": file_id,
+            "chunk_index": chunk_index,
+            "chunk_data": chunk_data,
+            "is_last": is_last
+        }
+        if encoding:
+            content["encoding"] = encoding
+        if proof is not None:
+            content["proof"] = proof
+        if proofs is not None:
+            content["proofs"] = proofs
         message = MessageProtocol.create_message(
             MessageType.FILE_TRANSFER_CHUNK,
             sender_id,
             recipient_id,
-            content={
-                "file_id": file_id,
-                "chunk_index": chunk_index,
-                "chunk_data": chunk_data,
-                "is_last": is_last
-            }
+            content=content
         )
         return MessageProtocol.encode_message(message)
     
@@ -128,6 +237,80 @@ class MessageProtocol:
         )
         return MessageProtocol.encode_message(message)
     
+    @staticmethod
+    def create_file_transfer_resume(sender_id: str, recipient_id: str, file_id: str,
+                                    missing: List[List[int]]) -> bytes:
+        """Ask the sender of a file for the chunk ranges we still lack (inclusive [start, end])"""
+        message = MessageProtocol.create_message(
+            MessageType.FILE_TRANSFER_RESUME,
+            sender_id,
+            recipient_id,
+            content={"file_id": file_id, "missing": missing}
+        )
+        return MessageProtocol.encode_message(message)
+    
+    @staticmethod
+    def create_file_transfer_want(sender_id: str, recipient_id: str, file_id: str,
+                                  missing: List[List[int]]) -> bytes:
+        """Answer a request that carried a manifest with the chunk ranges we still need"""
+        message = MessageProtocol.create_message(
+            MessageType.FILE_TRANSFER_WANT,
+            sender_id,
+            recipient_id,
+            content={"file_id": file_id, "missing": missing}
+        )
+        return MessageProtocol.encode_message(message)
+    
+    @staticmethod
+    def create_file_swarm_query(sender_id: str, recipient_id: str, file_id: str) -> bytes:
+        """Ask a peer which chunks of a file it holds"""
+        message = MessageProtocol.create_message(
+            MessageType.FILE_SWARM_QUERY,
+            sender_id,
+            recipient_id,
+            content={"file_id": file_id}
+        )
+        return MessageProtocol.encode_message(message)
+    
+    @staticmethod
+    def create_file_swarm_have(sender_id: str, recipient_id: str, file_id: str,
+                               file_info: Optional[Dict[str, Any]] = None,
+                               ranges: Optional[List[List[int]]] = None,
+                               merkle_root: Optional[str] = None) -> bytes:
+        """Answer a swarm query with the file's description and the chunk ranges we hold
+
+        Without ``file_info`` (or ``ranges``) the answer says we hold none of it.
+        """
+        content: Dict[str, Any] = {"file_id": file_id, "ranges": ranges or []}
+        if file_info and ranges:
+            content.update({
+                "filename": file_info["filename"],
+                "file_size": file_info["file_size"],
+                "mime_type": file_info.get("mime_type", "application/octet-stream"),
+                "chunk_size": file_info["chunk_size"]
+            })
+            if merkle_root:
+                content["merkle_root"] = merkle_root
+        message = MessageProtocol.create_message(
+            MessageType.FILE_SWARM_HAVE,
+            sender_id,
+            recipient_id,
+            content=content
+        )
+        return MessageProtocol.encode_message(message)
+    
+    @staticmethod
+    def create_file_swarm_fetch(sender_id: str, recipient_id: str, file_id: str,
+                                ranges: List[List[int]]) -> bytes:
+        """Ask a swarm source to send these chunk ranges (inclusive [start, end])"""
+        message = MessageProtocol.create_message(
+            MessageType.FILE_SWARM_FETCH,
+            sender_id,
+            recipient_id,
+            content={"file_id": file_id, "ranges": ranges}
+        )
+        return MessageProtocol.encode_message(message)
+    
     @staticmethod
     def create_file_transfer_ack(sender_id: str, recipient_id: str,
                                 file_id: str, success: bool) -> bytes:
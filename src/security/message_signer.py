@@ -0,0 +1,186 @@
+import base64
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import yaml
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives.asymmetric import ed25519
+
+from src.core.message_protocol import MessageProtocol
+from src.security.peer_identity import PeerIdentity
+
+MAX_VERIFIED_KEYS = 4096  # peers whose verified signing key is cached; the least recently used go first
+
+
+class MessageSigner:
+    """Signs outgoing frames and verifies incoming ones with Ed25519.
+
+    Each peer's signing key arrives in its handshake together with an RSA
+    signature binding it to the peer ID. That binding (and the SHA-256 peer ID
+    check) is verified once per peer and the resulting Ed25519 key is cached,
+    so the per-message cost is a single Ed25519 sign or verify. The cache
+    keeps the ``MAX_VERIFIED_KEYS`` most recently used peers; an evicted
+    peer's binding is verified again at its next handshake.
+    """
+
+    def __init__(self, identity: PeerIdentity, config_path: str = "config/security.yaml"):
+        self.identity = identity
+        self.sign_messages = True
+        self.enforce_verification = False
+        self._load_config(config_path)
+
+        # peer_id -> (raw signing key string, verified Ed25519 public key)
+        self.verified_keys: "OrderedDict[str, Tuple[str, ed25519.Ed25519PublicKey]]" = OrderedDict()
+        # Peers that advertised signing; unsigned messages from them are forgeries
+        self.signing_peers = set()
+        self.lock = threading.Lock()
+        self.stats = {
+            "signed": 0,
+            "verified": 0,
+            "unsigned_accepted": 0,
+            "rejected": 0,
+            "key_verifications": 0,
+            "key_cache_hits": 0
+        }
+
+    def _load_config(self, config_path: str):
+        """Load signing settings from the security config if available"""
+        if not config_path or not os.path.exists(config_path):
+            return
+        with open(config_path, 'r') as f:
+            config = yaml.safe_load(f) or {}
+        self.sign_messages = config.get("identity", {}).get("sign_messages", self.sign_messages)
+        self.enforce_verification = config.get("validation", {}).get(
+            "enforce_peer_verification", self.enforce_verification)
+
+    def handshake_fields(self) -> Dict[str, str]:
+        """Fields our handshake carries so peers can verify our signatures"""
+        return {
+            "signing_key": self.identity.get_signing_public_key_string(),
+            "signing_key_binding": self.identity.get_signing_key_binding()
+        }
+
+    def sign_frame(self, frame: bytes) -> bytes:
+        """Sign an encoded message (no-op when signing is disabled)"""
+        if not self.sign_messages:
+            return frame
+        signed = MessageProtocol.attach_signature(frame, self.identity.sign(frame))
+        with self.lock:
+            self.stats["signed"] += 1
+        return signed
+
+    def register_peer_key(self, peer_id: str, peer_info: Dict[str, Any], signs_messages: bool) -> bool:
+        """Verify and cache the signing key from a peer's handshake"""
+        public_key = peer_info.get("public_key")
+        signing_key = peer_info.get("signing_key")
+        binding = peer_info.get("signing_key_binding")
+        if not (public_key and signing_key and binding):
+            return False
+
+        with self.lock:
+            cached = self.verified_keys.get(peer_id)
+            if cached and cached[0] == signing_key:
+                self.verified_keys.move_to_end(peer_id)
+                self.stats["key_cache_hits"] += 1
+                if signs_messages:
+                    self.signing_peers.add(peer_id)
+                return True
+
+        # Slow path, once per peer: SHA-256 peer ID check plus the RSA binding
+        valid = (self.identity.verify_peer_id(peer_id, public_key)
+                 and PeerIdentity.verify_signing_key_binding(public_key, signing_key, binding))
+        key = None
+        if valid:
+            try:
+                key = ed25519.Ed25519PublicKey.from_public_bytes(base64.b64decode(signing_key))
+            except ValueError:
+                valid = False
+
+        with self.lock:
+            self.stats["key_verifications"] += 1
+            if not valid:
+                return False
+            self.verified_keys[peer_id] = (signing_key, key)
+            self.verified_keys.move_to_end(peer_id)
+            while len(self.verified_keys) > MAX_VERIFIED_KEYS:
+                evicted, _ = self.verified_keys.popitem(last=False)
+                self.signing_peers.discard(evicted)
+            if signs_messages:
+                self.signing_peers.add(peer_id)
+            else:
+                self.signing_peers.discard(peer_id)
+        return True
+
+    def _lookup(self, peer_id: str) -> Optional[Tuple[str, ed25519.Ed25519PublicKey]]:
+        """A peer's cached key, marked as recently used (caller holds the lock)"""
+        cached = self.verified_keys.get(peer_id)
+        if cached is not None:
+            self.verified_keys.move_to_end(peer_id)
+        return cached
+
+    def forget_peer(self, peer_id: str):
+        with self.lock:
+            self.verified_keys.pop(peer_id, None)
+            self.signing_peers.discard(peer_id)
+
+    def _check(self, sender_id: str, cached: Optional[Tuple[str, ed25519.Ed25519PublicKey]],
+               payload: bytes, signature: Optional[bytes]) -> Tuple[Optional[str], str]:
+        """Verify one frame; returns (error or None, stats counter to bump)"""
+        if signature is None:
+            if self.enforce_verification or sender_id in self.signing_peers:
+                return "Missing message signature", "rejected"
+            return None, "unsigned_accepted"
+
+        if cached is None:
+            if self.enforce_verification:
+                return "No verified signing key for sender", "rejected"
+            return None, "unsigned_accepted"
+
+        try:
+            cached[1].verify(signature, payload)
+        except InvalidSignature:
+            return "Invalid message signature", "rejected"
+        return None, "verified"
+
+    def verify_frame(self, sender_id: str, payload: bytes, signature: Optional[bytes]) -> Tuple[bool, Optional[str]]:
+        """Verify a single received frame against the sender's cached key"""
+        with self.lock:
+            cached = self._lookup(sender_id)
+        error, outcome = self._check(sender_id, cached, payload, signature)
+        with self.lock:
+            self.stats[outcome] += 1
+        return error is None, error
+
+    def verify_batch(self, frames: List[Tuple[str, bytes, Optional[bytes]]]) -> List[Optional[str]]:
+        """Verify several frames at once, returning an error (or None) per frame.
+
+        The ``cryptography`` package has no true Ed25519 batch verification, so
+        this amortises everything around it instead: keys are looked up once
+        per sender and the lock is taken once per batch rather than per frame.
+        """
+        with self.lock:
+            keys = {sender_id: self._lookup(sender_id) for sender_id, _, _ in frames}
+
+        results: List[Optional[str]] = []
+        outcomes: Dict[str, int] = {}
+        for sender_id, payload, signature in frames:
+            error, outcome = self._check(sender_id, keys[sender_id], payload, signature)
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+            results.append(error)
+
+        with self.lock:
+            for outcome, count in outcomes.items():
+                self.stats[outcome] += count
+        return results
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get signing statistics"""
+        with self.lock:
+            return {
+                **self.stats,
+                "sign_messages": self.sign_messages,
+                "enforce_verification": self.enforce_verification,
+                "verified_peers": len(self.verified_keys)
+            }
@@ -1,68 +1,296 @@
 import json
+import os
+import threading
 import time
-from typing import Dict,Tuple, Any, Optional, Set
+from typing import Callable, Dict, List, Tuple, Any, Optional
+
+import yaml
+
+from src.backend.chunk_store import ChunkStore, valid_manifest
+from src.backend.file_manager import DEFAULT_CHUNK_SIZE, MIN_TRANSFER_CHUNK_SIZE
+from src.core.message_protocol import MessageType
+from src.security.replay_cache import ReplayCache
+
+# Content schema per message type: field -> (accepted types, required).
+# Optional fields may also be absent or null.
+MESSAGE_SCHEMAS: Dict[MessageType, Dict[str, Tuple[tuple, bool]]] = {
+    MessageType.HANDSHAKE: {
+        "address": ((str,), False),
+        "port": ((int,), False),
+        "public_key": ((str,), False),
+        "capabilities": ((list,), False),
+        "signing_key": ((str,), False),
+        "signing_key_binding": ((str,), False),
+    },
+    MessageType.TEXT: {
+        "text": ((str,), True),
+        "delivery": ((dict,), False),
+    },
+    MessageType.ACK: {
+        "epoch": ((str,), False),
+        "ack": ((int,), False),
+        "missing": ((list,), False),
+    },
+    MessageType.PING: {},
+    MessageType.PONG: {},
+    MessageType.ERROR: {},
+    MessageType.FILE_TRANSFER_REQUEST: {
+        "file_id": ((str,), True),
+        "filename": ((str,), True),
+        "file_size": ((int,), True),
+        "mime_type": ((str,), False),
+        "chunk_size": ((int,), False),
+        "manifest": ((list,), False),
+        "merkle_root": ((str,), False),
+        "max_chunk_size": ((int,), False),
+    },
+    MessageType.FILE_TRANSFER_CHUNK: {
+        "file_id": ((str,), True),
+        "chunk_index": ((int,), True),
+        "chunk_data": ((str,), True),
+        "is_last": ((bool,), False),
+        "encoding": ((str,), False),
+        "proof": ((list,), False),
+        "proofs": ((list,), False),
+    },
+    MessageType.FILE_TRANSFER_COMPLETE: {
+        "file_id": ((str,), True),
+    },
+    MessageType.FILE_TRANSFER_ACK: {
+        "file_id": ((str,), True),
+        "success": ((bool,), False),
+    },
+    MessageType.FILE_TRANSFER_RESUME: {
+        "file_id": ((str,), True),
+        "missing": ((list,), True),
+    },
+    MessageType.FILE_TRANSFER_WANT: {
+        "file_id": ((str,), True),
+        "missing": ((list,), True),
+    },
+    MessageType.FILE_SWARM_QUERY: {
+        "file_id": ((str,), True),
+    },
+    MessageType.FILE_SWARM_HAVE: {
+        "file_id": ((str,), True),
+        "ranges": ((list,), True),
+        "filename": ((str,), False),
+        "file_size": ((int,), False),
+        "mime_type": ((str,), False),
+        "chunk_size": ((int,), False),
+        "merkle_root": ((str,), False),
+    },
+    MessageType.FILE_SWARM_FETCH: {
+        "file_id": ((str,), True),
+        "ranges": ((list,), True),
+    },
+}
+
+REQUIRED_FIELDS = ("version", "type", "sender_id", "message_id", "timestamp")
+MAX_SPAN_PROOFS = 1024  # Merkle proofs in one chunk message carrying a span of chunks
+
+ContentCheck = Callable[[Dict[str, Any]], Optional[str]]
+
 
 class MessageValidator:
-    def __init__(self):
-        self.seen_messages: Set[str] = set()  # Track message IDs to prevent replay
+    def __init__(self, config_path: str = "config/security.yaml", replay_capacity: int = 1_000_000):
         self.max_message_age = 300  # 5 minutes
         self.max_message_size = 1024 * 1024  # 1MB
-        
-    def validate_message(self, message: Dict[str, Any]) -> Tuple[bool, Optional[str]]:
-        """Validate incoming message"""
+        self.max_text_length = 10000
+        self.replay_sender_share = 0.25  # most of a replay cache bucket one sender may fill
+        self._load_config(config_path)
+
+        # Timestamps up to max_message_age in the past *or* future are accepted,
+        # so an ID must be remembered for twice that long to block every replay
+        self.replay_cache = ReplayCache(self.max_message_age * 2, capacity=replay_capacity,
+                                        owner_share=self.replay_sender_share)
+
+        # Compile every schema once; validate_message only does a dict lookup
+        self.validators: Dict[str, Callable[[Dict[str, Any]], Optional[str]]] = {
+            msg_type.value: self._compile_schema(msg_type, fields)
+            for msg_type, fields in MESSAGE_SCHEMAS.items()
+        }
+        self.lock = threading.Lock()
+        self.type_stats: Dict[str, Dict[str, int]] = {
+            msg_type: {"validated": 0, "rejected": 0, "total_ns": 0}
+            for msg_type in self.validators
+        }
+
+    def _load_config(self, config_path: str):
+        """Load validation limits from the security config if available"""
+        if not config_path or not os.path.exists(config_path):
+            return
+        with open(config_path, 'r') as f:
+            config = yaml.safe_load(f) or {}
+        validation = config.get("validation", {})
+        self.max_message_age = validation.get("max_message_age_seconds", self.max_message_age)
+        self.max_message_size = validation.get("max_message_size_bytes", self.max_message_size)
+        self.max_text_length = validation.get("max_text_length", self.max_text_length)
+        self.replay_sender_share = validation.get("replay_sender_share", self.replay_sender_share)
+
+    def _content_checks(self, msg_type: MessageType) -> List[ContentCheck]:
+        """Value checks that go beyond field presence and type"""
+        if msg_type == MessageType.TEXT:
+            return [lambda c: "Text message too long" if len(c["text"]) > self.max_text_length else None]
+        if msg_type == MessageType.FILE_TRANSFER_REQUEST:
+            return [
+                lambda c: "Empty file_id" if not c["file_id"] else None,
+                lambda c: "Negative file_size" if c["file_size"] < 0 else None,
+                lambda c: "Invalid chunk_size" if not MIN_TRANSFER_CHUNK_SIZE <= c.get(
+                    "chunk_size", DEFAULT_CHUNK_SIZE) <= self.max_message_size else None,
+                lambda c: "Invalid manifest" if c.get("manifest") is not None
+                and not valid_manifest(c["manifest"], c["file_size"]) else None,
+                lambda c: "Invalid merkle_root" if c.get("merkle_root") is not None
+                and not ChunkStore.is_digest(c["merkle_root"]) else None,
+                lambda c: "Invalid max_chunk_size" if c.get("max_chunk_size") is not None and not (
+                    0 < c["max_chunk_size"] <= self.max_message_size
+                    and c["max_chunk_size"] % (c.get("chunk_size") or DEFAULT_CHUNK_SIZE) == 0) else None,
+            ]
+        if msg_type == MessageType.FILE_TRANSFER_CHUNK:
+            return [
+                lambda c: "Empty file_id" if not c["file_id"] else None,
+                lambda c: "Negative chunk_index" if c["chunk_index"] < 0 else None,
+                lambda c: "Chunk data too large" if len(c["chunk_data"]) > self.max_message_size else None,
+                lambda c: "Chunk data is not valid base64" if len(c["chunk_data"]) % 4 else None,
+                lambda c: "Merkle proof too long" if len(c.get("proof") or ()) > 64 else None,
+                lambda c: "Invalid Merkle proofs" if c.get("proofs") is not None and (
+                    len(c["proofs"]) > MAX_SPAN_PROOFS
+                    or not all(isinstance(p, list) and len(p) <= 64 for p in c["proofs"])) else None,
+            ]
+        if msg_type in (MessageType.FILE_TRANSFER_RESUME, MessageType.FILE_TRANSFER_WANT):
+            return [
+                lambda c: "Empty file_id" if not c["file_id"] else None,
+                lambda c: "Too many missing ranges" if len(c["missing"]) > 64 else None,
+            ]
+        if msg_type == MessageType.FILE_SWARM_QUERY:
+            return [lambda c: "Empty file_id" if not c["file_id"] else None]
+        if msg_type in (MessageType.FILE_SWARM_HAVE, MessageType.FILE_SWARM_FETCH):
+            return [
+                lambda c: "Empty file_id" if not c["file_id"] else None,
+                lambda c: "Too many chunk ranges" if len(c["ranges"]) > 64 else None,
+                lambda c: "Invalid chunk ranges" if not all(
+                    isinstance(r, list) and len(r) == 2 and all(type(v) is int for v in r) and 0 <= r[0] <= r[1]
+                    for r in c["ranges"]) else None,
+                lambda c: "Incomplete file description" if c["ranges"] and msg_type == MessageType.FILE_SWARM_HAVE
+                and not all(isinstance(c.get(f), int) and c[f] >= 0 for f in ("file_size", "chunk_size"))
+                else None,
+                lambda c: "Invalid chunk_size" if c.get("chunk_size") is not None
+                and not 0 < c["chunk_size"] <= self.max_message_size else None,
+                lambda c: "Invalid merkle_root" if c.get("merkle_root") is not None
+                and not ChunkStore.is_digest(c["merkle_root"]) else None,
+            ]
+        return []
+
+    def _compile_schema(self, msg_type: MessageType, fields: Dict[str, Tuple[tuple, bool]]):
+        """Build a single validation function for one message type"""
+        required = tuple(name for name, (_, is_required) in fields.items() if is_required)
+        typed = tuple((name, types, bool in types) for name, (types, _) in fields.items())
+        checks = tuple(self._content_checks(msg_type))
+        label = msg_type.value
+
+        def validate(message: Dict[str, Any]) -> Optional[str]:
+            content = message.get("content")
+            if content is None:
+                content = {}
+            elif not isinstance(content, dict):
+                return f"Invalid {label} content: expected an object"
+
+            for name in required:
+                if name not in content:
+                    return f"Invalid {label} message: missing {name}"
+
+            for name, types, allows_bool in typed:
+                value = content.get(name)
+                if value is None:
+                    continue
+                # bool is an int subclass; only accept it where it is declared
+                if not isinstance(value, types) or (isinstance(value, bool) and not allows_bool):
+                    return f"Invalid {label} message: bad type for {name}"
+
+            for check in checks:
+                error = check(content)
+                if error:
+                    return error
+            return None
+
+        return validate
+
+    def validate_message(self, message: Dict[str, Any], check_replay: bool = True) -> Tuple[bool, Optional[str]]:
+        """Validate incoming message
+
+        With ``check_replay=False`` the message ID is not recorded; callers
+        that authenticate messages call ``check_replay`` once the signature
+        has been verified, so forged frames never take up replay cache room.
+        """
         # Check required fields
-        required_fields = ["version", "type", "sender_id", "message_id", "timestamp"]
-        for field in required_fields:
+        for field in REQUIRED_FIELDS:
             if field not in message:
                 return False, f"Missing required field: {field}"
-        
-        # Check message ID uniqueness (prevent replay)
-        msg_id = message["message_id"]
-        if msg_id in self.seen_messages:
-            return False, "Duplicate message ID"
-        
+
         # Check timestamp (prevent old messages)
         try:
             msg_time = float(message["timestamp"])
             current_time = time.time()
-            
+
             if abs(current_time - msg_time) > self.max_message_age:
                 return False, "Message timestamp too old or in future"
         except:
             return False, "Invalid timestamp"
-        
+
         # Check message type
-        valid_types = [
-            "handshake", "text", "ack", "ping", "pong", "error",
-            "file_transfer_request", "file_transfer_chunk", 
-            "file_transfer_complete", "file_transfer_ack"
-        ]
-        if message["type"] not in valid_types:
-            return False, f"Invalid message type: {message['type']}"
-        
+        msg_type = message["type"]
+        validator = self.validators.get(msg_type) if isinstance(msg_type, str) else None
+        if validator is None:
+            return False, f"Invalid message type: {msg_type}"
+
         # Type-specific validation
-        if message["type"] == "text":
-            if "content" not in message or "text" not in message.get("content", {}):
-                return False, "Text message missing content"
-            
-            # Check text length
-            text = message["content"]["text"]
-            if len(text) > 10000:  # 10K character limit
-                return False, "Text message too long"
-        
-        # Add to seen messages
-        self.seen_messages.add(msg_id)
-        
-        # Clean old message IDs periodically (simple approach)
-        if len(self.seen_messages) > 10000:
-            self.seen_messages.clear()  # Week 3: Implement proper cleanup
-        
+        started = time.perf_counter_ns()
+        error = validator(message)
+        elapsed = time.perf_counter_ns() - started
+        with self.lock:
+            stats = self.type_stats[msg_type]
+            stats["total_ns"] += elapsed
+            stats["rejected" if error else "validated"] += 1
+        if error:
+            return False, error
+
+        if check_replay:
+            return self.check_replay(message)
         return True, None
-    
+
+    def check_replay(self, message: Dict[str, Any], peer_id: Optional[str] = None) -> Tuple[bool, Optional[str]]:
+        """Check message ID uniqueness (prevent replay) and remember it under a per-peer quota
+
+        The quota is charged to ``peer_id``, the connection the message came
+        in on, when given: ``sender_id`` is only a claim unless the peer's
+        signature was verified, so keying on it would let one connection
+        rotate IDs past the quota or use up another peer's.
+        """
+        owner = peer_id if peer_id is not None else message["sender_id"]
+        error = self.replay_cache.admit(str(message["message_id"]), owner=str(owner))
+        return error is None, error
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get validator statistics, including per-type schema validation cost"""
+        with self.lock:
+            per_type = {}
+            for msg_type, stats in self.type_stats.items():
+                count = stats["validated"] + stats["rejected"]
+                per_type[msg_type] = {
+                    "validated": stats["validated"],
+                    "rejected": stats["rejected"],
+                    "avg_validation_us": round(stats["total_ns"] / count / 1000, 3) if count else 0.0
+                }
+        return {
+            "max_message_size": self.max_message_size,
+            "types": per_type,
+            "replay_cache": self.replay_cache.get_stats()
+        }
+
     def sanitize_text(self, text: str) -> str:
         """Basic text sanitization"""
         # Remove control characters except newline and tab
-        sanitized = ''.join(char for char in text 
-                          if char == '\n' or char == '\t' or 
+        sanitized = ''.join(char for char in text
+                          if char == '\n' or char == '\t' or
                           (ord(char) >= 32 and ord(char) < 127))
-        return sanitized[:10000]  # Enforce max length
\ No newline at end of file
+        return sanitized[:self.max_text_length]  # Enforce max length
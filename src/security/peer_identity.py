@@ -1,11 +1,15 @@
 import uuid
+import base64
 import hashlib
 import json
 import os
 from typing import Dict, Optional, Any
 from datetime import datetime
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, padding, rsa
+
+# Domain separation for the RSA signature that binds a signing key to a peer ID
+SIGNING_KEY_BINDING_PREFIX = b"p2p-signing-key:"
 
 
 class PeerIdentity:
@@ -18,6 +22,9 @@ class PeerIdentity:
         self.peer_id: str = ""
         self.public_key: Any = None
         self.private_key: Any = None
+        # Ed25519 key for fast per-message signatures, bound to the RSA identity
+        self.signing_key: Any = None
+        self._signing_key_binding: Optional[str] = None
         self.peer_info: Dict = {}
 
         if os.path.exists(self.identity_file):
@@ -37,6 +44,7 @@ class PeerIdentity:
             key_size=2048
         )
         self.public_key = self.private_key.public_key()
+        self.signing_key = ed25519.Ed25519PrivateKey.generate()
 
         pub_key_bytes = self.public_key.public_bytes(
             encoding=serialization.Encoding.PEM,
@@ -79,6 +87,12 @@ class PeerIdentity:
             "public_key": public_pem.decode("utf-8"),
             "peer_info": self.peer_info
         }
+        if self.signing_key:
+            identity_data["signing_key"] = self.signing_key.private_bytes(
+                encoding=serialization.Encoding.PEM,
+                format=serialization.PrivateFormat.PKCS8,
+                encryption_algorithm=serialization.NoEncryption()
+            ).decode("utf-8")
 
         with open(self.identity_file, "w") as f:
             json.dump(identity_data, f, indent=2)
@@ -101,10 +115,21 @@ class PeerIdentity:
             self.public_key = serialization.load_pem_public_key(
                 identity_data["public_key"].encode("utf-8")
             )
+            signing_pem = identity_data.get("signing_key")
+            if signing_pem:
+                self.signing_key = serialization.load_pem_private_key(
+                    signing_pem.encode("utf-8"),
+                    password=None
+                )
 
         except Exception as e:
             raise RuntimeError(f"Failed to load identity from {self.identity_file}: {e}")
 
+        # Identities created before message signing get a signing key on first load
+        if not self.signing_key:
+            self.signing_key = ed25519.Ed25519PrivateKey.generate()
+            self.save_identity()
+
     def get_public_key_string(self) -> str:
         """
         Returns public key in PEM string format.
@@ -117,6 +142,53 @@ class PeerIdentity:
             format=serialization.PublicFormat.SubjectPublicKeyInfo
         ).decode("utf-8")
 
+    def get_signing_public_key_string(self) -> str:
+        """
+        Returns the raw Ed25519 signing public key, base64 encoded.
+        """
+        if not self.signing_key:
+            raise RuntimeError("Signing key not initialized")
+
+        raw = self.signing_key.public_key().public_bytes(
+            encoding=serialization.Encoding.Raw,
+            format=serialization.PublicFormat.Raw
+        )
+        return base64.b64encode(raw).decode("utf-8")
+
+    def get_signing_key_binding(self) -> str:
+        """
+        Returns an RSA signature over the signing public key, proving that the
+        key belongs to this peer ID. Computed once, since RSA signing is slow.
+        """
+        if self._signing_key_binding is None:
+            signed = SIGNING_KEY_BINDING_PREFIX + self.get_signing_public_key_string().encode("utf-8")
+            signature = self.private_key.sign(signed, padding.PKCS1v15(), hashes.SHA256())
+            self._signing_key_binding = base64.b64encode(signature).decode("utf-8")
+        return self._signing_key_binding
+
+    def sign(self, data: bytes) -> bytes:
+        """
+        Signs data with the Ed25519 signing key.
+        """
+        return self.signing_key.sign(data)
+
+    @staticmethod
+    def verify_signing_key_binding(public_key_string: str, signing_key: str, binding: str) -> bool:
+        """
+        Verifies that a signing key was bound to an identity by its RSA key.
+        """
+        try:
+            public_key = serialization.load_pem_public_key(public_key_string.encode("utf-8"))
+            public_key.verify(
+                base64.b64decode(binding),
+                SIGNING_KEY_BINDING_PREFIX + signing_key.encode("utf-8"),
+                padding.PKCS1v15(),
+                hashes.SHA256()
+            )
+            return True
+        except Exception:
+            return False
+
     def verify_peer_id(self, peer_id: str, public_key_string: str) -> bool:
         """
         Verifies that a peer ID matches the given public key string.
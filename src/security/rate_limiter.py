@@ -0,0 +1,182 @@
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import yaml
+
+
+class TokenBucket:
+    """Token bucket that lets callers go into debt and wait it off.
+
+    ``consume`` never refuses: it takes the tokens and returns how long the
+    caller should pause before continuing. Paying off the debt by waiting keeps
+    the long-run rate at ``rate`` even when a single request is larger than the
+    bucket, which is exactly what a socket reader needs for backpressure.
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "updated_at")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def consume(self, amount: float = 1) -> float:
+        """Take ``amount`` tokens and return the seconds to wait (0 if within budget)"""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= amount
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def is_idle(self) -> bool:
+        """True once the bucket has refilled completely (safe to discard)"""
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+    def set_rate(self, rate: float, capacity: float):
+        self._refill(time.monotonic())
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = min(self.tokens, capacity)
+
+
+class RateLimiter:
+    """Per-peer token buckets for messages, bytes and new connections.
+
+    Limits are expressed per minute like ``config/security.yaml``; a limit of
+    0 disables that bucket. Buckets allow ``burst_seconds`` worth of traffic
+    at once before throttling kicks in.
+    """
+
+    LIMITS = ("max_messages_per_minute", "max_bytes_per_minute", "max_connections_per_minute")
+    MAX_IDLE_BUCKETS = 4096
+
+    def __init__(self, config_path: str = "config/security.yaml"):
+        self.enabled = False
+        self.limits: Dict[str, float] = {
+            "max_messages_per_minute": 60,
+            "max_bytes_per_minute": 0,
+            "max_connections_per_minute": 10
+        }
+        self.burst_seconds = 5.0
+        self.buckets: Dict[str, Dict[str, TokenBucket]] = {limit: {} for limit in self.LIMITS}
+        self.lock = threading.Lock()
+        self.stats = {"throttle_events": 0, "throttled_seconds": 0.0}
+        self._load_config(config_path)
+
+    def _load_config(self, config_path: str):
+        """Load rate limits from the security config if available"""
+        if not config_path or not os.path.exists(config_path):
+            return
+        with open(config_path, 'r') as f:
+            config = yaml.safe_load(f) or {}
+        rate_config = config.get("rate_limiting", {})
+        self.set_limits(
+            enabled=rate_config.get("enabled"),
+            burst_seconds=rate_config.get("burst_seconds"),
+            **{limit: rate_config.get(limit) for limit in self.LIMITS}
+        )
+
+    def _bucket_params(self, limit: str):
+        rate = self.limits[limit] / 60.0
+        # At least one whole unit so a single message or connection can pass
+        return rate, max(rate * self.burst_seconds, 1.0)
+
+    def set_limits(self, enabled: Optional[bool] = None, burst_seconds: Optional[float] = None,
+                   **limits: Optional[float]) -> Dict[str, Any]:
+        """Adjust limits at runtime; existing buckets pick up the new rates immediately"""
+        unknown = set(limits) - set(self.LIMITS)
+        if unknown:
+            raise ValueError(f"Unknown rate limits: {', '.join(sorted(unknown))}")
+
+        if burst_seconds is not None and burst_seconds <= 0:
+            raise ValueError("burst_seconds must be positive")
+        # Validate everything before changing anything, so a bad update leaves no partial change
+        new_limits = {limit: value for limit, value in limits.items() if value is not None}
+        for limit, value in new_limits.items():
+            if value < 0:
+                raise ValueError(f"{limit} must not be negative")
+
+        with self.lock:
+            if enabled is not None:
+                self.enabled = bool(enabled)
+            if burst_seconds is not None:
+                self.burst_seconds = float(burst_seconds)
+            for limit, value in new_limits.items():
+                self.limits[limit] = float(value)
+            for limit, buckets in self.buckets.items():
+                rate, capacity = self._bucket_params(limit)
+                for bucket in buckets.values():
+                    bucket.set_rate(rate, capacity)
+        return self.get_limits()
+
+    def get_limits(self) -> Dict[str, Any]:
+        return {"enabled": self.enabled, "burst_seconds": self.burst_seconds, **self.limits}
+
+    def _consume(self, limit: str, key: str, amount: float) -> float:
+        if not self.enabled or self.limits[limit] <= 0:
+            return 0.0
+        with self.lock:
+            buckets = self.buckets[limit]
+            bucket = buckets.get(key)
+            if bucket is None:
+                if len(buckets) >= self.MAX_IDLE_BUCKETS:
+                    self._prune(buckets)
+                bucket = buckets[key] = TokenBucket(*self._bucket_params(limit))
+            wait = bucket.consume(amount)
+            if wait > 0:
+                self.stats["throttle_events"] += 1
+                self.stats["throttled_seconds"] += wait
+            return wait
+
+    @staticmethod
+    def _prune(buckets: Dict[str, TokenBucket]):
+        """Drop buckets that have refilled; they carry no state worth keeping"""
+        for key in [key for key, bucket in buckets.items() if bucket.is_idle()]:
+            del buckets[key]
+
+    def message_delay(self, peer_id: str) -> float:
+        """Seconds to pause before handling another message from this peer"""
+        return self._consume("max_messages_per_minute", peer_id, 1)
+
+    def bytes_delay(self, peer_id: str, num_bytes: int) -> float:
+        """Seconds to pause reading after receiving ``num_bytes`` from this peer"""
+        return self._consume("max_bytes_per_minute", peer_id, num_bytes)
+
+    def connection_delay(self, host: str) -> float:
+        """Seconds to wait before serving a new connection from this host"""
+        return self._consume("max_connections_per_minute", host, 1)
+
+    def rename_peer(self, old_id: str, new_id: str):
+        """Carry a peer's buckets over when its temporary ID is replaced after handshake"""
+        with self.lock:
+            for limit in ("max_messages_per_minute", "max_bytes_per_minute"):
+                buckets = self.buckets[limit]
+                if old_id in buckets:
+                    buckets[new_id] = buckets.pop(old_id)
+
+    def forget_peer(self, peer_id: str):
+        """Drop per-peer message and byte buckets when the connection goes away"""
+        with self.lock:
+            for limit in ("max_messages_per_minute", "max_bytes_per_minute"):
+                self.buckets[limit].pop(peer_id, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get rate limiter statistics"""
+        with self.lock:
+            return {
+                **self.get_limits(),
+                "throttle_events": self.stats["throttle_events"],
+                "throttled_seconds": round(self.stats["throttled_seconds"], 3),
+                "tracked_peers": len(self.buckets["max_messages_per_minute"])
+            }
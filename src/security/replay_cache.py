@@ -0,0 +1,190 @@
+import hashlib
+import math
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+# Reasons ReplayCache.admit refuses a key
+DUPLICATE = "Duplicate message ID"
+OVER_QUOTA = "Sender exceeded its replay cache quota"
+
+
+class _BloomGeneration:
+    """One time bucket of the replay filter"""
+
+    __slots__ = ("bits", "count", "started_at", "owners")
+
+    def __init__(self, num_bytes: int, started_at: float):
+        self.bits = bytearray(num_bytes)
+        self.count = 0
+        self.started_at = started_at
+        self.owners: Dict[str, int] = {}  # keys inserted per sender
+
+
+class ReplayCache:
+    """Rotating Bloom filter that remembers message IDs for a fixed time window.
+
+    The window is split into ``generations - 1`` equal buckets plus the bucket
+    currently being filled. Every insert goes into the newest generation and a
+    lookup checks all of them; when a bucket's time is up the oldest generation
+    is dropped, so history expires one bucket at a time instead of all at once.
+
+    Memory is fixed up front from ``capacity`` (messages per window) and the
+    target false-positive rate. If a bucket receives more than its share of
+    ``capacity`` it is rotated early: this shortens the effective window a
+    little but keeps the false-positive rate bounded.
+
+    Keys added with an ``owner`` (the sender) count against that owner's
+    quota of ``owner_share`` of a bucket. An owner over its quota is
+    refused until the bucket rotates on time, so no single sender can
+    force the early rotations that would cut everyone else's window short.
+    """
+
+    def __init__(self, window_seconds: float, capacity: int = 1_000_000,
+                 false_positive_rate: float = 1e-6, generations: int = 4,
+                 owner_share: float = 0.25):
+        if generations < 2:
+            raise ValueError("ReplayCache needs at least 2 generations")
+        if capacity <= 0 or not 0 < false_positive_rate < 1:
+            raise ValueError("capacity must be positive and false_positive_rate in (0, 1)")
+        if not 0 < owner_share <= 1:
+            raise ValueError("owner_share must be in (0, 1]")
+
+        self.window_seconds = window_seconds
+        self.capacity = capacity
+        self.target_false_positive_rate = false_positive_rate
+        self.num_generations = generations
+        self.bucket_seconds = window_seconds / (generations - 1)
+
+        # Size each generation for its share of the window at fp / generations,
+        # since a lookup has to miss in every generation to count as new
+        self.generation_capacity = math.ceil(capacity / (generations - 1))
+        per_generation_fp = false_positive_rate / generations
+        num_bits = math.ceil(-self.generation_capacity * math.log(per_generation_fp) / (math.log(2) ** 2))
+        self.num_bytes = (num_bits + 7) // 8
+        self.num_bits = self.num_bytes * 8
+        self.num_hashes = max(1, round(self.num_bits / self.generation_capacity * math.log(2)))
+        self.owner_quota = max(1, int(self.generation_capacity * owner_share))
+
+        self.generations: Deque[_BloomGeneration] = deque()
+        self.lock = threading.Lock()
+        self.stats = {
+            "inserted": 0,
+            "duplicates_rejected": 0,
+            "rotations": 0,
+            "early_rotations": 0,
+            "quota_rejected": 0
+        }
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        m = self.num_bits
+        return [(h1 + i * h2) % m for i in range(self.num_hashes)]
+
+    @staticmethod
+    def _contains(generation: _BloomGeneration, positions) -> bool:
+        bits = generation.bits
+        for pos in positions:
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def _rotate(self, now: float):
+        """Expire generations whose bucket has fallen out of the window"""
+        if not self.generations:
+            self.generations.append(_BloomGeneration(self.num_bytes, now))
+            return
+
+        elapsed = now - self.generations[-1].started_at
+        if elapsed < self.bucket_seconds:
+            return
+
+        steps = int(elapsed // self.bucket_seconds)
+        if steps >= self.num_generations:
+            # Idle for longer than the whole window: everything has expired
+            self.generations.clear()
+            self.generations.append(_BloomGeneration(self.num_bytes, now))
+        else:
+            # Keep bucket boundaries aligned so retention never drops below the window
+            started_at = self.generations[-1].started_at
+            for step in range(1, steps + 1):
+                self._push_generation(started_at + step * self.bucket_seconds)
+        self.stats["rotations"] += steps
+
+    def _push_generation(self, now: float):
+        if len(self.generations) >= self.num_generations:
+            self.generations.popleft()
+        self.generations.append(_BloomGeneration(self.num_bytes, now))
+
+    def add(self, key: str, now: Optional[float] = None) -> bool:
+        """Record a key. Returns False if it was (probably) seen within the window."""
+        return self.admit(key, now=now) is None
+
+    def admit(self, key: str, owner: Optional[str] = None, now: Optional[float] = None) -> Optional[str]:
+        """Record a key sent by ``owner``; returns why it was refused, or None if it is new"""
+        positions = self._positions(key)
+        now = time.time() if now is None else now
+
+        with self.lock:
+            self._rotate(now)
+            for generation in self.generations:
+                if self._contains(generation, positions):
+                    self.stats["duplicates_rejected"] += 1
+                    return DUPLICATE
+
+            current = self.generations[-1]
+            if owner is not None and current.owners.get(owner, 0) >= self.owner_quota:
+                self.stats["quota_rejected"] += 1
+                return OVER_QUOTA
+            if current.count >= self.generation_capacity:
+                self._push_generation(now)
+                self.stats["early_rotations"] += 1
+                current = self.generations[-1]
+
+            bits = current.bits
+            for pos in positions:
+                bits[pos >> 3] |= 1 << (pos & 7)
+            current.count += 1
+            if owner is not None:
+                current.owners[owner] = current.owners.get(owner, 0) + 1
+            self.stats["inserted"] += 1
+            return None
+
+    def __contains__(self, key: str) -> bool:
+        positions = self._positions(key)
+        with self.lock:
+            self._rotate(time.time())
+            return any(self._contains(g, positions) for g in self.generations)
+
+    def estimated_false_positive_rate(self) -> float:
+        """Probability that a never-seen key is reported as a duplicate right now"""
+        with self.lock:
+            miss_probability = 1.0
+            for generation in self.generations:
+                fill = 1 - math.exp(-self.num_hashes * generation.count / self.num_bits)
+                miss_probability *= 1 - fill ** self.num_hashes
+            return 1 - miss_probability
+
+    def memory_bytes(self) -> int:
+        """Bytes held by the filter bit arrays (fixed once all generations exist)"""
+        return self.num_bytes * self.num_generations
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get replay cache statistics"""
+        fp_rate = self.estimated_false_positive_rate()
+        with self.lock:
+            entries = sum(g.count for g in self.generations)
+            return {
+                **self.stats,
+                "entries": entries,
+                "generations": len(self.generations),
+                "window_seconds": self.window_seconds,
+                "capacity": self.capacity,
+                "owner_quota": self.owner_quota,
+                "num_hashes": self.num_hashes,
+                "memory_bytes": self.memory_bytes(),
+                "estimated_false_positive_rate": fp_rate
+            }
@@ -0,0 +1,603 @@
+import sys
+import threading
+import time
+from pathlib import Path
+
+# Ensure the src package is importable when running tests without installation
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+SRC_PATH = PROJECT_ROOT / "src"
+if str(SRC_PATH) not in sys.path:
+    sys.path.insert(0, str(SRC_PATH))
+
+from backend.message_history import MessageHistory
+from backend.message_store import MessageStore
+from backend.event_bus import EventBus
+from backend.delivery import DeliveryTracker
+from backend.chunk_sizing import ADAPT_SPANS, ChunkSizer, span_limit
+from backend.chunk_store import MAX_CHUNK_SIZE, MIN_CHUNK_SIZE, cdc_chunks
+from backend.file_manager import FileManager, chunk_stream
+from backend.file_response import file_response, parse_range, prefix_response
+from backend.merkle import MerkleTree, leaf_hash, verify_proof
+from backend.message_queue import MessageQueue, TimerWheel
+from backend.models import Message
+from backend.outbox import Outbox
+from backend.swarm import BLOCK_CHUNKS, STALL_TIMEOUT, SwarmDownload
+from backend.transfer_manager import TransferManager
+
+
+class TestBackend:
+    """Tests for backend storage components"""
+
+    def test_history_summarizes_chunks_and_respects_budgets(self):
+        history = MessageHistory(max_entries=100, max_bytes=20000)
+        chunk = {
+            "type": "file_transfer_chunk",
+            "message_id": "m1",
+            "content": {"file_id": "f1", "chunk_index": 3, "chunk_data": "A" * 44000, "is_last": False}
+        }
+        history.record({"direction": "incoming", "payload": chunk})
+
+        entry = history.get(1)[0]
+        assert "chunk_data" not in entry["payload"]["content"]
+        assert entry["payload"]["content"] == {"file_id": "f1", "chunk_index": 3, "size": 33000, "is_last": False}
+        assert chunk["content"]["chunk_data"]  # the caller's message is left intact
+
+        for i in range(50):
+            history.record({"direction": "incoming", "payload": {"type": "text", "content": {"text": "x" * 1000}}})
+        stats = history.get_stats()
+        assert stats["memory_bytes"] <= 20000
+        assert stats["evicted"] > 0
+        assert stats["summarized"] == 1
+        assert len(history.get(1000)) == stats["entries"]
+
+    def test_message_store_persists_and_paginates(self, tmp_path):
+        db_path = str(tmp_path / "messages.db")
+        store = MessageStore(db_path, flush_interval=0.05)
+        store.start()
+        for i in range(30):
+            payload = {"type": "text", "message_id": f"m{i}", "sender_id": "peer-a" if i % 3 else "peer-b",
+                       "content": {"text": str(i)}}
+            store.record({"direction": "incoming", "payload": payload})
+        store.stop()
+
+        # A new store sees the rows written by the previous one
+        store = MessageStore(db_path)
+        page = store.query(limit=5)
+        assert [entry["payload"]["content"]["text"] for entry in page] == ["29", "28", "27", "26", "25"]
+        older = store.query(limit=5, before=page[-1]["id"])
+        assert [entry["payload"]["content"]["text"] for entry in older] == ["24", "23", "22", "21", "20"]
+        newer = store.query(limit=3, after=older[0]["id"])
+        assert [entry["id"] for entry in newer] == [page[-1]["id"] + 2, page[-1]["id"] + 1, page[-1]["id"]]
+
+        by_peer = store.query(limit=100, peer_id="peer-b")
+        assert len(by_peer) == 10
+        assert all(entry["payload"]["sender_id"] == "peer-b" for entry in by_peer)
+        assert store.record({"direction": "incoming", "payload": {"type": "ping"}})["id"] == 31
+        # A query in progress does not hold up recording
+        with store.read_lock:
+            assert store.record({"direction": "incoming", "payload": {"type": "ping"}})["id"] == 32
+
+    def test_event_bus_coalesces_and_bounds_each_subscriber(self):
+        bus = EventBus(max_pending=10)
+        wakeups = []
+        subscription = bus.subscribe(lambda: wakeups.append(1))
+        filtered = bus.subscribe(lambda: None, event_types=["message"])
+
+        for i in range(100):
+            bus.publish("chunk_progress", {"chunks_received": i}, key="f1")
+        bus.publish("message", {"text": "hi"})
+
+        events = subscription.drain()
+        assert [e["type"] for e in events] == ["chunk_progress", "message"]
+        assert events[0]["data"]["chunks_received"] == 99
+        assert len(wakeups) == 1  # only notified when the queue became non-empty
+        assert [e["type"] for e in filtered.drain()] == ["message"]
+
+        # A subscriber that stops reading is reset to a single resync event
+        for i in range(11):
+            bus.publish("message", {"text": str(i)})
+        assert [e["type"] for e in subscription.drain()] == ["resync"]
+        assert subscription.stats["overflows"] == 1
+
+        bus.unsubscribe(subscription)
+        bus.publish("message", {"text": "late"})
+        assert subscription.drain() == []
+
+    def test_message_queue_is_fair_across_peers_and_delays_retries(self):
+        sent = []
+        attempts = []
+        gate = threading.Event()
+
+        def handler(message):
+            gate.wait(timeout=5)
+            if message.recipient_id == "dead":
+                attempts.append(time.monotonic())
+                return False
+            sent.append(message.recipient_id)
+
+        queue = MessageQueue(num_workers=1, retry_base_delay=0.2)
+        queue.start(handler)
+        # A busy peer queues first; the quiet peer must not wait behind all of it
+        for i in range(5):
+            queue.put_message(Message(f"busy-{i}", "me", "busy", "text", {"text": str(i)}))
+        queue.put_message(Message("quiet-0", "me", "quiet", "text", {"text": "0"}))
+        queue.put_message(Message("dead-0", "me", "dead", "text", {"text": "0"}))
+        gate.set()
+
+        deadline = time.time() + 5
+        while (len(sent) < 6 or len(attempts) < 3) and time.time() < deadline:
+            time.sleep(0.05)
+        queue.stop()
+
+        assert sent.index("quiet") <= 1
+        assert len(attempts) == 3  # first try plus two retries, then it gives up
+        assert attempts[1] - attempts[0] >= 0.15 and attempts[2] - attempts[1] >= 0.35
+        stats = queue.get_stats()
+        assert stats["retries_exhausted"] == 1
+        assert stats["send_latency"]["count"] == 6
+
+    def test_message_queue_retries_keep_recipient_order_and_count_toward_size(self):
+        sent = []
+        failures = {"m0": 1}
+
+        def handler(message):
+            if failures.get(message.message_id):
+                failures[message.message_id] -= 1
+                return False
+            sent.append(message.message_id)
+
+        queue = MessageQueue(max_size=3, num_workers=2, retry_base_delay=0.2)
+        queue.start(handler)
+        assert queue.put_message(Message("m0", "me", "peer", "text", {"text": "0"}))
+        time.sleep(0.1)  # m0 has failed and waits for its retry
+        assert queue.get_stats()["queue_size"] == 1 and queue.get_stats()["scheduled_retries"] == 1
+        assert queue.put_messages([Message(f"m{i}", "me", "peer", "text", {"text": str(i)}) for i in (1, 2, 3)]) == 2
+
+        deadline = time.time() + 5
+        while len(sent) < 3 and time.time() < deadline:
+            time.sleep(0.02)
+        queue.stop()
+        assert sent == ["m0", "m1", "m2"]  # the retry was not overtaken
+        assert queue.get_stats()["queue_size"] == 0
+
+    def test_timer_wheel_handles_delays_beyond_one_rotation(self):
+        wheel = TimerWheel(tick=1, slots=4)
+        wheel.schedule(2, "soon")
+        wheel.schedule(6, "later")
+        due = [wheel.advance() for _ in range(6)]
+        assert due[1] == ["soon"] and due[5] == ["later"]
+        assert sum(len(items) for items in due) == 2 and len(wheel) == 0
+
+    def test_outbox_survives_restart_compacts_and_is_bounded(self, tmp_path):
+        outbox = Outbox(str(tmp_path), max_per_recipient=50, compact_min_bytes=2000)
+        for i in range(60):
+            outbox.put("peer-a", {"text": str(i)})
+        outbox.put("peer-b", {"text": "b"})
+        assert outbox.get_stats()["rejected"] == 10
+
+        batch = outbox.peek("peer-a", 40)
+        outbox.ack("peer-a", batch[-1][0])
+        stats = outbox.get_stats()
+        assert stats["compactions"] == 1 and stats["log_bytes"] == stats["live_bytes"]
+        outbox.close()
+
+        reopened = Outbox(str(tmp_path))
+        assert [m["text"] for _, m in reopened.peek("peer-a")] == [str(i) for i in range(40, 50)]
+        assert reopened.pending("peer-b") == 1
+
+        # Sent messages are held until their delivery ACK and acked in order once settled
+        held = [seq for seq, _ in reopened.peek("peer-a", 3)]
+        reopened.hold("peer-a", held)
+        assert reopened.pending("peer-a") == 7 and reopened.peek("peer-a", 1)[0][1]["text"] == "43"
+        reopened.settle("peer-a", held[1])
+        assert reopened.get_stats()["held"] == 3  # the first one is still unacknowledged
+        reopened.settle("peer-a", held[0])
+        assert reopened.get_stats()["held"] == 1 and reopened.peek("peer-a", 1)[0][1]["text"] == "43"
+        reopened.close()
+        # A hold is not persisted: after a restart the unacknowledged message is sent again
+        reopened = Outbox(str(tmp_path))
+        assert reopened.peek("peer-a", 1)[0][1]["text"] == "42"
+        # Sequence numbers keep increasing after a restart
+        reopened.put("peer-a", {"text": "new"})
+        assert reopened.peek("peer-a", 100)[-1][0] > batch[-1][0]
+
+    def test_delivery_acks_are_cumulative_and_retransmit_only_gaps(self):
+        retransmitted = []
+        sender = DeliveryTracker(send_ack=lambda *_: True,
+                                 retransmit=lambda peer, items: retransmitted.extend(items) or True)
+        acks = []
+        receiver = DeliveryTracker(send_ack=lambda peer, content: acks.append(content) or True,
+                                   retransmit=lambda *_: True)
+        messages = [Message(f"m{i}", "a", "b", "text", {"text": str(i)}) for i in range(5)]
+        fields = [sender.track("b", message) for message in messages]
+
+        for index in (0, 1, 3, 4):  # seq 3 is lost
+            assert receiver.on_receive("a", fields[index])
+        assert not receiver.on_receive("a", fields[0])  # duplicate
+        receiver.flush_acks()
+        assert acks == [{"epoch": sender.epoch, "ack": 2, "missing": [[3, 3]]}]
+
+        sender.on_ack("b", acks[-1])
+        assert [m.status for m in messages[:2]] == ["delivered", "delivered"]
+        assert [seq for seq, _ in retransmitted] == [3]
+
+        assert receiver.on_receive("a", sender.delivery_field("b", 3))
+        receiver.flush_acks()
+        sender.on_ack("b", acks[-1])
+        stats = sender.get_stats()
+        assert acks[-1]["ack"] == 5 and stats["unacked"] == 0
+        assert stats["delivered"] == 5 and stats["retransmitted"] == 1
+        assert receiver.get_stats()["duplicates"] == 1
+
+        # A peer that never comes back holds at most max_unacked messages
+        failed = []
+        capped = DeliveryTracker(send_ack=lambda *_: True, retransmit=lambda *_: False,
+                                 on_status=lambda peer, message: failed.append(message.message_id), max_unacked=3)
+        for message in messages:
+            capped.track("gone", message)
+        assert capped.get_stats()["unacked"] == 3 and failed == ["m0", "m1"]
+        assert capped.untrack("gone", 5) and not capped.untrack("gone", 5)
+
+    def test_message_queue_watermarks_shape_producers(self):
+        queue = MessageQueue(max_size=10, num_workers=1, low_watermark=5)
+        for i in range(10):
+            assert queue.put_message(Message(f"m{i}", "me", f"peer-{i}", "text", {"text": str(i)}))
+        stats = queue.get_stats()
+        assert stats["saturated"] and stats["high_watermark"] == 10
+        assert not queue.put_message(Message("late", "me", "peer-x", "text", {"text": "x"}))
+        assert queue.retry_after() == 60  # nothing drained yet, so no rate estimate
+
+        queue.start(lambda message: time.sleep(0.02))
+        started = time.time()
+        assert queue.put_message(Message("waited", "me", "peer-y", "text", {"text": "y"}), timeout=5)
+        assert time.time() - started < 1  # admitted once the depth fell to the low watermark
+        assert queue.get_stats()["queue_size"] <= 6 and not queue.get_stats()["saturated"]
+        queue.stop()
+
+    def test_message_queue_coalesces_per_recipient_batches(self):
+        queue = MessageQueue(max_size=100, num_workers=1, max_batch=8)
+        messages = [Message(f"m{i}", "me", "peer-a" if i % 2 else "peer-b", "text", {"text": str(i)})
+                    for i in range(20)]
+        assert queue.put_messages(messages[:15]) == 15
+        batches = []
+        queue.start(lambda message: batches.append([message.message_id]),
+                    lambda batch: batches.append([message.message_id for message in batch]))
+        deadline = time.time() + 5
+        while sum(len(batch) for batch in batches) < 15 and time.time() < deadline:
+            time.sleep(0.01)
+        queue.stop()
+
+        assert max(len(batch) for batch in batches) == 8
+        sent = [message_id for batch in batches for message_id in batch]
+        assert [m for m in sent if int(m[1:]) % 2] == [f"m{i}" for i in range(1, 15, 2)]  # order kept
+        assert queue.get_stats()["messages_processed"] == 15
+
+        full = MessageQueue(max_size=10)
+        assert full.put_messages(messages) == 10 and full.get_stats()["saturated"]
+        assert full.put_messages(messages[:1]) == 0
+
+    def test_file_manager_writes_chunks_at_offsets_and_renames_on_completion(self, tmp_path):
+        manager = FileManager(str(tmp_path / "files"))
+        data = bytes(range(256)) * 40  # 10240 bytes -> 3 chunks of 4096
+        assert manager.register_file("f1", "f.bin", len(data), "application/octet-stream", "peer",
+                                     chunk_size=4096)
+        part = tmp_path / "files" / "f1.part"
+        assert part.stat().st_size == len(data)  # preallocated up front
+
+        assert manager.add_chunk("f1", 2, data[8192:], True)
+        assert manager.add_chunk("f1", 0, data[:4096], False)
+        assert manager.add_chunk("f1", 0, data[:4096], False)  # duplicate is harmless
+        assert not manager.add_chunk("f1", 3, b"x", False)  # past the end of the file
+        assert manager.get_partial_file("f1") == data[:4096]
+        assert not manager.complete_file("f1")  # chunk 1 is still missing
+
+        assert manager.add_chunk("f1", 1, data[4096:8192], False)
+        assert manager.get_file_info("f1")["chunks_received"] == 3
+        assert manager.complete_file("f1")
+        assert not part.exists() and manager.get_file("f1") == data
+        assert not manager.register_file("../evil", "x", 1, "text/plain", "peer")
+        # Only broadcast files are offered to swarm peers
+        assert not manager.is_shared("f1")
+        assert manager.register_file("b1", "b.bin", 10, "application/octet-stream", "peer", shared=True)
+        assert manager.is_shared("b1") and not manager.is_shared("unknown")
+        # Tiny chunks would make the received-chunk bitmap grow with the file
+        assert not manager.register_file("f2", "f.bin", 64 * 1024 * 1024, "application/octet-stream", "peer",
+                                         chunk_size=1)
+        assert not (tmp_path / "files" / "f2.part").exists()
+
+    def test_chunk_stream_reads_paths_in_bounded_chunks(self, tmp_path):
+        data = bytes(range(256)) * 1000 + b"tail"
+        path = tmp_path / "big.bin"
+        path.write_bytes(data)
+
+        with chunk_stream(data, 1000) as (size, chunks):
+            from_memory = [bytes(chunk) for chunk in chunks]
+        with chunk_stream(str(path), 1000) as (size_on_disk, chunks):
+            views = []
+            from_disk = []
+            for chunk in chunks:
+                views.append(chunk.obj)
+                from_disk.append(bytes(chunk))
+
+        assert size == size_on_disk == len(data)
+        assert from_disk == from_memory and len(from_disk[-1]) == len(data) % 1000
+        assert len({id(buffer) for buffer in views}) == 1  # one reused read-ahead buffer
+
+    def test_file_manager_stores_streams_with_size_and_hash(self, tmp_path):
+        import hashlib
+        import io
+
+        manager = FileManager(str(tmp_path / "files"))
+        data = b"0123456789" * 300000  # spans several copy chunks
+        assert manager.store_stream(io.BytesIO(data), "up1", "up.bin", "application/octet-stream", "me")
+        info = manager.get_file_info("up1")
+        assert info["file_size"] == len(data) and info["sha256"] == hashlib.sha256(data).hexdigest()
+        assert manager.get_file("up1") == data
+        assert manager.wait_for_ingest()
+        # Dedup is off by default, so the upload stays a single file on disk
+        assert sorted(p.name for p in (tmp_path / "files").iterdir()) == ["chunks", "metadata.json", "up1"]
+        assert manager.get_file("up1") == data
+
+    def test_file_manager_resumes_partial_transfers_after_restart(self, tmp_path):
+        import json
+
+        storage = str(tmp_path / "files")
+        manager = FileManager(storage)
+        data = bytes(range(256)) * 64  # 16384 bytes -> 4 chunks of 4096
+        assert manager.register_file("f1", "f.bin", len(data), "application/octet-stream", "peer",
+                                     chunk_size=4096)
+        assert manager.add_chunk("f1", 0, data[:4096], False)
+        assert manager.add_chunk("f1", 3, data[12288:], True)
+        manager.close()
+
+        reopened = FileManager(storage)
+        assert reopened.incomplete_transfers("peer") == ["f1"]
+        assert reopened.missing_ranges("f1") == [[1, 2]]
+        assert reopened.add_chunk("f1", 1, data[4096:8192], False)
+        assert reopened.add_chunk("f1", 2, data[8192:12288], False)
+        assert reopened.complete_file("f1") and reopened.get_file("f1") == data
+        assert not (tmp_path / "files" / "f1.bitmap").exists()
+
+        source = tmp_path / "src.bin"
+        source.write_bytes(data)
+        reopened.register_outgoing("out1", source, ["a", "b"], len(data), 4096)
+        assert FileManager(storage).get_outgoing("out1", "a")["file_size"] == len(data)
+        reopened.finish_outgoing("out1", "a")
+        assert reopened.get_outgoing("out1", "a") is None and reopened.get_outgoing("out1", "b")
+        reopened.finish_outgoing("out1", "b")
+        assert "out1" not in FileManager(storage).outgoing
+
+        # Unfinished incoming files expire, on restart and when another transfer registers
+        long_ago = "2000-01-01T00:00:00"
+        for file_id in ("old1", "old2"):
+            assert reopened.register_file(file_id, "f.bin", len(data), "application/octet-stream", "peer",
+                                          chunk_size=4096)
+        reopened.close()
+        metadata = json.loads((tmp_path / "files" / "metadata.json").read_text())
+        metadata["old1"]["created_at"] = long_ago
+        (tmp_path / "files" / "metadata.json").write_text(json.dumps(metadata))
+        restarted = FileManager(storage)
+        assert restarted.incomplete_transfers("peer") == ["old2"]
+        assert not (tmp_path / "files" / "old1.part").exists()
+        restarted.files["old2"]["created_at"] = long_ago
+        assert restarted.register_file("new", "f.bin", len(data), "application/octet-stream", "peer",
+                                       chunk_size=4096)
+        assert restarted.incomplete_transfers("peer") == ["new"]
+        assert not (tmp_path / "files" / "old2.part").exists()
+
+    def test_chunk_store_deduplicates_edited_files_and_transfers(self, tmp_path, monkeypatch):
+        import io
+        import random
+
+        import backend.chunk_store as chunk_store
+
+        rng = random.Random(45)
+        data = bytes(rng.getrandbits(8) for _ in range(600000))
+        edited = data[:250000] + b"inserted" + data[250000:]
+        original_chunks = set(cdc_chunks(io.BytesIO(data)))
+        edited_chunks = list(cdc_chunks(io.BytesIO(edited)))
+        assert b"".join(edited_chunks) == edited
+        assert all(MIN_CHUNK_SIZE <= len(c) <= MAX_CHUNK_SIZE for c in edited_chunks[:-1])
+        # Only the chunk(s) around the insertion differ
+        assert len([c for c in edited_chunks if c not in original_chunks]) <= 2
+        if chunk_store.np is not None:
+            # The vectorized rolling hash cuts exactly where the byte-by-byte one does
+            monkeypatch.setattr(chunk_store, "np", None)
+            assert list(cdc_chunks(io.BytesIO(edited))) == edited_chunks
+            monkeypatch.undo()
+
+        sender = FileManager(str(tmp_path / "sender"), dedup=True)
+        assert sender.save_file("v1", data, "v1.bin", "application/octet-stream", "me")
+        assert sender.save_file("v2", edited, "v2.bin", "application/octet-stream", "me")
+        assert sender.wait_for_ingest()
+        stats = sender.get_stats()["chunk_store"]
+        assert stats["logical_bytes"] == len(data) + len(edited) and stats["bytes_saved"] > len(data) // 2
+        assert sender.get_file("v2") == edited
+
+        # A receiver that already has v1 only needs the chunks around the edit
+        receiver = FileManager(str(tmp_path / "receiver"), dedup=True)
+        assert receiver.save_file("old", data, "v1.bin", "application/octet-stream", "peer")
+        assert receiver.wait_for_ingest()
+        manifest = sender.get_manifest("v2")
+        assert receiver.register_file("new", "v2.bin", len(edited), "application/octet-stream", "peer",
+                                      chunk_size=4096, manifest=manifest)
+        assert receiver.fill_from_store("new") > len(edited) // 2
+        for start, end in receiver.missing_ranges("new", cover_tail=True):
+            for index in range(start, end + 1):
+                receiver.add_chunk("new", index, edited[index * 4096:(index + 1) * 4096], False)
+        assert receiver.complete_file("new") and receiver.wait_for_ingest()
+        assert receiver.get_file("new") == edited and receiver.get_manifest("new") == manifest
+
+        chunks_before = receiver.get_stats()["chunk_store"]["chunks"]
+        assert receiver.delete_file("old") and receiver.delete_file("new")
+        assert receiver.get_stats()["chunk_store"]["chunks"] == 0 < chunks_before
+        assert not list((tmp_path / "receiver" / "chunks").glob("*/*"))
+
+    def test_merkle_proofs_reject_tampered_chunks(self, tmp_path):
+        chunks = [bytes([i]) * 4096 for i in range(7)]
+        tree = MerkleTree.from_chunks(chunks)
+        for i, chunk in enumerate(chunks):
+            assert verify_proof(leaf_hash(chunk), i, len(chunks), tree.proof(i), tree.root)
+        assert not verify_proof(leaf_hash(b"x" * 4096), 3, len(chunks), tree.proof(3), tree.root)
+        assert not verify_proof(leaf_hash(chunks[3]), 4, len(chunks), tree.proof(3), tree.root)
+        assert not verify_proof(leaf_hash(chunks[3]), 3, len(chunks), tree.proof(3)[:-1], tree.root)
+
+        manager = FileManager(str(tmp_path / "files"))
+        data = b"".join(chunks)
+        assert manager.register_file("f", "f.bin", len(data), "application/octet-stream", "peer",
+                                     chunk_size=4096, merkle_root=tree.root)
+        assert not manager.verify_chunk("f", 2, b"y" * 4096, tree.proof(2))
+        assert manager.get_stats()["chunks_rejected"] == 1
+        for i, chunk in enumerate(chunks):
+            assert manager.verify_chunk("f", i, chunk, tree.proof(i))
+            assert manager.add_chunk("f", i, chunk, i == len(chunks) - 1)
+        assert manager.complete_file("f") and manager.get_file("f") == data
+
+    def test_spans_adapt_to_goodput_and_verify_chunk_by_chunk(self, tmp_path):
+        limit = span_limit(4096, 1024 * 1024)
+        assert limit % 4096 == 0 and limit * 4 // 3 < 1024 * 1024
+        sizer = ChunkSizer(4096, limit, rtt=0.05)
+        assert sizer.chunks() == 1
+        for _ in range(ADAPT_SPANS * 10):  # fast link: spans double per window up to the limit
+            sizer.record(sizer.size, sizer.size / 50e6)
+        assert sizer.size == limit
+        sizes = [sizer.size]
+        for _ in range(ADAPT_SPANS * 20):  # slow link: shrinks, at most halving per window
+            sizer.record(sizer.size, sizer.size / 20e3)
+            sizes.append(sizer.size)
+        assert all(b >= a // 2 // 4096 * 4096 for a, b in zip(sizes, sizes[1:]))
+        assert sizer.size == 4096
+        assert ChunkSizer(4096, limit, rtt=0.05, goodput=200e3).size == 8192
+
+        chunks = [bytes([i]) * 4096 for i in range(7)]
+        tree = MerkleTree.from_chunks(chunks)
+        manager = FileManager(str(tmp_path / "files"))
+        data = b"".join(chunks)
+        assert manager.register_file("f", "f.bin", len(data), "application/octet-stream", "peer",
+                                     chunk_size=4096, merkle_root=tree.root, max_chunk_size=4 * 4096)
+        tampered = chunks[0] + b"z" * 4096 + chunks[2] + chunks[3]
+        proofs = [tree.proof(i) for i in range(4)]
+        assert manager.add_span("f", 0, tampered, False, proofs) == ([0, 2, 3], [1])
+        assert manager.add_span("f", 1, b"".join(chunks[1:4]), False, proofs[1:]) == ([1, 2, 3], [])
+        assert manager.add_span("f", 4, b"".join(chunks[4:]), True, [tree.proof(i) for i in range(4, 7)]) \
+            == ([4, 5, 6], [])
+        assert manager.complete_file("f") and manager.get_file("f") == data
+
+    def test_swarm_schedules_rarest_blocks_and_reassigns_slow_sources(self):
+        chunk = 1000
+        total = 4 * BLOCK_CHUNKS
+        swarm = SwarmDownload("f", total * chunk, chunk, range(total), strategy="rarest")
+        swarm.add_source("full", [[0, total - 1]])
+        swarm.add_source("tail", [[2 * BLOCK_CHUNKS, total - 1]])
+        requests = swarm.schedule(now=0.0)
+        # Blocks 0 and 1 only exist at "full", so it fetches those and "tail" the others
+        assert requests == [("full", [[0, BLOCK_CHUNKS - 1]]), ("full", [[BLOCK_CHUNKS, 2 * BLOCK_CHUNKS - 1]]),
+                            ("tail", [[2 * BLOCK_CHUNKS, 3 * BLOCK_CHUNKS - 1]]), ("tail", [[3 * BLOCK_CHUNKS, total - 1]])]
+
+        # "full" finishes its blocks quickly; "tail" sends one chunk and goes slow
+        for index in range(2 * BLOCK_CHUNKS):
+            swarm.received("full", index, chunk, now=0.1)
+        swarm.received("tail", 2 * BLOCK_CHUNKS, chunk, now=1.0)
+        # Nothing is left unassigned, so the idle fast source takes over the slow one's blocks
+        assert swarm.schedule(now=1.0) == [("full", [[3 * BLOCK_CHUNKS, total - 1]]),
+                                           ("full", [[2 * BLOCK_CHUNKS + 1, 3 * BLOCK_CHUNKS - 1]])]
+        assert swarm.stats["blocks_reassigned"] == 2 and not swarm.sources["tail"].blocks
+
+        for index in range(2 * BLOCK_CHUNKS + 1, total):
+            swarm.received("full", index, chunk, now=1.2)
+        assert swarm.done() and not swarm.received("tail", total - 1, chunk)
+
+        # A source that stops sending loses its block, and after repeated stalls is dropped
+        swarm = SwarmDownload("g", BLOCK_CHUNKS * chunk, chunk, range(BLOCK_CHUNKS), strategy="fastest")
+        swarm.add_source("silent", [[0, BLOCK_CHUNKS - 1]])
+        now = 0.0
+        for _ in range(3):
+            assert swarm.schedule(now=now) or not swarm.sources
+            now += STALL_TIMEOUT + 1
+        swarm.schedule(now=now)
+        assert "silent" not in swarm.sources and not swarm.can_finish()
+
+    def test_transfer_manager_runs_jobs_by_priority_with_pause_and_cancel(self):
+        manager = TransferManager(max_concurrent=1)
+        gate = threading.Event()
+        order = []
+
+        def transfer(name, chunks=5):
+            def run(job):
+                order.append(name)
+                for i in range(chunks):
+                    job.checkpoint(i * 100)
+                    gate.wait(5)
+                return True
+            return run
+
+        first = manager.submit("send", "f1", "first", "peer", 500, transfer("first"))
+        low = manager.submit("send", "f2", "low", "peer", 500, transfer("low"), priority=9)
+        high = manager.submit("send", "f3", "high", "peer", 500, transfer("high"), priority=1)
+        doomed = manager.submit("send", "f4", "doomed", "peer", 500, transfer("doomed"))
+        assert [j["state"] for j in manager.list_jobs()] == ["queued", "queued", "queued", "running"]
+        assert manager.cancel(doomed.transfer_id) and doomed.state == "cancelled"
+
+        # Pausing the running job frees its slot for the highest priority waiting job
+        assert manager.pause(first.transfer_id) and high.state == "running"
+        assert manager.resume(first.transfer_id) and first.state == "queued"
+        gate.set()
+        assert manager.wait(low.transfer_id, timeout=5) == "completed"
+        assert first.state == high.state == "completed" and order == ["first", "high", "low"]
+        assert first.to_dict()["bytes_done"] == 500 and manager.get_stats()["completed"] == 3
+
+        # Cancelling a running job stops it at its next checkpoint
+        gate.clear()
+        running = manager.submit("download", "f5", "big", None, 500, transfer("big"))
+        time.sleep(0.05)
+        assert manager.cancel(running.transfer_id)
+        gate.set()
+        assert manager.wait(running.transfer_id, timeout=5) == "cancelled"
+        assert manager.get_stats()["running"] == 0
+
+    def test_file_response_serves_ranges_and_conditional_requests(self, tmp_path):
+        from starlette.applications import Starlette
+        from starlette.routing import Route
+        from starlette.testclient import TestClient
+
+        assert parse_range("bytes=0-9,5-19,-5", 100) == [(0, 19), (95, 99)]
+        assert parse_range("bytes=200-", 100) == [] and parse_range("items=0-1", 100) is None
+
+        data = bytes(range(256)) * 4000
+        path = tmp_path / "video.mp4"
+        path.write_bytes(data)
+        app = Starlette(routes=[Route("/f", lambda request: file_response(request, path, "video/mp4", "v.mp4"))])
+        client = TestClient(app)
+
+        full = client.get("/f")
+        assert full.status_code == 200 and full.content == data
+        etag = full.headers["etag"]
+
+        single = client.get("/f", headers={"Range": "bytes=1000-1999"})
+        assert single.status_code == 206 and single.content == data[1000:2000]
+        assert single.headers["content-range"] == f"bytes 1000-1999/{len(data)}"
+
+        multi = client.get("/f", headers={"Range": "bytes=0-9,-10"})
+        assert multi.status_code == 206 and multi.headers["content-type"].startswith("multipart/byteranges")
+        assert data[:10] in multi.content and data[-10:] in multi.content
+        assert int(multi.headers["content-length"]) == len(multi.content)
+
+        assert client.get("/f", headers={"Range": f"bytes={len(data)}-"}).status_code == 416
+        assert client.get("/f", headers={"If-None-Match": etag}).status_code == 304
+        assert client.get("/f", headers={"If-Modified-Since": full.headers["last-modified"]}).status_code == 304
+        stale = client.get("/f", headers={"Range": "bytes=0-0", "If-Range": '"old"'})
+        assert stale.status_code == 200 and len(stale.content) == len(data)
+
+        # A file still arriving is served up to its received prefix, never past it
+        manager = FileManager(str(tmp_path / "files"))
+        assert manager.register_file("p", "p.mp4", len(data), "video/mp4", "peer", chunk_size=4096)
+        assert manager.add_chunk("p", 0, data[:4096], False) and manager.add_chunk("p", 2, data[8192:12288], False)
+        part_path, length = manager.get_partial_prefix("p")
+        assert length == 4096
+        app = Starlette(routes=[Route("/p", lambda request: prefix_response(request, part_path, length, "video/mp4"))])
+        client = TestClient(app)
+        assert client.get("/p").content == data[:4096]
+        tail = client.get("/p", headers={"Range": "bytes=4000-9000"})
+        assert tail.status_code == 206 and tail.content == data[4000:4096]
+        assert tail.headers["content-range"] == "bytes 4000-4095/4096"
+        assert client.get("/p", headers={"Range": "bytes=5000-"}).status_code == 416
@@ -0,0 +1,163 @@
+import pytest
+import json
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+
+# Ensure the src package is importable when running tests without installation
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+SRC_PATH = PROJECT_ROOT / "src"
+if str(SRC_PATH) not in sys.path:
+    sys.path.insert(0, str(SRC_PATH))
+
+from core.bandwidth import BandwidthShaper
+from core.connection_manager import ConnectionManager
+from core.dispatcher import ShardedDispatcher
+from core.message_protocol import MessageProtocol, Capability
+
+
+class TestProtocol:
+    """Tests for wire protocol extensions"""
+
+    def test_handshake_advertises_capabilities(self):
+        handshake = json.loads(MessageProtocol.create_handshake("peer-a", {"port": 5000}))
+        assert handshake["content"]["port"] == 5000
+        assert set(handshake["content"]["capabilities"]) == set(MessageProtocol.CAPABILITIES)
+
+        legacy = json.loads(MessageProtocol.create_handshake("peer-b", {}, capabilities=[]))
+        assert legacy["content"]["capabilities"] == []
+
+    def test_capability_negotiation(self):
+        # Legacy peers send nothing, unknown features are ignored
+        assert MessageProtocol.negotiate_capabilities(None) == set()
+        assert MessageProtocol.negotiate_capabilities(["future_feature"]) == set()
+        negotiated = MessageProtocol.negotiate_capabilities(
+            [Capability.ZLIB_CHUNKS.value, "future_feature"]
+        )
+        assert negotiated == {Capability.ZLIB_CHUNKS.value}
+
+        cm = ConnectionManager()
+        sock1, sock2 = socket.socketpair()
+        cm.add_connection(sock1, ("test", 1), "peer2")
+        assert not cm.peer_supports("peer2", Capability.ZLIB_CHUNKS)
+        assert cm.set_peer_capabilities("peer2", negotiated)
+        assert cm.peer_supports("peer2", Capability.ZLIB_CHUNKS)
+        assert not cm.set_peer_capabilities("unknown", negotiated)
+        cm.remove_connection("peer2")
+        sock2.close()
+
+    def test_oversized_frames_dropped_before_decoding(self):
+        received = []
+        cm = ConnectionManager(lambda peer_id, raw: received.append(raw), max_message_size=1024)
+        sock1, sock2 = socket.socketpair()
+        cm.add_connection(sock1, ("test", 1), "peer2")
+
+        # One frame spans several reads, then a normal frame follows it
+        sock2.sendall(b"x" * 5000)
+        time.sleep(0.1)
+        sock2.sendall(b"x" * 100 + b"\nsmall\n")
+        time.sleep(0.3)
+
+        assert received == ["small"]
+        assert cm.get_stats()["oversized_frames"] == 1
+        cm.remove_connection("peer2")
+        sock2.close()
+
+    def test_bandwidth_shaping_per_level_and_class(self):
+        shaper = BandwidthShaper(config_path=None)
+        assert shaper.delay("peer2", "bulk", 10 ** 9) == 0  # unlimited by default
+
+        cm = ConnectionManager(shaper=shaper)
+        sock1, sock2 = socket.socketpair()
+        cm.add_connection(sock1, ("test", 1), "peer2")
+        shaper.set_limits(peer_rate=20000, burst_seconds=0.5)
+
+        # 10KB of burst goes at once; the next 10KB waits ~0.5s for the peer's bucket
+        start = time.monotonic()
+        assert cm.send_message("peer2", b"x" * 9999, traffic_class="bulk")
+        assert time.monotonic() - start < 0.1
+        assert cm.send_message("peer2", b"x" * 9999, traffic_class="bulk")
+        assert 0.4 < time.monotonic() - start < 1.0
+        # Control frames are charged but never wait
+        assert cm.send_message("peer2", b"ack", traffic_class="control")
+        assert shaper.delay("peer2", "control", 5000) == 0 and shaper.delay("peer2", "bulk", 1) > 0
+
+        # An override exempts one peer; a class limit caps that class for every peer
+        shaper.set_limits(peer_rates={"peer2": 0}, class_rates={"bulk": 1000})
+        assert shaper.delay("peer2", "message", 100000) == 0
+        assert shaper.delay("peer3", "bulk", 5000) > 0
+        shaper.set_limits(peer_rates={"peer2": None}, class_rates={"bulk": 0}, peer_rate=0, global_rate=1000)
+        assert shaper.delay("peer2", "message", 5000) > 0 and not shaper.get_limits()["peer_rates"]
+        with pytest.raises(ValueError):
+            shaper.set_limits(class_rates={"control": 10})
+        with pytest.raises(ValueError):
+            shaper.set_limits(global_rate=-1)
+        assert shaper.get_limits()["global_rate"] == 1000
+
+        stats = shaper.get_stats()
+        assert stats["bytes_sent"]["bulk"] >= 20000 and stats["throttle_events"] >= 4
+        cm.remove_connection("peer2")
+        assert stats["tracked_peers"] == 2 and shaper.get_stats()["tracked_peers"] == 1
+        sock2.close()
+
+    def test_blocked_send_does_not_stall_other_peers(self):
+        cm = ConnectionManager()
+        slow, slow_remote = socket.socketpair()
+        fast, fast_remote = socket.socketpair()
+        cm.add_connection(slow, ("slow", 1), "slow")
+        cm.add_connection(fast, ("fast", 1), "fast")
+
+        # "slow" never reads, so this write fills its socket buffer and blocks
+        results = []
+        writer = threading.Thread(target=lambda: results.append(cm.send_message("slow", b"x" * (8 * 1024 * 1024))))
+        writer.start()
+        time.sleep(0.2)
+        assert writer.is_alive()
+
+        sent = []
+        other = threading.Thread(target=lambda: sent.append(cm.send_message("fast", b"hello") and cm.get_stats()))
+        other.start()
+        other.join(timeout=0.5)
+        slow_remote.close()
+        assert sent and sent[0]
+        assert fast_remote.recv(100) == b"hello\n"
+
+        writer.join(timeout=5)
+        assert results == [False] and "slow" not in cm.get_active_connections()
+        cm.remove_connection("fast")
+        fast_remote.close()
+
+    def test_dispatcher_preserves_per_connection_order(self):
+        received = []
+        lock = threading.Lock()
+
+        def handler(peer_id, frames):
+            with lock:
+                received.extend((peer_id, frame) for frame in frames)
+
+        dispatcher = ShardedDispatcher(handler, num_workers=3)
+        dispatcher.start()
+        cm = ConnectionManager(dispatcher=dispatcher)
+        pairs = []
+        for i in range(3):
+            sock1, sock2 = socket.socketpair()
+            cm.add_connection(sock1, ("test", i), f"peer{i}")
+            pairs.append(sock2)
+
+        for n in range(200):
+            for sock in pairs:
+                sock.sendall(f"{n}\n".encode())
+        time.sleep(0.5)
+
+        for i in range(3):
+            frames = [int(frame) for peer_id, frame in received if peer_id == f"peer{i}"]
+            assert frames == list(range(200))
+        stats = dispatcher.get_stats()
+        assert stats["frames"] == 600
+        assert stats["batches"] <= 600
+
+        for i in range(3):
+            cm.remove_connection(f"peer{i}")
+        dispatcher.stop()
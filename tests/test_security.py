@@ -0,0 +1,204 @@
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+# Ensure the src package is importable when running tests without installation
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+SRC_PATH = PROJECT_ROOT / "src"
+if str(SRC_PATH) not in sys.path:
+    sys.path.insert(0, str(SRC_PATH))
+
+from core.message_protocol import MessageProtocol
+from security.message_signer import MessageSigner
+from security.message_validator import MessageValidator
+from security.peer_identity import PeerIdentity
+from security.rate_limiter import RateLimiter
+from security.replay_cache import OVER_QUOTA, ReplayCache
+
+
+class TestSecurity:
+    """Tests for message validation and replay protection"""
+
+    def test_replay_cache_expires_by_generation(self):
+        cache = ReplayCache(window_seconds=30, capacity=1000, generations=4)
+        now = 1000.0
+
+        assert cache.add("msg-1", now) is True
+        assert cache.add("msg-1", now + 5) is False
+
+        # Still remembered just inside the window, forgotten once it has passed
+        assert cache.add("msg-1", now + 29) is False
+        assert cache.add("msg-1", now + 41) is True
+
+        stats = cache.get_stats()
+        assert stats["duplicates_rejected"] == 2
+        assert stats["memory_bytes"] == cache.num_bytes * 4
+        assert 0 <= stats["estimated_false_positive_rate"] < 1e-6
+
+    def test_replay_cache_memory_is_fixed(self):
+        cache = ReplayCache(window_seconds=30, capacity=300, generations=4)
+        for i in range(5000):
+            cache.add(f"msg-{i}", 1000.0)
+
+        # Overflowing a bucket rotates early instead of growing or clearing
+        stats = cache.get_stats()
+        assert stats["generations"] == 4
+        assert stats["early_rotations"] > 0
+        assert stats["entries"] <= 4 * cache.generation_capacity
+        assert cache.add("msg-4999", 1000.0) is False
+
+    def test_replay_cache_quota_keeps_one_sender_from_rotating(self):
+        cache = ReplayCache(window_seconds=30, capacity=300, generations=4, owner_share=0.25)
+        assert cache.add("victim", 1000.0)
+        refused = sum(cache.admit(f"flood-{i}", owner="flooder", now=1000.0) is not None for i in range(5000))
+
+        stats = cache.get_stats()
+        assert refused == 5000 - cache.owner_quota
+        assert stats["early_rotations"] == 0 and stats["quota_rejected"] == refused
+        assert cache.add("victim", 1000.0) is False
+        assert cache.admit("other", owner="someone-else", now=1000.0) is None
+        # The flooder's quota comes back when the bucket rotates on time
+        assert cache.admit("flood-later", owner="flooder", now=1011.0) is None
+
+    def test_validator_rejects_replays(self):
+        validator = MessageValidator(replay_capacity=1000)
+        message = {
+            "version": "1.0",
+            "type": "ping",
+            "sender_id": "test-peer",
+            "message_id": "msg-1",
+            "timestamp": time.time()
+        }
+
+        assert validator.validate_message(message) == (True, None)
+        assert validator.validate_message(message) == (False, "Duplicate message ID")
+
+        # Unauthenticated frames are not recorded until check_replay is called
+        message["message_id"] = "msg-2"
+        assert validator.validate_message(message, check_replay=False) == (True, None)
+        assert validator.validate_message(message, check_replay=False) == (True, None)
+        assert validator.check_replay(message) == (True, None)
+        assert validator.check_replay(message) == (False, "Duplicate message ID")
+
+        # The quota follows the connection, whatever sender_id its messages claim
+        quota = validator.replay_cache.owner_quota
+        for i in range(quota):
+            spoofed = dict(message, message_id=f"spoof-{i}", sender_id=f"claimed-{i}")
+            assert validator.check_replay(spoofed, "conn-1") == (True, None)
+        rotated = dict(message, message_id="spoof-more", sender_id="claimed-new")
+        assert validator.check_replay(rotated, "conn-1") == (False, OVER_QUOTA)
+        assert validator.check_replay(dict(message, message_id="real-1", sender_id="claimed-0"), "conn-2") == \
+            (True, None)
+
+    def test_schema_validation_per_type(self):
+        validator = MessageValidator(replay_capacity=1000)
+
+        def message(msg_type, content, message_id):
+            return {
+                "version": "1.0",
+                "type": msg_type,
+                "sender_id": "test-peer",
+                "message_id": message_id,
+                "timestamp": time.time(),
+                "content": content
+            }
+
+        good_chunk = {"file_id": "f1", "chunk_index": 0, "chunk_data": "aGVsbG8=", "is_last": True}
+        assert validator.validate_message(message("file_transfer_chunk", good_chunk, "m1")) == (True, None)
+
+        bad_chunks = [
+            {"file_id": "f1", "chunk_data": "aGVsbG8="},
+            {"file_id": "f1", "chunk_index": "0", "chunk_data": "aGVsbG8="},
+            {"file_id": "f1", "chunk_index": True, "chunk_data": "aGVsbG8="},
+            {"file_id": "f1", "chunk_index": -1, "chunk_data": "aGVsbG8="},
+            {"file_id": "f1", "chunk_index": 0, "chunk_data": "abc"},
+        ]
+        for i, content in enumerate(bad_chunks):
+            is_valid, error = validator.validate_message(message("file_transfer_chunk", content, f"bad-{i}"))
+            assert is_valid is False and error
+
+        request = {"file_id": "f1", "filename": "f.bin", "file_size": 64 * 1024 * 1024,
+                   "mime_type": "application/octet-stream", "chunk_size": 1}
+        assert validator.validate_message(message("file_transfer_request", request, "tiny")) == \
+            (False, "Invalid chunk_size")
+
+        is_valid, error = validator.validate_message(message("text", {"text": "x" * 20000}, "long"))
+        assert is_valid is False
+        assert error == "Text message too long"
+
+        stats = validator.get_stats()["types"]["file_transfer_chunk"]
+        assert stats["validated"] == 1
+        assert stats["rejected"] == len(bad_chunks)
+        assert stats["avg_validation_us"] > 0
+
+    def test_rate_limiter_backpressure(self):
+        limiter = RateLimiter(config_path=None)
+        assert limiter.message_delay("peer-1") == 0  # disabled by default
+
+        limiter.set_limits(enabled=True, max_messages_per_minute=600, burst_seconds=1)
+        # Burst of 10 messages passes, the next one has to wait ~0.1s
+        delays = [limiter.message_delay("peer-1") for _ in range(11)]
+        assert delays[:10] == [0.0] * 10
+        assert 0 < delays[10] <= 0.11
+
+        # Other peers have their own budget
+        assert limiter.message_delay("peer-2") == 0
+
+        # Limits apply to existing buckets at runtime
+        limiter.set_limits(max_messages_per_minute=0)
+        assert limiter.message_delay("peer-1") == 0
+
+        # A rejected update changes nothing, not even the fields before the bad one
+        before = limiter.get_limits()
+        with pytest.raises(ValueError):
+            limiter.set_limits(enabled=False, max_messages_per_minute=60, max_bytes_per_minute=-1)
+        assert limiter.get_limits() == before
+
+        limiter.rename_peer("peer-2", "real-peer")
+        assert "real-peer" in limiter.buckets["max_messages_per_minute"]
+        assert limiter.get_stats()["throttle_events"] == 1
+
+    def test_message_signatures(self, tmp_path, monkeypatch):
+        sender = PeerIdentity(str(tmp_path / "sender.json"))
+        receiver = PeerIdentity(str(tmp_path / "receiver.json"))
+        signer = MessageSigner(sender, config_path=None)
+        verifier = MessageSigner(receiver, config_path=None)
+
+        # Signing key must be bound to the sender's peer ID
+        peer_info = {"public_key": sender.get_public_key_string(), **signer.handshake_fields()}
+        assert verifier.register_peer_key(receiver.peer_id, peer_info, True) is False
+        assert verifier.register_peer_key(sender.peer_id, peer_info, True) is True
+        assert verifier.register_peer_key(sender.peer_id, peer_info, True) is True
+        assert verifier.get_stats()["key_verifications"] == 2
+        assert verifier.get_stats()["key_cache_hits"] == 1
+
+        frame = MessageProtocol.create_text_message(sender.peer_id, receiver.peer_id, "hi")
+        signed = signer.sign_frame(frame)
+        assert MessageProtocol.decode_message(signed)["content"]["text"] == "hi"
+
+        payload, signature = MessageProtocol.split_signature(signed)
+        assert payload == frame
+        assert verifier.verify_frame(sender.peer_id, payload, signature) == (True, None)
+
+        tampered = payload.replace(b'"hi"', b'"yo"')
+        assert verifier.verify_frame(sender.peer_id, tampered, signature)[0] is False
+        # A peer that advertised signing cannot send unsigned messages
+        assert verifier.verify_frame(sender.peer_id, frame, None)[0] is False
+        assert verifier.verify_batch([(sender.peer_id, payload, signature),
+                                      (sender.peer_id, tampered, signature)]) == [
+            None, "Invalid message signature"]
+
+        # Signing keys persist with the identity
+        reloaded = PeerIdentity(str(tmp_path / "sender.json"))
+        assert reloaded.get_signing_public_key_string() == sender.get_signing_public_key_string()
+
+        # The verified-key cache keeps only the most recently used peers
+        monkeypatch.setattr("security.message_signer.MAX_VERIFIED_KEYS", 1)
+        other = PeerIdentity(str(tmp_path / "other.json"))
+        other_info = {"public_key": other.get_public_key_string(),
+                      **MessageSigner(other, config_path=None).handshake_fields()}
+        assert verifier.register_peer_key(other.peer_id, other_info, True) is True
+        assert list(verifier.verified_keys) == [other.peer_id]
+        assert sender.peer_id not in verifier.signing_peers